@@ -0,0 +1,36 @@
+from common import *
+from Domain import Domain
+from VirtConnWrapper import *
+
+
+class AsyncDomain:
+    # Domain for asyncio, the same calls and VirMessage results; at most
+    # parallel calls run at once, see AsyncRunner. Connect the pool with
+    # loop=asyncio.get_running_loop() to have libvirt's events on the loop
+    def __init__(self, conn: VirConnWrapper, parallel=None):
+        self.__domain = Domain(conn)
+        self.__runner = AsyncRunner(conn, parallel)
+
+    async def createDomain(self, name, uuid, cpu, memory, image_path, bridge, mac, port_name,
+                           domain_type='kvm') -> VirMessage:
+        return await self.__runner.run(self.__domain.createDomain, name, uuid, cpu, memory, image_path,
+                                       bridge, mac, port_name, domain_type)
+
+    async def createDomains(self, spec_list, worker_count=None) -> VirMessage:
+        return await self.__runner.run(self.__domain.createDomains, spec_list, worker_count)
+
+    async def removeDomain(self, name) -> VirMessage:
+        return await self.__runner.run(self.__domain.removeDomain, name)
+
+    async def getDomain(self, name) -> VirMessage:
+        return await self.__runner.run(self.__domain.getDomain, name)
+
+    async def getDomains(self, name_list) -> list:
+        # a VirMessage per name, fetched side by side
+        return await self.__runner.gather(self.__domain.getDomain, [(name,) for name in name_list])
+
+    async def getDomainList(self, *args, **kwargs) -> VirMessage:
+        return await self.__runner.run(self.__domain.getDomainList, *args, **kwargs)
+
+    def close(self):
+        self.__runner.close()
@@ -0,0 +1,49 @@
+from common import *
+from Storage import Storage
+from VirtConnWrapper import *
+
+
+class AsyncStorage:
+    # Storage for asyncio, the same calls and VirMessage results; at most
+    # parallel calls run at once, see AsyncRunner
+    def __init__(self, conn: VirConnWrapper, parallel=None):
+        self.__storage = Storage(conn)
+        self.__runner = AsyncRunner(conn, parallel)
+
+    async def createStoragePool(self, name, uuid, path) -> VirMessage:
+        return await self.__runner.run(self.__storage.createStoragePool, name, uuid, path)
+
+    async def removeStoragePool(self, name) -> VirMessage:
+        return await self.__runner.run(self.__storage.removeStoragePool, name)
+
+    async def getStoragePool(self, name) -> VirMessage:
+        return await self.__runner.run(self.__storage.getStoragePool, name)
+
+    async def getStoragePoolList(self) -> VirMessage:
+        return await self.__runner.run(self.__storage.getStoragePoolList)
+
+    async def createStorageVol(self, pool_name, name, capacity, path, owner, group) -> VirMessage:
+        return await self.__runner.run(self.__storage.createStorageVol, pool_name, name, capacity, path,
+                                       owner, group)
+
+    async def createStorageVols(self, pool_name, spec_list, worker_count=None) -> VirMessage:
+        return await self.__runner.run(self.__storage.createStorageVols, pool_name, spec_list, worker_count)
+
+    async def removeStorageVol(self, pool_name, name) -> VirMessage:
+        return await self.__runner.run(self.__storage.removeStorageVol, pool_name, name)
+
+    async def uploadStorageVol(self, pool_name, name, file_path) -> VirMessage:
+        return await self.__runner.run(self.__storage.uploadStorageVol, pool_name, name, file_path)
+
+    async def getStorageVol(self, pool_name, name) -> VirMessage:
+        return await self.__runner.run(self.__storage.getStorageVol, pool_name, name)
+
+    async def getStorageVols(self, pool_name, name_list) -> list:
+        # a VirMessage per volume name, fetched side by side
+        return await self.__runner.gather(self.__storage.getStorageVol, [(pool_name, name) for name in name_list])
+
+    async def getStorageVolList(self, pool_name) -> VirMessage:
+        return await self.__runner.run(self.__storage.getStorageVolList, pool_name)
+
+    def close(self):
+        self.__runner.close()
@@ -1,66 +1,123 @@
+import time
+
 import libvirt
 
 from common import *
 from VirtConnWrapper import *
 
+# virDomainState
+# VIR_DOMAIN_NOSTATE = 0
+# VIR_DOMAIN_RUNNING = 1
+# VIR_DOMAIN_BLOCKED = 2
+# VIR_DOMAIN_PAUSED = 3
+# VIR_DOMAIN_SHUTDOWN = 4
+# VIR_DOMAIN_SHUTOFF = 5
+# VIR_DOMAIN_CRASHED = 6
+# VIR_DOMAIN_PMSUSPENDED = 7
+state_to_string_map = [
+    'nostate',
+    'running',
+    'blocked',
+    'paused',
+    'shutdown',
+    'shutoff',
+    'crashed',
+    'pmsuspended',
+]
+
+# stat groups getDomainList reads by default, what __DomainDetail gets from
+# getCPUStats, memoryStats and info
+DOMAIN_DETAIL_STATS = (libvirt.VIR_DOMAIN_STATS_STATE | libvirt.VIR_DOMAIN_STATS_CPU_TOTAL |
+                       libvirt.VIR_DOMAIN_STATS_BALLOON | libvirt.VIR_DOMAIN_STATS_VCPU)
+
+# getAllDomainStats field -> getCPUStats(True, 0) key
+cpu_stats_key_map = {
+    'cpu.time': 'cpu_time',
+    'cpu.user': 'user_time',
+    'cpu.system': 'system_time',
+}
+
+# getAllDomainStats field -> memoryStats() key
+mem_stats_key_map = {
+    'balloon.current': 'actual',
+    'balloon.swap_in': 'swap_in',
+    'balloon.swap_out': 'swap_out',
+    'balloon.major_fault': 'major_fault',
+    'balloon.minor_fault': 'minor_fault',
+    'balloon.unused': 'unused',
+    'balloon.available': 'available',
+    'balloon.usable': 'usable',
+    'balloon.last-update': 'last_update',
+    'balloon.disk_caches': 'disk_caches',
+    'balloon.hugetlb_pgalloc': 'hugetlb_pgalloc',
+    'balloon.hugetlb_pgfail': 'hugetlb_pgfail',
+    'balloon.rss': 'rss',
+}
+
+
+# the keys of a createDomains spec, domain_type may be left out
+domain_spec_key_list = ['name', 'uuid', 'cpu', 'memory', 'image_path', 'bridge', 'mac', 'port_name']
+
 
 class Domain:
     def __init__(self, conn: VirConnWrapper):
-        self.__conn = conn.getConnect()
-
-    def createDomain(self, name, uuid, cpu, memory, image_path, bridge, mac, port_name) -> VirMessage:
-        xml_config = f'''
-            <domain type='kvm'>
-                <name>{name}</name>
-                <uuid>{uuid}</uuid>
-                <vcpu>{cpu}</vcpu>
-                <memory>{memory}</memory>
-                <os>
-                    <type arch="x86_64">hvm</type>
-                    <boot dev='hd'/>
-                </os>
-                <clock sync="localtime"/>
-                <on_poweroff>destroy</on_poweroff>
-                <on_reboot>restart</on_reboot>
-                <on_crash>destroy</on_crash>
-                <devices>
-                    <emulator>/usr/bin/kvm</emulator>
-                    <disk type='file' device='disk'>
-                        <driver name='qemu' type='qcow2'/>
-                        <source file='{image_path}'/>
-                        <target dev='vda' bus='virtio'/>
-                    </disk>
-                    <interface type='bridge'>
-                        <source bridge='{bridge}'/>
-                        <target dev='{port_name}'/>
-                        <mac address='{mac}'/>
-                        <virtualport type='openvswitch'/>
-                    </interface>
-                    <graphics type='vnc' port='-1'/>
-                    <serial type='pty'>
-                        <target type='isa-serial' port='0'>
-                            <model name='isa-serial'/>
-                        </target>
-                    </serial>
-                    <console type='pty'>
-                        <target type='serial' port='0'/>
-                    </console>
-                </devices>
-            </domain>
-        '''
-        
+        self.__conn_wrapper = conn
+
+    def getConnWrapper(self) -> VirConnWrapper:
+        return self.__conn_wrapper
+
+    # the connection checked out for the running call, see pooled
+    @property
+    def __conn(self) -> libvirt.virConnect:
+        return self.__conn_wrapper.getConnect()
+
+    @property
+    def __handle_cache(self) -> HandleCache:
+        return self.__conn_wrapper.getHandleCache()
+
+    @pooled
+    def createDomain(self, name, uuid, cpu, memory, image_path, bridge, mac, port_name,
+                     domain_type='kvm') -> VirMessage:
         if self.__findDomain(name) != None:
             return VirMessage(reason='dom already exists')
 
-        dom = self.__conn.defineXML(xml_config)
-        if dom == None:
-            return VirMessage(reason='Failed to define dom')
+        return self.__defineDomain(name, uuid, cpu, memory, image_path, bridge, mac, port_name, domain_type)
 
-        if dom.create() < 0:
-            return VirMessage(reason='Failed to activate dom')
+    def createDomains(self, spec_list, worker_count=None) -> VirMessage:
+        # createDomain for every spec (a dict of its keyword arguments), the
+        # names checked against one listing and the defines and starts run
+        # on worker_count threads (the pool size by default), each with its
+        # own connection. data has a VirMessage per spec, in order, and the
+        # wall times
+        start = time.perf_counter()
+        with self.__conn_wrapper.checkout():
+            name_set = {dom.name() for dom in self.__conn.listAllDomains()}
+        list_seconds = time.perf_counter() - start
 
-        return VirMessage(code=VirMessageCode.SUCCESS)
+        result_list = [None] * len(spec_list)
+        index_list = []
+        for i, spec in enumerate(spec_list):
+            reason = check_spec(spec, domain_spec_key_list, ['domain_type'])
+            if reason != None:
+                result_list[i] = VirMessage(reason=reason)
+            elif spec['name'] in name_set:
+                result_list[i] = VirMessage(reason='dom already exists')
+            else:
+                # a name twice in the batch is a conflict too
+                name_set.add(spec['name'])
+                index_list.append(i)
 
+        if worker_count == None:
+            worker_count = self.__conn_wrapper.getSize()
+        created_list = run_batch(lambda spec: self.__createDomain(**spec),
+                                 [spec_list[i] for i in index_list], worker_count)
+        for i, result in zip(index_list, created_list):
+            result_list[i] = result
+
+        return VirMessage(data=batch_data(result_list, worker_count, list_seconds, start),
+                          code=VirMessageCode.SUCCESS)
+
+    @pooled
     def removeDomain(self, name) -> VirMessage:
         dom = self.__findDomain(name)
         if dom == None:
@@ -70,9 +127,11 @@ class Domain:
             dom.destroyFlags(libvirt.VIR_DOMAIN_DESTROY_GRACEFUL)
 
         dom.undefine()
+        self.__handle_cache.dropDomain(name)
 
         return VirMessage(code=VirMessageCode.SUCCESS)
 
+    @pooled
     def getDomain(self, name) -> VirMessage:
         dom = self.__findDomain(name)
         if dom == None:
@@ -82,21 +141,93 @@ class Domain:
 
         return VirMessage(data=data, code=VirMessageCode.SUCCESS)
 
-    def getDomainList(self) -> VirMessage:
+    @pooled
+    def getDomainList(self, stats=DOMAIN_DETAIL_STATS, bulk=True) -> VirMessage:
+        # one getAllDomainStats call for every domain instead of three RPCs
+        # per domain; stats picks the VIR_DOMAIN_STATS_* groups, the fields
+        # of groups left out are None and the fields of groups beyond
+        # DOMAIN_DETAIL_STATS come as they are in data['stats']. Drivers
+        # without bulk stats (or bulk=False) take the per domain path
+        if bulk == True:
+            try:
+                record_list = self.__conn.getAllDomainStats(stats)
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT:
+                    return VirMessage(reason=f'Failed to get domain stats: {e}')
+                record_list = None
+
+            if record_list != None:
+                data = [Domain.__DomainStatsDetail(dom, record, stats) for dom, record in record_list]
+                return VirMessage(data=data, code=VirMessageCode.SUCCESS)
+
         dom_list = self.__conn.listAllDomains()
         data = [Domain.__DomainDetail(dom) for dom in dom_list]
 
         return VirMessage(data=data, code=VirMessageCode.SUCCESS)
 
+    @pooled
+    def __createDomain(self, name, uuid, cpu, memory, image_path, bridge, mac, port_name,
+                       domain_type='kvm') -> VirMessage:
+        return self.__defineDomain(name, uuid, cpu, memory, image_path, bridge, mac, port_name, domain_type)
+
+    def __defineDomain(self, name, uuid, cpu, memory, image_path, bridge, mac, port_name,
+                       domain_type) -> VirMessage:
+        xml_config = Domain.__DomainXML(name, uuid, cpu, memory, image_path, bridge, mac, port_name,
+                                        domain_type)
+        dom = self.__conn.defineXML(xml_config)
+        self.__handle_cache.dropDomain(name)
+        if dom == None:
+            return VirMessage(reason='Failed to define dom')
+
+        if dom.create() < 0:
+            return VirMessage(reason='Failed to activate dom')
+
+        return VirMessage(code=VirMessageCode.SUCCESS)
+
     def __findDomain(self, name) -> libvirt.virDomain:
-        dom_list = self.__conn.listAllDomains()
+        return self.__handle_cache.getDomain(name)
 
-        dom = None
-        for each in dom_list:
-            if each.name() == name:
-                dom = each
-                break
-        return dom
+    @staticmethod
+    def __DomainXML(name, uuid, cpu, memory, image_path, bridge, mac, port_name, domain_type) -> str:
+        return f'''
+        <domain type='{domain_type}'>
+            <name>{name}</name>
+            <uuid>{uuid}</uuid>
+            <vcpu>{cpu}</vcpu>
+            <memory>{memory}</memory>
+            <os>
+                <type arch="x86_64">hvm</type>
+                <boot dev='hd'/>
+            </os>
+            <clock sync="localtime"/>
+            <on_poweroff>destroy</on_poweroff>
+            <on_reboot>restart</on_reboot>
+            <on_crash>destroy</on_crash>
+            <devices>
+                <emulator>/usr/bin/kvm</emulator>
+                <disk type='file' device='disk'>
+                    <driver name='qemu' type='qcow2'/>
+                    <source file='{image_path}'/>
+                    <target dev='vda' bus='virtio'/>
+                </disk>
+                <interface type='bridge'>
+                    <source bridge='{bridge}'/>
+                    <target dev='{port_name}'/>
+                    <mac address='{mac}'/>
+                    <virtualport type='openvswitch'/>
+                </interface>
+                <graphics type='vnc' port='-1'/>
+                <serial type='pty'>
+                    <target type='isa-serial' port='0'>
+                        <model name='isa-serial'/>
+                    </target>
+                </serial>
+                <console type='pty'>
+                    <target type='serial' port='0'/>
+                </console>
+            </devices>
+        </domain>
+        '''
 
     @staticmethod
     def __DomainDetail(dom: libvirt.virDomain) -> dict:
@@ -105,27 +236,6 @@ class Domain:
         memStats = dom.memoryStats()
         info = dom.info()
 
-        # virDomainState
-        # VIR_DOMAIN_NOSTATE = 0
-        # VIR_DOMAIN_RUNNING = 1
-        # VIR_DOMAIN_BLOCKED = 2
-        # VIR_DOMAIN_PAUSED = 3
-        # VIR_DOMAIN_SHUTDOWN = 4
-        # VIR_DOMAIN_SHUTOFF = 5
-        # VIR_DOMAIN_CRASHED = 6
-        # VIR_DOMAIN_PMSUSPENDED = 7
-
-        state_to_string_map = [
-            'nostate',
-            'running',
-            'blocked',
-            'paused',
-            'shutdown',
-            'shutoff',
-            'crashed',
-            'pmsuspended',
-        ]
-
         data = {
             'name': name,
             'cpuStats': cpuStats,
@@ -140,3 +250,35 @@ class Domain:
         }
 
         return data
+
+    @staticmethod
+    def __DomainStatsDetail(dom: libvirt.virDomain, record: dict, stats: int) -> dict:
+        # the __DomainDetail shape out of one getAllDomainStats record
+        state = record.get('state.state')
+
+        cpu_stats = None
+        if stats & libvirt.VIR_DOMAIN_STATS_CPU_TOTAL:
+            cpu_stats = [{key: record[field] for field, key in cpu_stats_key_map.items() if field in record}]
+        mem_stats = None
+        if stats & libvirt.VIR_DOMAIN_STATS_BALLOON:
+            mem_stats = {key: record[field] for field, key in mem_stats_key_map.items() if field in record}
+
+        data = {
+            'name': dom.name(),
+            'cpuStats': cpu_stats,
+            'memStats': mem_stats,
+            'info': {
+                'state': None if state == None else state_to_string_map[state],
+                'max memory': record.get('balloon.maximum'),
+                'used memory': record.get('balloon.current'),
+                'CPU(s)': record.get('vcpu.current'),
+                'cpu time': record.get('cpu.time'),
+            },
+        }
+
+        if stats & ~DOMAIN_DETAIL_STATS:
+            detail_group_list = ['state', 'cpu', 'balloon', 'vcpu']
+            data['stats'] = {field: value for field, value in record.items()
+                             if field.split('.')[0] not in detail_group_list}
+
+        return data
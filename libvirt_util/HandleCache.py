@@ -0,0 +1,173 @@
+import threading
+
+import libvirt
+
+
+class HandleCache:
+    # virDomain, virStoragePool and virStorageVol handles by name and UUID.
+    # A miss is one lookupByName-style RPC and the handle is kept; domain and
+    # storage pool lifecycle events drop what they touch, so a lookup of a
+    # known object makes no RPC. Misses are not kept. Without events (the
+    # driver does not support them) nothing is kept and every lookup is an
+    # RPC. Volumes have no events of their own: they are dropped with their
+    # pool, on a pool refresh and by the Storage calls that change them
+    def __init__(self, conn: libvirt.virConnect):
+        self.__conn = conn
+        self.__lock = threading.Lock()
+        self.__domain_map = {}
+        self.__domain_uuid_map = {}
+        self.__pool_map = {}
+        self.__pool_uuid_map = {}
+        # (pool name, vol name) -> virStorageVol
+        self.__vol_map = {}
+
+        self.__domain_callback_id_list = []
+        self.__pool_callback_id_list = []
+        try:
+            self.__domain_callback_id_list.append(conn.domainEventRegisterAny(
+                None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self.__domainEvent, None))
+            self.__pool_callback_id_list.append(conn.storagePoolEventRegisterAny(
+                None, libvirt.VIR_STORAGE_POOL_EVENT_ID_LIFECYCLE, self.__poolEvent, None))
+            self.__pool_callback_id_list.append(conn.storagePoolEventRegisterAny(
+                None, libvirt.VIR_STORAGE_POOL_EVENT_ID_REFRESH, self.__poolRefreshEvent, None))
+            self.__enabled = True
+        except libvirt.libvirtError:
+            self.__enabled = False
+
+    def close(self):
+        # the connection may be gone already (a reconnect closes the dead
+        # one), its callbacks went with it
+        for callback_id in self.__domain_callback_id_list:
+            try:
+                self.__conn.domainEventDeregisterAny(callback_id)
+            except libvirt.libvirtError:
+                pass
+        for callback_id in self.__pool_callback_id_list:
+            try:
+                self.__conn.storagePoolEventDeregisterAny(callback_id)
+            except libvirt.libvirtError:
+                pass
+        self.__domain_callback_id_list = []
+        self.__pool_callback_id_list = []
+        self.__enabled = False
+        self.clear()
+
+    def clear(self):
+        with self.__lock:
+            self.__domain_map = {}
+            self.__domain_uuid_map = {}
+            self.__pool_map = {}
+            self.__pool_uuid_map = {}
+            self.__vol_map = {}
+
+    def getDomain(self, name) -> libvirt.virDomain:
+        dom = self.__domain_map.get(name)
+        if dom != None:
+            return dom
+
+        dom = HandleCache.__lookup(self.__conn.lookupByName, name)
+        if dom != None:
+            self.__putDomain(dom)
+        return dom
+
+    def getDomainByUUID(self, uuid) -> libvirt.virDomain:
+        dom = self.__domain_uuid_map.get(str(uuid))
+        if dom != None:
+            return dom
+
+        dom = HandleCache.__lookup(self.__conn.lookupByUUIDString, str(uuid))
+        if dom != None:
+            self.__putDomain(dom)
+        return dom
+
+    def dropDomain(self, name):
+        with self.__lock:
+            dom = self.__domain_map.pop(name, None)
+            if dom != None:
+                self.__domain_uuid_map.pop(dom.UUIDString(), None)
+
+    def getStoragePool(self, name) -> libvirt.virStoragePool:
+        pool = self.__pool_map.get(name)
+        if pool != None:
+            return pool
+
+        pool = HandleCache.__lookup(self.__conn.storagePoolLookupByName, name)
+        if pool != None:
+            self.__putStoragePool(pool)
+        return pool
+
+    def getStoragePoolByUUID(self, uuid) -> libvirt.virStoragePool:
+        pool = self.__pool_uuid_map.get(str(uuid))
+        if pool != None:
+            return pool
+
+        pool = HandleCache.__lookup(self.__conn.storagePoolLookupByUUIDString, str(uuid))
+        if pool != None:
+            self.__putStoragePool(pool)
+        return pool
+
+    def dropStoragePool(self, name):
+        with self.__lock:
+            pool = self.__pool_map.pop(name, None)
+            if pool != None:
+                self.__pool_uuid_map.pop(pool.UUIDString(), None)
+            self.__vol_map = {key: vol for key, vol in self.__vol_map.items() if key[0] != name}
+
+    def getStorageVol(self, pool_name, name) -> libvirt.virStorageVol:
+        vol = self.__vol_map.get((pool_name, name))
+        if vol != None:
+            return vol
+
+        pool = self.getStoragePool(pool_name)
+        if pool == None:
+            return None
+
+        vol = HandleCache.__lookup(pool.storageVolLookupByName, name)
+        if vol != None and self.__enabled == True:
+            with self.__lock:
+                self.__vol_map[(pool_name, name)] = vol
+        return vol
+
+    def dropStorageVol(self, pool_name, name):
+        with self.__lock:
+            self.__vol_map.pop((pool_name, name), None)
+
+    def __putDomain(self, dom: libvirt.virDomain):
+        if self.__enabled == False:
+            return
+
+        with self.__lock:
+            self.__domain_map[dom.name()] = dom
+            self.__domain_uuid_map[dom.UUIDString()] = dom
+
+    def __putStoragePool(self, pool: libvirt.virStoragePool):
+        if self.__enabled == False:
+            return
+
+        with self.__lock:
+            self.__pool_map[pool.name()] = pool
+            self.__pool_uuid_map[pool.UUIDString()] = pool
+
+    @staticmethod
+    def __lookup(func, key):
+        # None when the object does not exist
+        try:
+            return func(key)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() in (libvirt.VIR_ERR_NO_DOMAIN, libvirt.VIR_ERR_NO_STORAGE_POOL,
+                                      libvirt.VIR_ERR_NO_STORAGE_VOL):
+                return None
+            raise
+
+    # events come on the event loop thread; any lifecycle change drops the
+    # handle, the next lookup gets a fresh one
+    def __domainEvent(self, conn, dom, event, detail, opaque):
+        self.dropDomain(dom.name())
+
+    def __poolEvent(self, conn, pool, event, detail, opaque):
+        self.dropStoragePool(pool.name())
+
+    def __poolRefreshEvent(self, conn, pool, opaque):
+        name = pool.name()
+        with self.__lock:
+            self.__vol_map = {key: vol for key, vol in self.__vol_map.items() if key[0] != name}
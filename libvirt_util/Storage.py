@@ -1,3 +1,5 @@
+import time
+
 import libvirt
 
 from common import *
@@ -6,11 +8,27 @@ from VirtConnWrapper import *
 # POOL == DISK
 # VOLUME == partition
 
+# the keys of a createStorageVols spec
+vol_spec_key_list = ['name', 'capacity', 'path', 'owner', 'group']
+
 
 class Storage:
     def __init__(self, conn: VirConnWrapper):
-        self.__conn = conn.getConnect()
+        self.__conn_wrapper = conn
+
+    def getConnWrapper(self) -> VirConnWrapper:
+        return self.__conn_wrapper
+
+    # the connection checked out for the running call, see pooled
+    @property
+    def __conn(self) -> libvirt.virConnect:
+        return self.__conn_wrapper.getConnect()
+
+    @property
+    def __handle_cache(self) -> HandleCache:
+        return self.__conn_wrapper.getHandleCache()
 
+    @pooled
     def createStoragePool(self, name, uuid, path) -> VirMessage:
         xml_config = f'''
             <pool type='dir'>
@@ -35,6 +53,7 @@ class Storage:
         fileio.make_directory(path)
 
         pool = self.__conn.storagePoolDefineXML(xml_config, 0)
+        self.__handle_cache.dropStoragePool(name)
         if pool == None:
             return VirMessage(reason='Failed to create StoragePool object.')
 
@@ -43,6 +62,7 @@ class Storage:
 
         return VirMessage(code=VirMessageCode.SUCCESS)
 
+    @pooled
     def removeStoragePool(self, name) -> VirMessage:
         pool = self.__findStoragePool(name)
 
@@ -56,9 +76,11 @@ class Storage:
             pool.destroy()
 
         pool.undefine()
+        self.__handle_cache.dropStoragePool(name)
 
         return VirMessage(code=VirMessageCode.SUCCESS)
 
+    @pooled
     def getStoragePool(self, name) -> VirMessage:
         pool = self.__findStoragePool(name)
         if pool == None:
@@ -68,6 +90,7 @@ class Storage:
 
         return VirMessage(data=data, code=VirMessageCode.SUCCESS)
 
+    @pooled
     def getStoragePoolList(self) -> VirMessage:
         pool_list = self.__conn.listAllStoragePools()
         data = [Storage.__StoragePoolDetail(pool) for pool in pool_list]
@@ -75,14 +98,7 @@ class Storage:
         return VirMessage(data=data, code=VirMessageCode.SUCCESS)
 
     def __findStoragePool(self, name) -> libvirt.virStoragePool:
-        pool_list = self.__conn.listAllStoragePools()
-
-        pool = None
-        for each in pool_list:
-            if each.name() == name:
-                pool = each
-                break
-        return pool
+        return self.__handle_cache.getStoragePool(name)
 
     @staticmethod
     def __StoragePoolDetail(pool: libvirt.virStoragePool) -> dict:
@@ -116,25 +132,8 @@ class Storage:
         }
         return data
 
+    @pooled
     def createStorageVol(self, pool_name, name, capacity, path, owner, group) -> VirMessage:
-        xml_config = f'''
-            <volume>
-                <name>{name}</name>
-                <allocation>0</allocation>
-                <capacity unit="bytes">{capacity}</capacity>
-                <target>
-                    <path>{path}</path>
-                    <format type='qcow2'/>
-                    <permissions>
-                        <mode>0744</mode>
-                        <owner>{owner}</owner>
-                        <group>{group}</group>
-                        <label>virt_image_t</label>
-                    </permissions>
-                </target>
-            </volume>
-            '''
-
         if os.path.exists(path):
             return VirMessage(reason=f'volume target path "{path}" already exists')
 
@@ -145,11 +144,51 @@ class Storage:
         if self.__findStorageVol(pool_name, name) != None:
             return VirMessage(reason='volume already exists')
 
-        pool.createXML(
-            xml_config, libvirt.VIR_STORAGE_VOL_CREATE_PREALLOC_METADATA)
-
-        return VirMessage(code=VirMessageCode.SUCCESS)
-
+        return self.__defineStorageVol(pool, pool_name, name, capacity, path, owner, group)
+
+    def createStorageVols(self, pool_name, spec_list, worker_count=None) -> VirMessage:
+        # createStorageVol in pool_name for every spec (a dict of its keyword
+        # arguments but pool_name), the names and paths checked against one
+        # listing and the creates run on worker_count threads (the pool size
+        # by default), each with its own connection. data has a VirMessage
+        # per spec, in order, and the wall times
+        start = time.perf_counter()
+        with self.__conn_wrapper.checkout():
+            pool = self.__findStoragePool(pool_name)
+            if pool == None:
+                return VirMessage(reason='pool does not exist')
+            vol_list = pool.listAllVolumes()
+            name_set = {vol.name() for vol in vol_list}
+            path_set = {vol.path() for vol in vol_list}
+        list_seconds = time.perf_counter() - start
+
+        result_list = [None] * len(spec_list)
+        index_list = []
+        for i, spec in enumerate(spec_list):
+            reason = check_spec(spec, vol_spec_key_list)
+            if reason != None:
+                result_list[i] = VirMessage(reason=reason)
+            elif spec['name'] in name_set:
+                result_list[i] = VirMessage(reason='volume already exists')
+            elif spec['path'] in path_set or os.path.exists(spec['path']):
+                result_list[i] = VirMessage(reason=f'volume target path "{spec["path"]}" already exists')
+            else:
+                # a name or path twice in the batch is a conflict too
+                name_set.add(spec['name'])
+                path_set.add(spec['path'])
+                index_list.append(i)
+
+        if worker_count == None:
+            worker_count = self.__conn_wrapper.getSize()
+        created_list = run_batch(lambda spec: self.__createStorageVol(pool_name, **spec),
+                                 [spec_list[i] for i in index_list], worker_count)
+        for i, result in zip(index_list, created_list):
+            result_list[i] = result
+
+        return VirMessage(data=batch_data(result_list, worker_count, list_seconds, start),
+                          code=VirMessageCode.SUCCESS)
+
+    @pooled
     def removeStorageVol(self, pool_name, name) -> VirMessage:
         pool = self.__findStoragePool(pool_name)
         if pool == None:
@@ -161,9 +200,11 @@ class Storage:
 
         vol.wipe()
         vol.delete()
+        self.__handle_cache.dropStorageVol(pool_name, name)
 
         return VirMessage(code=VirMessageCode.SUCCESS)
 
+    @pooled
     def uploadStorageVol(self, pool_name, name, file_path) -> VirMessage:
         pool = self.__findStoragePool(pool_name)
         if pool == None:
@@ -185,6 +226,7 @@ class Storage:
         st.finish()
         f.close()
 
+    @pooled
     def getStorageVol(self, pool_name, name) -> VirMessage:
         vol = self.__findStorageVol(pool_name, name)
         if vol == None:
@@ -194,6 +236,7 @@ class Storage:
 
         return VirMessage(data=data, code=VirMessageCode.SUCCESS)
 
+    @pooled
     def getStorageVolList(self, pool_name) -> VirMessage:
         pool = self.__findStoragePool(pool_name)
         if pool == None:
@@ -204,20 +247,49 @@ class Storage:
 
         return VirMessage(data=data, code=VirMessageCode.SUCCESS)
 
-    def __findStorageVol(self, pool_name, name) -> libvirt.virStorageVol:
+    @pooled
+    def __createStorageVol(self, pool_name, name, capacity, path, owner, group) -> VirMessage:
+        # the pool handle of this connection
         pool = self.__findStoragePool(pool_name)
         if pool == None:
+            return VirMessage(reason='pool does not exist')
+
+        return self.__defineStorageVol(pool, pool_name, name, capacity, path, owner, group)
+
+    def __defineStorageVol(self, pool, pool_name, name, capacity, path, owner, group) -> VirMessage:
+        xml_config = Storage.__StorageVolXML(name, capacity, path, owner, group)
+        pool.createXML(
+            xml_config, libvirt.VIR_STORAGE_VOL_CREATE_PREALLOC_METADATA)
+        self.__handle_cache.dropStorageVol(pool_name, name)
+
+        return VirMessage(code=VirMessageCode.SUCCESS)
+
+    def __findStorageVol(self, pool_name, name) -> libvirt.virStorageVol:
+        if self.__findStoragePool(pool_name) == None:
             print(f'pool({pool_name}) does not exist')
             return None
 
-        vol_list = pool.listAllVolumes()
-        vol = None
-        for each in vol_list:
-            if name == each.name():
-                vol = each
-                break
+        return self.__handle_cache.getStorageVol(pool_name, name)
 
-        return vol
+    @staticmethod
+    def __StorageVolXML(name, capacity, path, owner, group) -> str:
+        return f'''
+        <volume>
+            <name>{name}</name>
+            <allocation>0</allocation>
+            <capacity unit="bytes">{capacity}</capacity>
+            <target>
+                <path>{path}</path>
+                <format type='qcow2'/>
+                <permissions>
+                    <mode>0744</mode>
+                    <owner>{owner}</owner>
+                    <group>{group}</group>
+                    <label>virt_image_t</label>
+                </permissions>
+            </target>
+        </volume>
+        '''
 
     @staticmethod
     def __StorageVolDetail(vol: libvirt.virStorageVol) -> dict:
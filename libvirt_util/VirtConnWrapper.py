@@ -1,18 +1,325 @@
 from common import *
+from HandleCache import HandleCache
+import asyncio
+import contextlib
+import functools
 import libvirt
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# lifecycle events reach only the connections opened after an event loop
+# implementation is registered, one per process: the default one run by a
+# thread or libvirt's asyncio one on an asyncio loop
+event_loop_impl = None
+event_loop_lock = threading.Lock()
+
+
+def start_event_loop(loop=None):
+    global event_loop_impl
+    with event_loop_lock:
+        if event_loop_impl != None:
+            return
+
+        if loop != None:
+            import libvirtaio
+            libvirtaio.virEventRegisterAsyncIOImpl(loop=loop)
+            event_loop_impl = 'asyncio'
+            return
+
+        libvirt.virEventRegisterDefaultImpl()
+        event_loop_impl = threading.Thread(target=run_event_loop, daemon=True)
+        event_loop_impl.start()
+
+
+def run_event_loop():
+    while True:
+        libvirt.virEventRunDefaultImpl()
+
+
+def pooled(method):
+    # runs a Domain/Storage method with a connection of the pool checked out
+    # by the calling thread, see VirConnWrapper.checkout
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.getConnWrapper().checkout():
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def check_spec(spec, key_list, optional_key_list=()) -> str:
+    # why spec (a dict of keyword arguments) cannot be used, None if it can
+    if type(spec) != dict:
+        return 'spec is not a dict'
+    missing_list = [x for x in key_list if x not in spec]
+    if len(missing_list) > 0:
+        return f'spec misses {", ".join(missing_list)}'
+    unknown_list = [x for x in spec if x not in key_list and x not in optional_key_list]
+    if len(unknown_list) > 0:
+        return f'spec has unknown {", ".join(unknown_list)}'
+    return None
+
+
+def run_batch(func, arg_list, worker_count) -> list:
+    # func(arg) for every arg on worker_count threads, a VirMessage each in
+    # order; an exception fails only its own item
+    def run(arg) -> VirMessage:
+        try:
+            return func(arg)
+        except Exception as e:
+            return VirMessage(reason=f'{type(e).__name__}: {e}')
+
+    if len(arg_list) == 0:
+        return []
+    with ThreadPoolExecutor(max(min(worker_count, len(arg_list)), 1), thread_name_prefix='libvirt') as executor:
+        return list(executor.map(run, arg_list))
+
+
+def batch_data(result_list, worker_count, list_seconds, start) -> dict:
+    # the data of a batch call begun at start (time.perf_counter())
+    seconds = time.perf_counter() - start
+    success_count = len([x for x in result_list if x.code == VirMessageCode.SUCCESS])
+    return {
+        'results': result_list,
+        'workers': worker_count,
+        'success': success_count,
+        'fail': len(result_list) - success_count,
+        'list seconds': list_seconds,
+        'seconds': seconds,
+        'per second': len(result_list) / seconds if seconds > 0 else 0.0,
+    }
+
+
+class PooledConnect:
+    # a connection and the handle cache filled through it
+    def __init__(self, conn: libvirt.virConnect):
+        self.conn = conn
+        self.handle_cache = HandleCache(conn)
+
+    def close(self):
+        self.handle_cache.close()
+        try:
+            self.conn.close()
+        except libvirt.libvirtError:
+            # already dropped
+            pass
+
 
 class VirConnWrapper:
-    def connect(self) -> VirMessage:
-        self.__conn = libvirt.open('qemu:///system')
-        if self.__conn == None:
-            VirMessage(reason='Failed to open connection to qemu:///system')
+    # a pool of up to size connections to one uri. A thread checks one out
+    # for the length of a Domain/Storage call (nested calls of the thread
+    # share it) and waits while all of them are out; a connection found dead
+    # at checkout is reopened. Connections send a keepalive every
+    # keepalive_interval seconds and libvirt drops them after keepalive_count
+    # unanswered ones (0 turns keepalive off). getStats() has the open
+    # latencies
+    def __init__(self, size=4, keepalive_interval=5, keepalive_count=3):
+        self.__size = max(size, 1)
+        self.__keepalive_interval = keepalive_interval
+        self.__keepalive_count = keepalive_count
+        self.__uri = None
+        # reentrant, a reopen under it updates the stats
+        self.__cond = threading.Condition(threading.RLock())
+        self.__idle_list = []
+        self.__open_count = 0
+        self.__closed = False
+        # used by the threads without a checkout, the first connection
+        self.__default = None
+        self.__local = threading.local()
+        self.__stats = {
+            'open': 0,
+            'open fail': 0,
+            'reconnect': 0,
+            'open seconds': 0.0,
+            'open max seconds': 0.0,
+            'checkout': 0,
+            'checkout wait seconds': 0.0,
+        }
+
+    def connect(self, uri='qemu:///system', loop=None) -> VirMessage:
+        # loop: deliver the events on this asyncio loop, see start_event_loop
+        start_event_loop(loop)
+        self.__uri = uri
+        self.__closed = False
+        pooled_conn = self.__open()
+        if pooled_conn == None:
+            return VirMessage(reason=f'Failed to open connection to {uri}')
+
+        with self.__cond:
+            self.__open_count += 1
+            self.__idle_list.append(pooled_conn)
+            self.__default = pooled_conn
 
         return VirMessage(code=VirMessageCode.SUCCESS)
 
     def close(self) -> VirMessage:
-        self.__conn.close()
+        # connections checked out now are closed when they come back
+        with self.__cond:
+            self.__closed = True
+            for pooled_conn in self.__idle_list:
+                pooled_conn.close()
+            self.__open_count -= len(self.__idle_list)
+            self.__idle_list = []
+            self.__default = None
+            self.__cond.notify_all()
 
         return VirMessage(code=VirMessageCode.SUCCESS)
-    
+
     def getConnect(self) -> libvirt.virConnect:
-        return self.__conn
\ No newline at end of file
+        # the connection this thread checked out, the default one outside a
+        # checkout
+        return self.__current().conn
+
+    def getHandleCache(self) -> HandleCache:
+        return self.__current().handle_cache
+
+    def getSize(self) -> int:
+        return self.__size
+
+    def getStats(self) -> dict:
+        with self.__cond:
+            stats = dict(self.__stats)
+            stats['size'] = self.__size
+            stats['opened'] = self.__open_count
+            stats['idle'] = len(self.__idle_list)
+        stats['open mean seconds'] = stats['open seconds'] / stats['open'] if stats['open'] else 0.0
+        return stats
+
+    @contextlib.contextmanager
+    def checkout(self):
+        pooled_conn = getattr(self.__local, 'pooled_conn', None)
+        if pooled_conn != None:
+            yield pooled_conn.conn
+            return
+
+        pooled_conn = self.__acquire()
+        self.__local.pooled_conn = pooled_conn
+        try:
+            yield pooled_conn.conn
+        finally:
+            self.__local.pooled_conn = None
+            self.__release(pooled_conn)
+
+    def __current(self) -> PooledConnect:
+        pooled_conn = getattr(self.__local, 'pooled_conn', None)
+        if pooled_conn != None:
+            return pooled_conn
+
+        with self.__cond:
+            if self.__closed == True:
+                raise libvirt.libvirtError('connection pool is closed')
+            if self.__default == None:
+                raise libvirt.libvirtError('not connected')
+            if self.__default.conn.isAlive() == False:
+                # __reopen swaps in the new one, a failed reopen raises and
+                # leaves the dead one to be retried at the next call
+                return self.__reopen(self.__default)
+            return self.__default
+
+    def __open(self) -> PooledConnect:
+        start = time.perf_counter()
+        try:
+            conn = libvirt.open(self.__uri)
+        except libvirt.libvirtError:
+            conn = None
+        elapsed = time.perf_counter() - start
+
+        with self.__cond:
+            if conn == None:
+                self.__stats['open fail'] += 1
+                return None
+            self.__stats['open'] += 1
+            self.__stats['open seconds'] += elapsed
+            self.__stats['open max seconds'] = max(self.__stats['open max seconds'], elapsed)
+
+        if self.__keepalive_interval > 0:
+            try:
+                conn.setKeepAlive(self.__keepalive_interval, self.__keepalive_count)
+            except libvirt.libvirtError:
+                # local drivers have no keepalive
+                pass
+
+        return PooledConnect(conn)
+
+    def __reopen(self, pooled_conn: PooledConnect) -> PooledConnect:
+        # the new connection is opened before the dead one is replaced and
+        # closed, so the default one never points at a closed connection
+        new_pooled_conn = self.__open()
+        if new_pooled_conn == None:
+            with self.__cond:
+                # dropped by the pool unless it is still the default one
+                if self.__default is not pooled_conn:
+                    pooled_conn.close()
+            raise libvirt.libvirtError(f'Failed to reopen connection to {self.__uri}')
+
+        with self.__cond:
+            self.__stats['reconnect'] += 1
+            if self.__default is pooled_conn:
+                self.__default = new_pooled_conn
+            # the default one may be idle too, reopened once for both
+            self.__idle_list = [new_pooled_conn if x is pooled_conn else x for x in self.__idle_list]
+        pooled_conn.close()
+        return new_pooled_conn
+
+    def __acquire(self) -> PooledConnect:
+        start = time.perf_counter()
+        with self.__cond:
+            while len(self.__idle_list) == 0 and self.__open_count >= self.__size and self.__closed == False:
+                self.__cond.wait()
+            if self.__closed == True:
+                raise libvirt.libvirtError('connection pool is closed')
+
+            self.__stats['checkout'] += 1
+            self.__stats['checkout wait seconds'] += time.perf_counter() - start
+            if len(self.__idle_list) > 0:
+                pooled_conn = self.__idle_list.pop()
+                if pooled_conn.conn.isAlive() == True:
+                    return pooled_conn
+            else:
+                pooled_conn = None
+                self.__open_count += 1
+
+        # opened or reopened without holding the pool
+        try:
+            if pooled_conn != None:
+                return self.__reopen(pooled_conn)
+
+            pooled_conn = self.__open()
+            if pooled_conn == None:
+                raise libvirt.libvirtError(f'Failed to open connection to {self.__uri}')
+            return pooled_conn
+        except libvirt.libvirtError:
+            with self.__cond:
+                self.__open_count -= 1
+                self.__cond.notify()
+            raise
+
+    def __release(self, pooled_conn: PooledConnect):
+        with self.__cond:
+            if self.__closed == True:
+                pooled_conn.close()
+                self.__open_count -= 1
+            else:
+                self.__idle_list.append(pooled_conn)
+            self.__cond.notify()
+
+
+class AsyncRunner:
+    # runs blocking Domain/Storage calls for asyncio on parallel threads
+    # (the pool size by default), each call with its own connection of the
+    # pool, so calls awaited together overlap up to parallel at a time
+    def __init__(self, conn: VirConnWrapper, parallel=None):
+        self.__parallel = parallel if parallel != None else conn.getSize()
+        self.__executor = ThreadPoolExecutor(self.__parallel, thread_name_prefix='libvirt')
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__executor, functools.partial(func, *args, **kwargs))
+
+    async def gather(self, func, arg_list) -> list:
+        # func(*args) for every args of arg_list, results in order
+        return await asyncio.gather(*[self.run(func, *args) for args in arg_list])
+
+    def close(self):
+        self.__executor.shutdown()
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from uuid import *
+
+root_folder = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(root_folder)
+
+from AsyncDomain import AsyncDomain
+from Domain import Domain
+from VirtConnWrapper import *
+
+from common import *
+
+
+def measure(name, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f'{name:>20} | {elapsed:10.4f} s')
+
+
+def test_domain_xml(name) -> str:
+    # the smallest domain the test driver runs
+    return f'''
+        <domain type='test'>
+            <name>{name}</name>
+            <uuid>{uuid4()}</uuid>
+            <memory unit='KiB'>65536</memory>
+            <vcpu>1</vcpu>
+            <os>
+                <type arch='x86_64'>hvm</type>
+            </os>
+        </domain>
+    '''
+
+
+def define_domains(conn: VirConnWrapper, count, prefix='bench') -> list:
+    dom_list = []
+    for i in range(count):
+        dom = conn.getConnect().defineXML(test_domain_xml(f'{prefix}{i}'))
+        dom.create()
+        dom_list.append(dom)
+    return dom_list
+
+
+def remove_domains(dom_list):
+    for dom in dom_list:
+        if dom.isActive() == True:
+            dom.destroy()
+        dom.undefine()
+
+
+def report_errors(name, error_list):
+    # getDomain reads getCPUStats/memoryStats, which are up to the driver;
+    # the failures are counted instead of ending the thread or the gather
+    if error_list:
+        print(f'{name:>20} | {len(error_list)} failed: {error_list[0]}')
+
+
+def bench_domain_list(conn: VirConnWrapper, count):
+    # the bulk getAllDomainStats listing against three RPCs per domain
+    dom_list = define_domains(conn, count)
+    dom = Domain(conn)
+
+    print(f'domains: {count}, domain list')
+    try:
+        measure('per domain', lambda: dom.getDomainList(bulk=False))
+    except libvirt.libvirtError as e:
+        # getCPUStats/memoryStats are up to the driver
+        print(f'{"per domain":>20} | {e}')
+    measure('getAllDomainStats', lambda: dom.getDomainList())
+    remove_domains(dom_list)
+
+
+def bench_pool(uri, count, thread_count=8):
+    # getDomain of every domain from thread_count threads, through one
+    # connection and through a pool of thread_count
+    conn = VirConnWrapper()
+    conn.connect(uri)
+    dom_list = define_domains(conn, count)
+    name_list = [x.name() for x in dom_list]
+
+    print(f'domains: {count}, threads: {thread_count}, connection pool')
+    for size in (1, thread_count):
+        pool = VirConnWrapper(size=size)
+        pool.connect(uri)
+        dom = Domain(pool)
+        error_list = []
+
+        def get_domains():
+            for name in name_list:
+                try:
+                    dom.getDomain(name)
+                except libvirt.libvirtError as e:
+                    error_list.append(e)
+
+        def run():
+            thread_list = [threading.Thread(target=get_domains) for _ in range(thread_count)]
+            for thread in thread_list:
+                thread.start()
+            for thread in thread_list:
+                thread.join()
+
+        measure(f'pool size {size}', run)
+        report_errors(f'pool size {size}', error_list)
+        stats = pool.getStats()
+        print(f'{"open mean":>20} | {stats["open mean seconds"]:10.4f} s')
+        print(f'{"checkout wait":>20} | {stats["checkout wait seconds"]:10.4f} s')
+        pool.close()
+
+    remove_domains(dom_list)
+    conn.close()
+
+
+def bench_async(uri, count, parallel=8):
+    # getDomain of every domain awaited one by one and all together
+    conn = VirConnWrapper(size=parallel)
+    conn.connect(uri)
+    dom_list = define_domains(conn, count)
+    name_list = [x.name() for x in dom_list]
+    dom = AsyncDomain(conn, parallel)
+    error_list = []
+
+    async def get_domain(name):
+        try:
+            await dom.getDomain(name)
+        except libvirt.libvirtError as e:
+            error_list.append(e)
+
+    async def one_by_one():
+        for name in name_list:
+            await get_domain(name)
+
+    async def together():
+        # as dom.getDomains, with every getDomain guarded so one failure
+        # does not abort the gather
+        await asyncio.gather(*[get_domain(x) for x in name_list])
+
+    print(f'domains: {count}, parallel: {parallel}, asyncio')
+    measure('await one by one', lambda: asyncio.run(one_by_one()))
+    report_errors('await one by one', error_list)
+    error_list.clear()
+    measure('await together', lambda: asyncio.run(together()))
+    report_errors('await together', error_list)
+
+    dom.close()
+    remove_domains(dom_list)
+    conn.close()
+
+
+def bench_batch(uri, count, worker_list=(1, 4, 8)):
+    # createDomains of count domains with 1, 4 and 8 workers
+    print(f'domains: {count}, batch create')
+    for worker_count in worker_list:
+        conn = VirConnWrapper(size=worker_count)
+        conn.connect(uri)
+        dom = Domain(conn)
+        spec_list = [{
+            'name': f'batch{i}', 'uuid': uuid4(), 'cpu': 1, 'memory': 65536,
+            'image_path': f'/tmp/batch{i}.qcow2', 'bridge': 'br0', 'mac': f'52:54:00:00:{i // 256 % 256:02x}:{i % 256:02x}',
+            'port_name': f'vnet{i}', 'domain_type': 'test',
+        } for i in range(count)]
+
+        message = dom.createDomains(spec_list, worker_count)
+        data = message.data
+        print(f'{f"workers {worker_count}":>20} | {data["seconds"]:10.4f} s | {data["per second"]:10.1f} /s'
+              f' | fail {data["fail"]}')
+
+        for spec in spec_list:
+            dom.removeDomain(spec['name'])
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='libvirt_util benchmark suite')
+    parser.add_argument('--uri', default='test:///default',
+                        help='libvirt connection, the test driver by default')
+    parser.add_argument('--domains', type=int, nargs='+', default=[10, 100, 500])
+    args = parser.parse_args()
+
+    conn = VirConnWrapper()
+    conn.connect(args.uri)
+    for count in args.domains:
+        bench_domain_list(conn, count)
+        bench_pool(args.uri, count)
+        bench_async(args.uri, count)
+        bench_batch(args.uri, count)
+    conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+from sortedlist import SortedKeyList
+
+MATERIALIZED_OP_LIST = ['count', 'sum', 'min', 'max']
+
+# column types each op but count takes: sum adds, min and max order
+MATERIALIZED_TYPE_MAP = {
+    'sum': [int, float],
+    'min': [int, float, str],
+    'max': [int, float, str],
+}
+
+
+class MaterializedAggregate:
+    # count, sum, min or max of column per key of key_set, kept up to date
+    # from the (old, new) key values of every change instead of being
+    # recomputed on read. A row counts when its column value is not None
+    # (every row for count without a column); a key no row counts for is
+    # dropped. count and sum cost O(1) per changed row, min and max keep the
+    # distinct values of each key sorted, O(log n). A row count over a key
+    # set the table indexes reads the bucket sizes of that index (index)
+    # and keeps nothing of its own
+    def __init__(self, op: str, key_set: tuple, key_getter, column: str = None, index: dict = None) -> None:
+        if op not in MATERIALIZED_OP_LIST:
+            raise ValueError(f'unknown aggregate {op}')
+
+        self.op = op
+        self.key_set = key_set
+        self.column = column
+        self.__key_getter = key_getter
+        self.index = index
+        # value key -> rows counted
+        self.__count_map = {}
+        # sum: value key -> sum, min/max: value key -> {value: rows}
+        self.__value_map = {}
+        # min/max: value key -> SortedKeyList of the distinct values
+        self.__ordered_map = {}
+
+    def apply(self, change_list: list):
+        for old_key_value, new_key_value in change_list:
+            if old_key_value != None:
+                self.__remove(old_key_value)
+            if new_key_value != None:
+                self.__add(new_key_value)
+
+    def __add(self, key_value: dict):
+        column = self.column
+        value = None if column == None else key_value[column]
+        if value is None and column != None:
+            return
+
+        value_key = self.__key_getter(key_value)
+        count_map = self.__count_map
+        count_map[value_key] = count_map.get(value_key, 0) + 1
+        op = self.op
+        if op == 'sum':
+            self.__value_map[value_key] = self.__value_map.get(value_key, 0) + value
+        elif op != 'count':
+            value_count_map = self.__value_map.get(value_key)
+            if value_count_map == None:
+                value_count_map = self.__value_map[value_key] = {}
+                self.__ordered_map[value_key] = SortedKeyList()
+            if value in value_count_map:
+                value_count_map[value] += 1
+            else:
+                value_count_map[value] = 1
+                self.__ordered_map[value_key].add(value)
+
+    def __remove(self, key_value: dict):
+        column = self.column
+        value = None if column == None else key_value[column]
+        if value is None and column != None:
+            return
+
+        value_key = self.__key_getter(key_value)
+        count_map = self.__count_map
+        count = count_map[value_key] - 1
+        op = self.op
+        if count == 0:
+            del count_map[value_key]
+            if op != 'count':
+                del self.__value_map[value_key]
+                self.__ordered_map.pop(value_key, None)
+            return
+
+        count_map[value_key] = count
+        if op == 'sum':
+            self.__value_map[value_key] -= value
+        elif op != 'count':
+            value_count_map = self.__value_map[value_key]
+            if value_count_map[value] == 1:
+                del value_count_map[value]
+                self.__ordered_map[value_key].remove(value)
+            else:
+                value_count_map[value] -= 1
+
+    def get(self, value_key: tuple):
+        # 0 for count and sum, None for min and max when no row counts
+        op = self.op
+        if self.index != None:
+            bucket = self.index.get(value_key)
+            if bucket is None:
+                return 0
+            return 1 if type(bucket) is int else len(bucket)
+        if op == 'count':
+            return self.__count_map.get(value_key, 0)
+        if op == 'sum':
+            return self.__value_map.get(value_key, 0)
+
+        ordered = self.__ordered_map.get(value_key)
+        if ordered == None:
+            return None
+        return ordered.min() if op == 'min' else ordered.max()
+
+    def items(self) -> dict:
+        value_key_list = list(self.__count_map if self.index == None else self.index)
+        return {value_key: self.get(value_key) for value_key in value_key_list}
@@ -0,0 +1,516 @@
+#!/usr/bin/python3
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+from database import Database
+from memdb import Field, Table
+from shared import SharedTable, SharedTableReader
+
+member_list = [
+    Field('dpid',  int),
+    Field('port_name',  str),
+    Field('port_no',  int),
+]
+
+key_set_list = [
+    ['dpid', 'port_name'],
+    ['dpid'],
+    ['port_name'],
+    ['dpid', 'port_no'],
+]
+
+ordered_key_set_list = [
+    ['dpid', 'port_no'],
+]
+
+# per-row scenarios time this many calls at most
+SAMPLE_COUNT = 100000
+
+
+def measure(name, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f'{name:>20} | {elapsed:10.4f} s')
+
+
+def make_row(i: int) -> dict:
+    return {'dpid': i % 3 + 1, 'port_name': f'veth{i}', 'port_no': i}
+
+
+def peak_rss_kb() -> int:
+    # peak resident set size of this process so far (KB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(sorted_list: list, ratio: float) -> float:
+    if len(sorted_list) == 0:
+        return 0.0
+    return sorted_list[min(len(sorted_list) - 1, int(len(sorted_list) * ratio))]
+
+
+def run_op(func, arg_list) -> dict:
+    # func(arg) for every arg, each call timed on its own
+    perf_counter_ns = time.perf_counter_ns
+    latency_list = []
+    start = perf_counter_ns()
+    for arg in arg_list:
+        call_start = perf_counter_ns()
+        func(arg)
+        latency_list.append(perf_counter_ns() - call_start)
+    elapsed = (perf_counter_ns() - start) / 1e9
+
+    latency_list.sort()
+    return {
+        "ops": len(latency_list),
+        "seconds": elapsed,
+        "ops_per_sec": len(latency_list) / elapsed if elapsed else 0.0,
+        "p50_us": percentile(latency_list, 0.50) / 1e3,
+        "p99_us": percentile(latency_list, 0.99) / 1e3,
+    }
+
+
+def run_bulk(func, row_count: int) -> dict:
+    # one call handling row_count rows, ops are rows and the latency is
+    # the whole call
+    start = time.perf_counter_ns()
+    func()
+    elapsed_ns = time.perf_counter_ns() - start
+    return {
+        "ops": row_count,
+        "seconds": elapsed_ns / 1e9,
+        "ops_per_sec": row_count / (elapsed_ns / 1e9) if elapsed_ns else 0.0,
+        "p50_us": elapsed_ns / 1e3,
+        "p99_us": elapsed_ns / 1e3,
+    }
+
+
+def run_suite(row_count: int, compact: bool, sample_count: int = SAMPLE_COUNT) -> list:
+    # every scenario on one table size and store mode, results in order
+    rand = random.Random(row_count)
+    sample = rand.sample(range(row_count), min(sample_count, row_count))
+    result_list = []
+
+    def record(scenario, result):
+        result.update({
+            "rows": row_count,
+            "mode": "compact" if compact else "row",
+            "scenario": scenario,
+            "peak_rss_kb": peak_rss_kb(),
+        })
+        result_list.append(result)
+
+    table = Table(member_list, key_set_list, compact=compact, ordered_key_set_list=ordered_key_set_list)
+    record("insert", run_op(lambda i: table.insert(**make_row(i)), range(row_count)))
+
+    row_list = [make_row(i) for i in range(row_count)]
+    loaded = Table(member_list, key_set_list, compact=compact, ordered_key_set_list=ordered_key_set_list)
+    record("bulk_load", run_bulk(lambda: loaded.load(row_list), row_count))
+    del loaded, row_list
+
+    record("point_get", run_op(
+        lambda i: table.getOne(dpid=i % 3 + 1, port_name=f'veth{i}'), sample))
+    record("multi_key_get", run_op(
+        lambda i: table.get(dpid=i % 3 + 1, port_no=i), sample))
+    record("range_get", run_op(
+        lambda i: table.getRange(['dpid', 'port_no'], (2, i), (2, i + 100)), sample[:SAMPLE_COUNT // 10]))
+    record("query_page", run_op(
+        lambda i: list(table.query(order_by=['port_no'], limit=50, dpid=i % 3 + 1)), sample[:SAMPLE_COUNT // 10]))
+    # port_no moves every row to another (dpid, port_no) bucket and
+    # another place in the ordered index
+    record("update_key_move", run_op(
+        lambda i: table.update(dpid=i % 3 + 1, port_name=f'veth{i}', port_no=i + row_count), sample))
+    record("str_render", run_bulk(lambda: str(table), row_count))
+    record("delete_secondary", run_op(lambda i: table.delete(port_name=f'veth{i}'), sample))
+    return result_list
+
+
+def run_child(row_count: int, compact: bool) -> list:
+    # each size and mode runs in its own process so that peak RSS is its own
+    command = [sys.executable, os.path.abspath(__file__), '--child', str(row_count),
+               'compact' if compact else 'row']
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output)
+
+
+def best_of(result: dict, other: dict) -> dict:
+    best = dict(result)
+    best["ops_per_sec"] = max(result["ops_per_sec"], other["ops_per_sec"])
+    best["seconds"] = min(result["seconds"], other["seconds"])
+    for metric in ["p50_us", "p99_us", "peak_rss_kb"]:
+        best[metric] = min(result[metric], other[metric])
+    return best
+
+
+def print_result(result_list: list):
+    for result in result_list:
+        print(f'{result["rows"]:>8} {result["mode"]:>7} {result["scenario"]:>17} | '
+              f'{result["ops_per_sec"]:12.0f} ops/s | p50 {result["p50_us"]:10.1f} us | '
+              f'p99 {result["p99_us"]:10.1f} us | rss {result["peak_rss_kb"] / 1024:8.1f} MB')
+
+
+def compare(result_list: list, baseline_list: list, threshold: float) -> list:
+    # regressions against a baseline: ops/s down, or p99 latency or peak
+    # RSS up, by more than threshold
+    baseline_map = {(x["rows"], x["mode"], x["scenario"]): x for x in baseline_list}
+    regression_list = []
+    for result in result_list:
+        baseline = baseline_map.get((result["rows"], result["mode"], result["scenario"]))
+        if baseline == None:
+            continue
+
+        for metric, worse in [("ops_per_sec", -1), ("p99_us", 1), ("peak_rss_kb", 1)]:
+            if baseline[metric] == 0:
+                continue
+            change = (result[metric] - baseline[metric]) / baseline[metric]
+            if change * worse > threshold:
+                regression_list.append({
+                    "rows": result["rows"],
+                    "mode": result["mode"],
+                    "scenario": result["scenario"],
+                    "metric": metric,
+                    "baseline": baseline[metric],
+                    "current": result[metric],
+                    "change": change,
+                })
+    return regression_list
+
+
+def bench_concurrent(row_count, compact, write_rate=1000, duration=2.0):
+    # reads/s of N reader threads doing getOne while one writer thread
+    # updates write_rate rows per second
+    table = Table(member_list, key_set_list, compact=compact,
+                  ordered_key_set_list=ordered_key_set_list, concurrent=True)
+    table.insert_many(make_row(i) for i in range(row_count))
+
+    print(f'rows: {row_count}, compact: {compact}, concurrent, writer: {write_rate}/s')
+    for reader_count in [1, 2, 4, 8]:
+        stop = threading.Event()
+        read_count_list = [0] * reader_count
+        write_count = [0]
+
+        def writer():
+            count = 0
+            start = time.perf_counter()
+            while not stop.is_set():
+                i = count % row_count
+                table.update(dpid=i % 3 + 1, port_name=f'veth{i}', port_no=i + row_count)
+                count += 1
+                # keep the fixed rate
+                delay = start + count / write_rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            write_count[0] = count
+
+        def reader(n):
+            i = n
+            count = 0
+            while not stop.is_set():
+                table.getOne(dpid=i % 3 + 1, port_name=f'veth{i}')
+                i = (i + 7919) % row_count
+                count += 1
+            read_count_list[n] = count
+
+        thread_list = [threading.Thread(target=writer)]
+        thread_list += [threading.Thread(target=reader, args=(n,)) for n in range(reader_count)]
+        for thread in thread_list:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in thread_list:
+            thread.join()
+
+        reads = sum(read_count_list) / duration
+        print(f'{reader_count:>12} readers | {reads:12.0f} reads/s | {write_count[0] / duration:8.0f} writes/s')
+
+
+def bench_transaction(row_count, compact, tx_size=1000):
+    # commit latency of a transaction moving tx_size ports to another
+    # bridge (a delete and an insert each), against the same changes made
+    # one call at a time
+    database = Database()
+    table = database.createTable('port', member_list, key_set_list, compact=compact,
+                                 ordered_key_set_list=ordered_key_set_list)
+    table.insert_many(make_row(i) for i in range(row_count))
+
+    def stage(tx, offset):
+        for i in range(offset, offset + tx_size):
+            tx.delete('port', dpid=i % 3 + 1, port_name=f'veth{i}')
+            tx.insert('port', dpid=i % 3 + 11, port_name=f'veth{i}', port_no=i)
+
+    def commit_transaction():
+        tx = database.transaction()
+        stage(tx, 0)
+        tx.commit()
+
+    def failing_transaction():
+        # the last insert hits a unique key, everything is rolled back
+        tx = database.transaction()
+        stage(tx, tx_size)
+        tx.insert('port', dpid=11, port_name='veth0', port_no=0)
+        tx.commit()
+
+    def one_by_one():
+        for i in range(tx_size * 2, tx_size * 3):
+            table.delete(dpid=i % 3 + 1, port_name=f'veth{i}')
+            table.insert(dpid=i % 3 + 11, port_name=f'veth{i}', port_no=i)
+
+    print(f'rows: {row_count}, compact: {compact}, {tx_size} row transaction')
+    measure('commit', commit_transaction)
+    measure('commit + rollback', failing_transaction)
+    measure('without transaction', one_by_one)
+
+
+def bench_cache(row_count, compact, repeat=100000):
+    # the same few queries over and over with rare writes, with and
+    # without the query cache
+    for cache_size in [0, 1024]:
+        table = Table(member_list, key_set_list, compact=compact,
+                      ordered_key_set_list=ordered_key_set_list, cache_size=cache_size)
+        table.insert_many(make_row(i) for i in range(row_count))
+
+        def get_one():
+            for i in range(repeat):
+                table.getOne(dpid=i % 3 + 1, port_name=f'veth{i % 100}')
+                if i % 1000 == 0:
+                    table.update(dpid=1, port_name='veth99', port_no=i)
+
+        def get_secondary():
+            for i in range(100):
+                table.get(dpid=2)
+
+        print(f'rows: {row_count}, compact: {compact}, cache_size: {cache_size}')
+        measure(f'getOne x {repeat}', get_one)
+        measure('get(dpid=2) x 100', get_secondary)
+        if cache_size:
+            print(table.getCacheStats())
+
+
+def bench_update(row_count, compact, repeat=100000):
+    # counter-style updates of a column no index covers: the whole row
+    # against only the key and the changed counter
+    counter_member_list = member_list + [Field('rx_packets', int), Field('tx_packets', int)]
+    table = Table(counter_member_list, key_set_list, compact=compact,
+                  ordered_key_set_list=ordered_key_set_list)
+    table.insert_many(dict(make_row(i), rx_packets=0, tx_packets=0) for i in range(row_count))
+    step = max(1, row_count // repeat)
+
+    def update_full():
+        for n in range(repeat):
+            i = n * step % row_count
+            table.update(dpid=i % 3 + 1, port_name=f'veth{i}', port_no=i, rx_packets=n, tx_packets=0)
+
+    def update_partial():
+        for n in range(repeat):
+            i = n * step % row_count
+            table.update(dpid=i % 3 + 1, port_name=f'veth{i}', rx_packets=n + 1)
+
+    print(f'rows: {row_count}, compact: {compact}, counter update')
+    measure(f'full x {repeat}', update_full)
+    measure(f'partial x {repeat}', update_partial)
+
+
+def bench_scan(row_count, compact):
+    # a predicate no index fits, vectorized on a compact table, against the
+    # loop over getAll it replaces
+    table = Table(member_list, key_set_list, compact=compact)
+    table.insert_many(make_row(i) for i in range(row_count))
+    where = [('port_no', '>', row_count // 2), ('dpid', 'in', {1, 3})]
+
+    def python_loop():
+        return [x for x in table.getAll()
+                if x.key_value['port_no'] > row_count // 2 and x.key_value['dpid'] in (1, 3)]
+
+    print(f'rows: {row_count}, compact: {compact}, scan')
+    check_scan(min(row_count, 10000))
+    measure('getAll loop', python_loop)
+    measure('scan', lambda: table.scan(where))
+    measure('count', lambda: table.aggregate('count', where=where))
+    measure('max group by dpid', lambda: table.aggregate('max', 'port_no', group_by='dpid'))
+
+
+def check_scan(row_count, where_list=None):
+    # scans and aggregates on the numpy path (compact table) against the
+    # python path (row table) over the same rows, each dpid with its own
+    # range of port_no (negative ones included) so group results differ;
+    # prints the mismatches, returns how many
+    table_list = [Table(member_list, key_set_list, compact=compact) for compact in (True, False)]
+    row_list = [{'dpid': i % 7, 'port_name': f'veth{i}', 'port_no': (i % 7 - 3) * 100 + random.randint(0, 99)}
+                for i in range(row_count)]
+    for table in table_list:
+        table.insert_many(row_list)
+    if where_list == None:
+        where_list = [None, [('port_no', '<', 0)], [('dpid', 'in', {1, 3}), ('port_no', '>=', 500)]]
+
+    mismatch_count = 0
+    for where in where_list:
+        compact_list, row_list = [sorted([tuple(sorted(x.key_value.items())) for x in table.scan(where)])
+                                  for table in table_list]
+        if compact_list != row_list:
+            mismatch_count += 1
+            print(f'MISMATCH scan {where}: {len(compact_list)} against {len(row_list)} rows')
+        for op in ('count', 'sum', 'min', 'max'):
+            for group_by in (None, 'dpid'):
+                compact_result, row_result = [table.aggregate(op, 'port_no', where, group_by)
+                                              for table in table_list]
+                if compact_result != row_result:
+                    mismatch_count += 1
+                    print(f'MISMATCH {op} {where} group by {group_by}: {compact_result} against {row_result}')
+
+    print(f'{"numpy vs python":>20} | {mismatch_count} mismatches')
+    return mismatch_count
+
+
+def bench_aggregate(row_count, compact, repeat=10000):
+    # "ports per dpid" read from a materialized count against len(get()),
+    # and what keeping a sum and a max costs the writes
+    table = Table(member_list, key_set_list, compact=compact)
+    table.insert_many(make_row(i) for i in range(row_count))
+    table.addAggregate('port_count', 'count', ['dpid'])
+    table.addAggregate('port_no_sum', 'sum', ['dpid'], 'port_no')
+    table.addAggregate('port_no_max', 'max', ['dpid'], 'port_no')
+    plain_table = Table(member_list, key_set_list, compact=compact)
+
+    def insert_delete(target):
+        def run():
+            for i in range(repeat):
+                target.insert(dpid=4, port_name=f'extra{i}', port_no=i)
+            for i in range(repeat):
+                target.delete(dpid=4, port_name=f'extra{i}')
+        return run
+
+    print(f'rows: {row_count}, compact: {compact}, aggregate')
+    measure('len(get) x 100', lambda: [len(table.get(dpid=2)) for _ in range(100)])
+    measure(f'getAggregate x {repeat}', lambda: [table.getAggregate('port_no_sum', dpid=2) for _ in range(repeat)])
+    measure('write plain', insert_delete(plain_table))
+    measure('write aggregated', insert_delete(table))
+
+
+def bench_expiry(row_count, compact):
+    # 1% of the rows aging out by ttl against the periodic getAll scan and
+    # delete it replaces
+    scan_table = Table(member_list, key_set_list, compact=compact)
+    scan_table.insert_many(make_row(i) for i in range(row_count))
+
+    def scan_delete():
+        for x in scan_table.getAll():
+            key_value = x.key_value
+            if key_value['port_no'] % 100 == 0:
+                scan_table.delete(dpid=key_value['dpid'], port_name=key_value['port_name'])
+
+    table = Table(member_list, key_set_list, compact=compact, ttl=3600)
+    table.insert_many(make_row(i) for i in range(row_count))
+    for i in range(0, row_count, 100):
+        row = make_row(i)
+        table.setTtl(0, dpid=row['dpid'], port_name=row['port_name'])
+    # let the last deadline pass
+    time.sleep(0.1)
+
+    print(f'rows: {row_count}, compact: {compact}, expiry')
+    measure('scan and delete', scan_delete)
+    measure('sweep', table.sweep)
+
+
+def bench_shared(row_count, process_count=None):
+    # a reader process attaching to the published partitions against
+    # building its own table, and scans fanned out over the cpus against
+    # one process
+    rows = [make_row(i) for i in range(row_count)]
+    table = Table(member_list, key_set_list, compact=True)
+    writer = SharedTable(f'memdb_bench_{os.getpid()}', member_list, key_set_list, partition_key_set=['dpid'])
+    writer.insert_many(rows)
+    writer.publish()
+    where = [('port_no', '>', row_count // 2), ('port_name', '!=', 'veth1')]
+
+    print(f'rows: {row_count}, shared, {process_count or os.cpu_count()} processes')
+    measure('build table', lambda: table.insert_many(rows))
+    measure('attach reader', lambda: SharedTableReader(writer.name).getOne(dpid=1, port_name='veth0'))
+    reader = SharedTableReader(writer.name, 1)
+    pool_reader = SharedTableReader(writer.name, process_count)
+    # start the pool and map the partitions in the workers
+    pool_reader.aggregate('count')
+    measure('scan', lambda: table.scan(where))
+    measure('shared scan', lambda: reader.scan(where))
+    measure('shared pool scan', lambda: pool_reader.scan(where))
+    measure('count', lambda: table.aggregate('count', where=where))
+    measure('shared pool count', lambda: pool_reader.aggregate('count', where=where))
+    reader.close()
+    pool_reader.close()
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='memdb benchmark suite')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--mode', choices=['row', 'compact'], nargs='+', default=['row', 'compact'])
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to flag regressions against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative change counted as a regression (default 0.2)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='run every size and mode this many times and keep the best numbers')
+    parser.add_argument('--extra', action='store_true',
+                        help='also run the concurrency, transaction, cache, update, scan, aggregate, expiry and shared benchmarks')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(run_suite(int(args.child[0]), args.child[1] == 'compact'), sys.stdout)
+        return 0
+
+    result_list = []
+    for row_count in args.rows:
+        for mode in args.mode:
+            # best of the runs, one noisy run does not count as a regression
+            child_result_list = run_child(row_count, mode == 'compact')
+            for _ in range(args.repeat - 1):
+                child_result_list = [best_of(x, y) for x, y in
+                                     zip(child_result_list, run_child(row_count, mode == 'compact'))]
+            print_result(child_result_list)
+            result_list.extend(child_result_list)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                "results": result_list,
+            }, f, indent=2)
+
+    if args.extra:
+        for row_count in args.rows:
+            bench_concurrent(row_count, False)
+            bench_transaction(row_count, False)
+            bench_cache(row_count, False)
+            bench_update(row_count, False)
+            bench_scan(row_count, True)
+            bench_aggregate(row_count, False)
+            bench_expiry(row_count, False)
+            bench_shared(row_count)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline_list = json.load(f)["results"]
+        regression_list = compare(result_list, baseline_list, args.threshold)
+        for x in regression_list:
+            print(f'REGRESSION {x["rows"]} {x["mode"]} {x["scenario"]} {x["metric"]}: '
+                  f'{x["baseline"]:.1f} -> {x["current"]:.1f} ({x["change"]:+.0%})')
+        if regression_list:
+            return 1
+        print(f'no regression over {args.threshold:.0%} against {args.compare}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+# bucket versions live in a fixed number of slots picked by hash, buckets
+# sharing a slot only invalidate each other a little early
+CACHE_VERSION_SLOT = 1 << 16
+
+
+class QueryCache:
+    # query -> result list, LRU bounded to size entries. Each entry depends
+    # on the version slot of one index bucket every matching row is in (or
+    # on the whole table, slot None) and is dropped once that version moves
+    def __init__(self, size: int) -> None:
+        self.__size = size
+        self.__entry_map = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__slot_list = [0] * CACHE_VERSION_SLOT
+        self.__table_version = 0
+        self.hit_count = 0
+        self.miss_count = 0
+        self.evict_count = 0
+
+    def slot(self, key_set: tuple, value_key: tuple) -> int:
+        return hash((key_set, value_key)) % CACHE_VERSION_SLOT
+
+    def version(self, slot: int) -> int:
+        if slot == None:
+            return self.__table_version
+        return self.__slot_list[slot]
+
+    def get(self, key) -> list:
+        with self.__lock:
+            entry = self.__entry_map.get(key)
+            if entry != None:
+                value_list, slot, version = entry
+                if version == (self.__table_version if slot == None else self.__slot_list[slot]):
+                    self.__entry_map.move_to_end(key)
+                    self.hit_count += 1
+                    return value_list
+                del self.__entry_map[key]
+
+            self.miss_count += 1
+            return None
+
+    def put(self, key, value_list: list, slot: int, version: int):
+        with self.__lock:
+            self.__entry_map[key] = (value_list, slot, version)
+            self.__entry_map.move_to_end(key)
+            while len(self.__entry_map) > self.__size:
+                self.__entry_map.popitem(last=False)
+                self.evict_count += 1
+
+    def invalidate(self, slot_list: list):
+        slot_version = self.__slot_list
+        for slot in slot_list:
+            slot_version[slot] += 1
+        self.__table_version += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entry_map.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.__entry_map),
+            "capacity": self.__size,
+            "hit": self.hit_count,
+            "miss": self.miss_count,
+            "evict": self.evict_count,
+        }
@@ -0,0 +1,135 @@
+import threading
+from typing import List
+
+from memdb import Field, Table
+
+
+class TransactionError(Exception):
+    pass
+
+
+class Database:
+    # named tables plus transactions spanning them, see Transaction
+    def __init__(self) -> None:
+        self.__table_map = {}
+        # transactions commit one at a time
+        self.__commit_lock = threading.Lock()
+
+    def createTable(self, name: str, member_list: List[Field], key_set_list: List[list], **kwargs) -> Table:
+        # kwargs go to Table (compact, ordered_key_set_list, concurrent);
+        # None if the name is taken
+        if name in self.__table_map:
+            return None
+
+        table = Table(member_list, key_set_list, **kwargs)
+        self.__table_map[name] = table
+        return table
+
+    def addTable(self, name: str, table: Table) -> bool:
+        if name in self.__table_map:
+            return False
+
+        self.__table_map[name] = table
+        return True
+
+    def dropTable(self, name: str) -> bool:
+        return self.__table_map.pop(name, None) != None
+
+    def getTable(self, name: str) -> Table:
+        return self.__table_map.get(name)
+
+    def getTableNameList(self) -> List[str]:
+        return list(self.__table_map)
+
+    def __getitem__(self, name: str) -> Table:
+        return self.__table_map[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__table_map
+
+    def transaction(self) -> 'Transaction':
+        return Transaction(self)
+
+    def commit(self, op_list_map: dict) -> bool:
+        # op_list_map: table name -> [(op, kwargs), ...]; each table applies
+        # its ops as one batch, a table failing undoes the tables already
+        # committed
+        with self.__commit_lock:
+            if not all([name in self.__table_map for name in op_list_map]):
+                return False
+
+            undo_list = []
+            done = False
+            try:
+                for name, op_list in op_list_map.items():
+                    table = self.__table_map[name]
+                    undo_op_list = table.applyBatch(op_list)
+                    if undo_op_list == None:
+                        return False
+                    undo_list.append((table, undo_op_list))
+                done = True
+            finally:
+                if not done:
+                    for table, undo_op_list in reversed(undo_list):
+                        table.applyBatch(undo_op_list)
+
+            return True
+
+
+class Transaction:
+    # changes are staged and only reach the tables on commit, all of them or
+    # none. Used as a context manager it commits when the block ends and
+    # discards the staged changes when the block raises; a failed commit
+    # (unique key taken, updated row missing) raises TransactionError
+    #
+    #   with db.transaction() as tx:
+    #       tx.delete('port', dpid=1, port_name='veth1')
+    #       tx.insert('port', dpid=2, port_name='veth1', port_no=1)
+    def __init__(self, database: Database) -> None:
+        self.__database = database
+        self.__op_list_map = {}
+        self.__done = False
+
+    def __stage(self, table_name: str, op: str, key_value: dict) -> bool:
+        if self.__done or table_name not in self.__database:
+            return False
+
+        self.__op_list_map.setdefault(table_name, []).append((op, key_value))
+        return True
+
+    def insert(self, table_name: str, *args, **kwargs) -> bool:
+        return self.__stage(table_name, "insert", kwargs)
+
+    def update(self, table_name: str, *args, **kwargs) -> bool:
+        return self.__stage(table_name, "update", kwargs)
+
+    def delete(self, table_name: str, *args, **kwargs) -> bool:
+        return self.__stage(table_name, "delete", kwargs)
+
+    def getStagedCount(self) -> int:
+        return sum([len(x) for x in self.__op_list_map.values()])
+
+    def commit(self) -> bool:
+        if self.__done:
+            return False
+
+        self.__done = True
+        ret = self.__database.commit(self.__op_list_map)
+        self.__op_list_map = {}
+        return ret
+
+    def rollback(self):
+        self.__done = True
+        self.__op_list_map = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type != None:
+            self.rollback()
+            return False
+
+        if not self.__done and not self.commit():
+            raise TransactionError('transaction failed, nothing was applied')
+        return False
@@ -0,0 +1,189 @@
+import time
+
+# seconds per wheel tick, deadlines are rounded up to a tick
+EXPIRY_TICK = 0.05
+
+# 4 levels of 64 slots cover 64 ** 4 ticks (about 9.7 days), later
+# deadlines wait in an overflow slot
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SIZE - 1
+WHEEL_LEVEL = 4
+
+
+class TimerWheel:
+    # hierarchical timer wheel of keys and deadline ticks: level l holds the
+    # keys whose deadline agrees with the current tick above its bits and
+    # is cascaded one level down once the current tick reaches its slot, so
+    # add, remove and expiry are O(1) per key whatever the deadline
+    def __init__(self, now: int = 0) -> None:
+        self.__current = now
+        self.__level_list = [[{} for _ in range(WHEEL_SIZE)] for _ in range(WHEEL_LEVEL)]
+        self.__level_count_list = [0] * WHEEL_LEVEL
+        self.__overflow = {}
+        # due on the next advance
+        self.__due = {}
+        # key -> (level, slot) it waits in, level None for due and overflow
+        self.__location_map = {}
+
+    def __len__(self) -> int:
+        return len(self.__location_map)
+
+    def current(self) -> int:
+        return self.__current
+
+    def has_due(self) -> bool:
+        return len(self.__due) > 0
+
+    def add(self, key, deadline: int):
+        # (re)schedules key, a deadline already passed is due right away
+        if key in self.__location_map:
+            self.remove(key)
+
+        current = self.__current
+        if deadline <= current:
+            slot, level = self.__due, None
+        else:
+            level = 0
+            while level < WHEEL_LEVEL and deadline >> (WHEEL_BITS * (level + 1)) != current >> (WHEEL_BITS * (level + 1)):
+                level += 1
+            if level == WHEEL_LEVEL:
+                slot, level = self.__overflow, None
+            else:
+                slot = self.__level_list[level][(deadline >> (WHEEL_BITS * level)) & WHEEL_MASK]
+                self.__level_count_list[level] += 1
+        slot[key] = deadline
+        self.__location_map[key] = (level, slot)
+
+    def remove(self, key) -> bool:
+        location = self.__location_map.pop(key, None)
+        if location == None:
+            return False
+
+        level, slot = location
+        del slot[key]
+        if level != None:
+            self.__level_count_list[level] -= 1
+        return True
+
+    def deadline(self, key) -> int:
+        location = self.__location_map.get(key)
+        if location == None:
+            return None
+        return location[1][key]
+
+    def advance(self, now: int) -> list:
+        # moves the wheel to tick now, the keys due by then
+        expired_list = list(self.__due)
+        self.__due = {}
+        for key in expired_list:
+            del self.__location_map[key]
+
+        level_count_list = self.__level_count_list
+        while self.__current < now:
+            # ticks before the next cascade of the first non empty level
+            # have nothing to do and are skipped
+            step = 1
+            for count in level_count_list:
+                if count:
+                    break
+                step <<= WHEEL_BITS
+            current = min((self.__current // step + 1) * step, now)
+            self.__current = current
+
+            if current & ((1 << (WHEEL_BITS * WHEEL_LEVEL)) - 1) == 0 and self.__overflow:
+                self.__cascade(self.__overflow, None)
+            for level in range(WHEEL_LEVEL - 1, 0, -1):
+                if current & ((1 << (WHEEL_BITS * level)) - 1) == 0:
+                    slot = self.__level_list[level][(current >> (WHEEL_BITS * level)) & WHEEL_MASK]
+                    if slot:
+                        self.__cascade(slot, level)
+
+            slot = self.__level_list[0][current & WHEEL_MASK]
+            if slot:
+                expired_list.extend(slot)
+                level_count_list[0] -= len(slot)
+                for key in slot:
+                    del self.__location_map[key]
+                slot.clear()
+
+        # keys cascaded right onto the current tick
+        if self.__due:
+            expired_list.extend(self.__due)
+            for key in self.__due:
+                del self.__location_map[key]
+            self.__due = {}
+        return expired_list
+
+    def __cascade(self, slot: dict, level: int):
+        item_list = list(slot.items())
+        slot.clear()
+        if level != None:
+            self.__level_count_list[level] -= len(item_list)
+        location_map = self.__location_map
+        for key, deadline in item_list:
+            del location_map[key]
+            self.add(key, deadline)
+
+
+class RowExpiry:
+    # deadlines of the rows of a table by unique key, fed by the change list
+    # of every change: a delete drops the row's deadline, an insert or
+    # update (re)arms it to ttl seconds from now when the table has a ttl.
+    # Rows given their own ttl keep it until their next change
+    def __init__(self, ttl: float, key_getter) -> None:
+        self.ttl = ttl
+        self.__key_getter = key_getter
+        self.__wheel = TimerWheel(self.__tick(time.monotonic()))
+        # monotonic time of the next tick, nothing is due before
+        self.__next_time = 0.0
+
+    def __tick(self, now: float) -> int:
+        return int(now / EXPIRY_TICK)
+
+    def __deadline(self, now: float, ttl: float) -> int:
+        # rounded up, a row never expires early
+        return -int(-(now + ttl) // EXPIRY_TICK)
+
+    def __len__(self) -> int:
+        return len(self.__wheel)
+
+    def apply(self, change_list: list):
+        key_getter = self.__key_getter
+        ttl = self.ttl
+        wheel = self.__wheel
+        deadline = None if ttl == None else self.__deadline(time.monotonic(), ttl)
+        for old_key_value, new_key_value in change_list:
+            if new_key_value == None:
+                wheel.remove(key_getter(old_key_value))
+            elif deadline != None:
+                wheel.add(key_getter(new_key_value), deadline)
+        if wheel.has_due():
+            self.__next_time = 0.0
+
+    def set(self, value_key: tuple, ttl: float):
+        # None: the row never expires
+        if ttl == None:
+            self.__wheel.remove(value_key)
+            return
+
+        self.__wheel.add(value_key, self.__deadline(time.monotonic(), ttl))
+        if self.__wheel.has_due():
+            self.__next_time = 0.0
+
+    def remaining(self, value_key: tuple) -> float:
+        deadline = self.__wheel.deadline(value_key)
+        if deadline == None:
+            return None
+        return max(0.0, deadline * EXPIRY_TICK - time.monotonic())
+
+    def pending(self, now: float) -> bool:
+        # cheap check whether due() may find something
+        return len(self.__wheel) > 0 and now >= self.__next_time
+
+    def due(self, now: float) -> list:
+        # unique keys of the rows expired by now, they leave the wheel
+        tick = self.__tick(now)
+        expired_list = self.__wheel.advance(tick)
+        self.__next_time = (tick + 1) * EXPIRY_TICK
+        return expired_list
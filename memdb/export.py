@@ -0,0 +1,154 @@
+import csv
+import json
+from operator import itemgetter
+
+# rows per chunk read from the table and per write to the output
+EXPORT_CHUNK = 1024
+
+
+class ColumnWidth:
+    # widest str() of every column (or its name) over the rows of a table,
+    # kept as {length: row count} per column so deletes are O(1) too
+    def __init__(self, name_list: list) -> None:
+        self.name_list = name_list
+        self.__length_count_map = {name: {} for name in name_list}
+
+    def apply(self, change_list: list):
+        length_count_map = self.__length_count_map
+        for old_key_value, new_key_value in change_list:
+            for name in self.name_list:
+                old_length = None if old_key_value == None else len(str(old_key_value[name]))
+                new_length = None if new_key_value == None else len(str(new_key_value[name]))
+                if old_length == new_length:
+                    continue
+
+                length_count = length_count_map[name]
+                if old_length != None:
+                    if length_count[old_length] == 1:
+                        del length_count[old_length]
+                    else:
+                        length_count[old_length] -= 1
+                if new_length != None:
+                    length_count[new_length] = length_count.get(new_length, 0) + 1
+
+    def width_map(self) -> dict:
+        return {name: max([len(name)] + list(self.__length_count_map[name])) for name in self.name_list}
+
+
+class SocketWriter:
+    # write(str) over a socket, for outputs without write()
+    def __init__(self, sock, encoding: str = 'utf-8') -> None:
+        self.__sock = sock
+        self.__encoding = encoding
+
+    def write(self, text: str):
+        self.__sock.sendall(text.encode(self.__encoding))
+
+
+def make_writer(out):
+    # text file, socket or anything else with write(str)
+    if not hasattr(out, 'write') and hasattr(out, 'sendall'):
+        return SocketWriter(out)
+    return out
+
+
+def write_text(out, name_list: list, width_map: dict, chunk_iter) -> int:
+    # aligned table, the same layout as str(table)
+    row_format = '| ' + ''.join([f'%{width_map[name]}s | ' for name in name_list]) + '\n'
+    out.write(row_format % tuple(name_list))
+
+    # a tuple of the values even for a single column
+    value_getter = itemgetter(*name_list) if len(name_list) > 1 else lambda key_value: (key_value[name_list[0]],)
+    row_count = 0
+    for key_value_list in chunk_iter:
+        out.write(''.join([row_format % value_getter(key_value) for key_value in key_value_list]))
+        row_count += len(key_value_list)
+    return row_count
+
+
+class ChunkBuffer:
+    # what csv.writer writes for one chunk, joined into one write
+    def __init__(self) -> None:
+        self.text_list = []
+
+    def write(self, text: str):
+        self.text_list.append(text)
+
+    def take(self) -> str:
+        text = ''.join(self.text_list)
+        self.text_list = []
+        return text
+
+
+def write_csv(out, name_list: list, chunk_iter, header: bool = True) -> int:
+    # None is written as an empty field
+    buffer = ChunkBuffer()
+    writer = csv.writer(buffer, lineterminator='\n')
+    value_getter = itemgetter(*name_list) if len(name_list) > 1 else lambda key_value: (key_value[name_list[0]],)
+    if header:
+        writer.writerow(name_list)
+
+    row_count = 0
+    for key_value_list in chunk_iter:
+        writer.writerows(map(value_getter, key_value_list))
+        out.write(buffer.take())
+        row_count += len(key_value_list)
+    out.write(buffer.take())
+    return row_count
+
+
+def write_jsonl(out, name_list: list, chunk_iter) -> int:
+    # one JSON object per row, values json cannot encode as their str();
+    # key values hold every column in member order already
+    encode = json.JSONEncoder(default=str).encode
+    row_count = 0
+    for key_value_list in chunk_iter:
+        out.write('\n'.join(map(encode, key_value_list)) + '\n')
+        row_count += len(key_value_list)
+    return row_count
+
+
+def read_csv(file, member_list: list, header: bool = True):
+    # rows as dicts, values converted to the Field types up front so the
+    # bulk insert takes its fast path (a value that does not convert is
+    # left as is for the table to reject), an empty field as None. Without
+    # a header the columns are in member order
+    type_map = {x.name: x.type for x in member_list}
+    name_list = [x.name for x in member_list]
+    reader = csv.reader(file)
+    if header:
+        row = next(reader, None)
+        if row == None:
+            return
+        name_list = row
+
+    convert_list = [type_map.get(name) for name in name_list]
+    for row in reader:
+        key_value = {}
+        for name, convert, value in zip(name_list, convert_list, row):
+            if value == '':
+                value = None
+            elif convert != None and convert is not str:
+                try:
+                    value = convert(value)
+                except (TypeError, ValueError):
+                    pass
+            key_value[name] = value
+        yield key_value
+
+
+def read_jsonl(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_chunks(row_iter, size: int = EXPORT_CHUNK):
+    chunk = []
+    for row in row_iter:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
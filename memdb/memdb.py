@@ -1,11 +1,23 @@
+import heapq
+import io
+import sys
+import threading
+import time
+from array import array
+from collections import deque
+from itertools import islice, repeat
+from operator import itemgetter
 from typing import List
-import hashlib
 
-
-def get_hash(key_set: list):
-    h = hashlib.new('sha256')
-    h.update('_'.join(key_set).encode('utf-8'))
-    return h.hexdigest()
+from aggregate import MATERIALIZED_OP_LIST, MATERIALIZED_TYPE_MAP, MaterializedAggregate
+from cache import QueryCache
+from expiry import RowExpiry
+from export import (EXPORT_CHUNK, ColumnWidth, iter_chunks, make_writer, read_csv, read_jsonl, write_csv,
+                    write_jsonl, write_text)
+from scan import AGGREGATE_OP_LIST, aggregate_rows, normalize, scan_row_ids, to_typed
+from sortedlist import GREATEST, SortedKeyList
+from stats import OpStats, index_stats, prometheus_text, sample_bytes
+from watch import OVERFLOW_BLOCK, Watch
 
 
 class Field:
@@ -16,169 +28,1861 @@ class Field:
 
 
 class Data:
-    def __init__(self, key_value: dict):
+    __slots__ = ('key_value', 'row_id')
+
+    def __init__(self, key_value: dict, row_id: int = None):
         self.key_value = key_value
+        self.row_id = row_id
+
+
+class RowView:
+    # live view of a row in a ColumnStore, valid until the row is deleted
+    # or the table is compacted
+    __slots__ = ('store', 'row_id')
+
+    def __init__(self, store: 'ColumnStore', row_id: int):
+        self.store = store
+        self.row_id = row_id
+
+    @property
+    def key_value(self) -> dict:
+        return self.store.key_value(self.row_id)
+
+
+def make_key_getter(key_set: tuple):
+    # index keys are always tuples, even for a single column
+    if len(key_set) == 0:
+        return lambda key_value: ()
+    if len(key_set) == 1:
+        name = key_set[0]
+        return lambda key_value: (key_value[name],)
+
+    return itemgetter(*key_set)
+
+
+# an index bucket is a bare row id while it holds one row and a set of row
+# ids once it holds more, so the buckets of unique-ish key sets never pay
+# for a set object
+# for ordered indexes, bucket_add/bucket_remove tell whether the key itself
+# was added to or removed from the index
+def bucket_add(index: dict, value_key: tuple, row_id: int) -> bool:
+    bucket = index.get(value_key)
+    if bucket is None:
+        index[value_key] = row_id
+        return True
+
+    if type(bucket) is int:
+        index[value_key] = {bucket, row_id}
+    else:
+        bucket.add(row_id)
+    return False
+
+
+def bucket_remove(index: dict, value_key: tuple, row_id: int) -> bool:
+    bucket = index[value_key]
+    if type(bucket) is int:
+        del index[value_key]
+        return True
+
+    bucket.discard(row_id)
+    if len(bucket) == 1:
+        index[value_key] = next(iter(bucket))
+    return False
+
+
+# keys with a None in them cannot be ordered, those rows are only reachable
+# through the hash index of the key set
+def ordered_add(ordered: SortedKeyList, value_key: tuple):
+    if ordered != None and None not in value_key:
+        ordered.add(value_key)
+
+
+def ordered_remove(ordered: SortedKeyList, value_key: tuple):
+    if ordered != None and None not in value_key:
+        ordered.remove(value_key)
+
+
+def make_plan(explain: bool, kind: str, key_set_list: list, residual, estimate: float) -> dict:
+    if not explain:
+        return None
+    return {
+        "plan": kind,
+        "key_set_list": [list(x) for x in key_set_list],
+        "residual": sorted(residual),
+        "estimate": estimate,
+    }
+
+
+def make_validator(member_list: List[Field]):
+    # builds validate(key_value) for one schema: a new dict with every
+    # column, in member order and of its Field type (converted when it is
+    # not, None kept as is), or None when a column is missing, unknown or
+    # cannot be converted exactly (see scan.to_typed, port_no=7.9 is not
+    # stored as 7); names and types are checked by straight line
+    # code instead of set compares and loops
+    line_list = ['def validate(key_value):',
+                 f'    if len(key_value) != {len(member_list)}:',
+                 '        return None',
+                 '    try:']
+    for i, field in enumerate(member_list):
+        line_list.append(f'        v{i} = key_value[{field.name!r}]')
+    line_list += ['    except KeyError:',
+                  '        return None']
+    for i, field in enumerate(member_list):
+        line_list += [f'    if v{i} is not None and type(v{i}) is not t{i}:',
+                      '        try:',
+                      f'            v{i} = to_typed(v{i}, t{i})',
+                      '        except (TypeError, ValueError):',
+                      '            return None']
+    line_list.append('    return {' + ', '.join([f'{field.name!r}: v{i}' for i, field in enumerate(member_list)]) + '}')
+
+    namespace = {f't{i}': field.type for i, field in enumerate(member_list)}
+    namespace['to_typed'] = to_typed
+    exec('\n'.join(line_list), namespace)
+    return namespace['validate']
+
+
+def make_event(old_key_value: dict, new_key_value: dict) -> dict:
+    if old_key_value == None:
+        return {"op": "insert", "old": None, "new": dict(new_key_value)}
+    if new_key_value == None:
+        return {"op": "delete", "old": dict(old_key_value), "new": None}
+    return {"op": "update", "old": dict(old_key_value), "new": dict(new_key_value)}
+
+
+def bucket_row_ids(bucket) -> set:
+    if bucket is None:
+        return ()
+    if type(bucket) is int:
+        return (bucket,)
+    return bucket
+
+
+class RowStore:
+    # one Data object per row, rows live in slots addressed by row id,
+    # deleted slots are None and go to the free list to be reused
+    def __init__(self, member_list: List[Field], snapshot_view: bool = False) -> None:
+        self.name_list = [x.name for x in member_list]
+        # snapshot views are copies that later changes do not reach
+        self.snapshot_view = snapshot_view
+        self.data: List[Data] = []
+        self.free_list: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.data) - len(self.free_list)
+
+    def slot_count(self) -> int:
+        return len(self.data)
+
+    def check(self, key_value: dict) -> bool:
+        return True
+
+    def check_column(self, name: str, value_list: list) -> bool:
+        return True
+
+    def alloc(self, key_value: dict) -> int:
+        data = Data(key_value)
+        if self.free_list:
+            data.row_id = self.free_list.pop()
+            self.data[data.row_id] = data
+        else:
+            data.row_id = len(self.data)
+            self.data.append(data)
+        return data.row_id
+
+    def alloc_many(self, key_value_list: List[dict]) -> List[int]:
+        reuse_count = min(len(self.free_list), len(key_value_list))
+        row_id_list = [self.alloc(key_value) for key_value in key_value_list[:reuse_count]]
+
+        start = len(self.data)
+        self.data.extend(map(Data, key_value_list[reuse_count:], range(start, start + len(key_value_list) - reuse_count)))
+        row_id_list.extend(range(start, len(self.data)))
+        return row_id_list
+
+    def free(self, row_id_list: List[int]):
+        data = self.data
+        for row_id in row_id_list:
+            data[row_id].row_id = None
+            data[row_id] = None
+        self.free_list.extend(row_id_list)
+
+    def replace(self, row_id: int, key_value: dict):
+        self.data[row_id].key_value = key_value
+
+    def key_value(self, row_id: int) -> dict:
+        return self.data[row_id].key_value
+
+    def view(self, row_id: int) -> Data:
+        if self.snapshot_view:
+            return Data(self.data[row_id].key_value, row_id)
+        return self.data[row_id]
+
+    def row_ids(self) -> List[int]:
+        return [data.row_id for data in self.data if data != None]
+
+    def iter_row_ids(self):
+        for data in self.data:
+            if data != None:
+                yield data.row_id
+
+    def key_values(self, start: int, stop: int) -> List[dict]:
+        # key values of the live rows in slots [start, stop)
+        return [data.key_value for data in self.data[start:stop] if data != None]
+
+    def project(self, row_id: int, name_list: List[str]) -> dict:
+        key_value = self.data[row_id].key_value
+        return {name: key_value[name] for name in name_list}
+
+    def key_tuples(self, row_id_list: List[int], key_set: tuple) -> list:
+        # the index keys of key_set of the rows, see make_key_getter
+        data = self.data
+        key_getter = make_key_getter(key_set)
+        return [key_getter(data[row_id].key_value) for row_id in row_id_list]
+
+    def nbytes(self) -> int:
+        # estimated from a sample of the rows: Data, dict and values
+        def row_bytes(data: Data) -> int:
+            if data == None:
+                return 0
+            key_value = data.key_value
+            return sys.getsizeof(data) + sys.getsizeof(key_value) + sum(map(sys.getsizeof, key_value.values()))
+        return sys.getsizeof(self.data) + sample_bytes(self.data, len(self.data), row_bytes)
+
+    def columns(self) -> dict:
+        key_value_list = [data.key_value for data in self.data if data != None]
+        return {name: list(map(itemgetter(name), key_value_list)) for name in self.name_list}
+
+    def views(self) -> List[Data]:
+        if self.snapshot_view:
+            return [Data(data.key_value, data.row_id) for data in self.data if data != None]
+        return [data for data in self.data if data != None]
+
+    def compact(self) -> dict:
+        remap = {}
+        data_list = []
+        for data in self.data:
+            if data == None:
+                continue
+            remap[data.row_id] = len(data_list)
+            data.row_id = len(data_list)
+            data_list.append(data)
+
+        self.data = data_list
+        self.free_list = []
+        return remap
+
+
+# array typecode per Field type, other types are kept in plain lists
+COLUMN_TYPECODE_MAP = {
+    int: 'q',
+    float: 'd',
+}
+
+COLUMN_INT_MIN = -2 ** 63
+COLUMN_INT_MAX = 2 ** 63 - 1
+
+
+class ColumnStore:
+    # one column per Field, int/float fields are packed into arrays and str
+    # values are interned, so a row costs a few machine words instead of a
+    # Data object and a dict
+    def __init__(self, member_list: List[Field], snapshot_view: bool = False) -> None:
+        self.name_list = [x.name for x in member_list]
+        self.snapshot_view = snapshot_view
+        self.column_map = {}
+        self.intern_name_set = set()
+        for field in member_list:
+            typecode = COLUMN_TYPECODE_MAP.get(field.type)
+            self.column_map[field.name] = array(typecode) if typecode else []
+            if field.type is str:
+                self.intern_name_set.add(field.name)
+        self.column_item_list = list(self.column_map.items())
+        self.alive = bytearray()
+        self.free_list: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.alive) - len(self.free_list)
+
+    def slot_count(self) -> int:
+        return len(self.alive)
+
+    def check(self, key_value: dict) -> bool:
+        # array columns cannot hold None or out of range ints, check up
+        # front so that a bad row never leaves the columns half written
+        for name, column in self.column_item_list:
+            if type(column) is not array:
+                continue
+            value = key_value[name]
+            if value is None:
+                return False
+            if column.typecode == 'q' and not COLUMN_INT_MIN <= value <= COLUMN_INT_MAX:
+                return False
+        return True
+
+    def check_column(self, name: str, value_list: list) -> bool:
+        column = self.column_map[name]
+        if type(column) is not array or len(value_list) == 0:
+            return True
+        if None in value_list:
+            return False
+        if column.typecode == 'q':
+            return COLUMN_INT_MIN <= min(value_list) and max(value_list) <= COLUMN_INT_MAX
+        return True
+
+    def alloc(self, key_value: dict) -> int:
+        intern_name_set = self.intern_name_set
+        if self.free_list:
+            row_id = self.free_list.pop()
+            for name, column in self.column_item_list:
+                value = key_value[name]
+                if name in intern_name_set and value is not None:
+                    value = sys.intern(value)
+                column[row_id] = value
+            self.alive[row_id] = 1
+        else:
+            row_id = len(self.alive)
+            for name, column in self.column_item_list:
+                value = key_value[name]
+                if name in intern_name_set and value is not None:
+                    value = sys.intern(value)
+                column.append(value)
+            self.alive.append(1)
+        return row_id
+
+    def alloc_many(self, key_value_list: List[dict]) -> List[int]:
+        reuse_count = min(len(self.free_list), len(key_value_list))
+        row_id_list = [self.alloc(key_value) for key_value in key_value_list[:reuse_count]]
+
+        # column at a time, the rest is appended in one extend per column
+        rest = key_value_list[reuse_count:]
+        start = len(self.alive)
+        for name, column in self.column_item_list:
+            value_list = [key_value[name] for key_value in rest]
+            if name in self.intern_name_set:
+                intern = sys.intern
+                value_list = [value if value is None else intern(value) for value in value_list]
+            column.extend(value_list)
+        self.alive.extend(b'\x01' * len(rest))
+        row_id_list.extend(range(start, len(self.alive)))
+        return row_id_list
+
+    def free(self, row_id_list: List[int]):
+        alive = self.alive
+        for row_id in row_id_list:
+            alive[row_id] = 0
+        # drop references held by list columns, array slots are just reused
+        for name, column in self.column_item_list:
+            if type(column) is array:
+                continue
+            for row_id in row_id_list:
+                column[row_id] = None
+        self.free_list.extend(row_id_list)
+
+    def replace(self, row_id: int, key_value: dict):
+        intern_name_set = self.intern_name_set
+        for name, column in self.column_item_list:
+            value = key_value[name]
+            if name in intern_name_set and value is not None:
+                value = sys.intern(value)
+            column[row_id] = value
+
+    def key_value(self, row_id: int) -> dict:
+        return {name: column[row_id] for name, column in self.column_item_list}
+
+    def view(self, row_id: int) -> RowView:
+        if self.snapshot_view:
+            return Data(self.key_value(row_id), row_id)
+        return RowView(self, row_id)
+
+    def row_ids(self) -> List[int]:
+        alive = self.alive
+        return [row_id for row_id in range(len(alive)) if alive[row_id]]
+
+    def iter_row_ids(self):
+        alive = self.alive
+        return (row_id for row_id in range(len(alive)) if alive[row_id])
+
+    def key_values(self, start: int, stop: int) -> List[dict]:
+        key_value = self.key_value
+        alive = self.alive
+        return [key_value(row_id) for row_id in range(start, min(stop, len(alive))) if alive[row_id]]
+
+    def project(self, row_id: int, name_list: List[str]) -> dict:
+        # only the columns asked for are read
+        column_map = self.column_map
+        return {name: column_map[name][row_id] for name in name_list}
+
+    def key_tuples(self, row_id_list: List[int], key_set: tuple) -> list:
+        # each key column read once for all the rows, no dict per row
+        if len(key_set) == 0 or len(row_id_list) < 2:
+            return [tuple([self.column_map[name][row_id] for name in key_set]) for row_id in row_id_list]
+        getter = itemgetter(*row_id_list)
+        return list(zip(*[getter(self.column_map[name]) for name in key_set]))
+
+    def nbytes(self) -> int:
+        # arrays exactly, list columns from a sample of their values
+        total = sys.getsizeof(self.alive)
+        for name, column in self.column_item_list:
+            total += sys.getsizeof(column)
+            if type(column) is not array:
+                total += sample_bytes(column, len(column), lambda value: 0 if value is None else sys.getsizeof(value))
+        return total
+
+    def columns(self) -> dict:
+        if len(self.free_list) == 0:
+            return {name: column[:] for name, column in self.column_item_list}
+
+        row_id_list = self.row_ids()
+        column_map = {}
+        for name, column in self.column_item_list:
+            value_list = [column[row_id] for row_id in row_id_list]
+            column_map[name] = array(column.typecode, value_list) if type(column) is array else value_list
+        return column_map
+
+    def views(self) -> List[RowView]:
+        alive = self.alive
+        view = self.view
+        return [view(row_id) for row_id in range(len(alive)) if alive[row_id]]
+
+    def compact(self) -> dict:
+        alive = self.alive
+        row_id_list = [row_id for row_id in range(len(alive)) if alive[row_id]]
+        remap = {row_id: i for i, row_id in enumerate(row_id_list)}
+
+        for name, column in self.column_item_list:
+            if type(column) is array:
+                packed = array(column.typecode, [column[x] for x in row_id_list])
+            else:
+                packed = [column[x] for x in row_id_list]
+            self.column_map[name] = packed
+        self.column_item_list = list(self.column_map.items())
+        self.alive = bytearray(b'\x01' * len(row_id_list))
+        self.free_list = []
+        return remap
+
+
+# compaction runs once more than half of the slots are free
+COMPACT_MIN_SLOT = 1024
+
+# the planner stops intersecting posting lists once this few rows are left
+PLAN_INTERSECT_MIN = 8
+
+# optimistic reads tried before a concurrent reader takes the write lock
+READ_RETRY_COUNT = 16
 
 
 class Table:
-    def __init__(self, member_list: List[Field], key_set_list: List[list]) -> None:
+    def __init__(self, member_list: List[Field], key_set_list: List[list], compact: bool = False,
+                 ordered_key_set_list: List[list] = None, concurrent: bool = False,
+                 cache_size: int = 0, ttl: float = None, expire_callback=None,
+                 instrument: bool = False) -> None:
         self.__member_list = member_list
         self.__member_name_set = [x.name for x in member_list]
+        self.__member_name_frozenset = frozenset(self.__member_name_set)
+        self.__member_type_map = {x.name: x.type for x in member_list}
+        self.__validate = make_validator(member_list)
+        # changed column set -> key infos of the indexes over those columns
+        self.__changed_key_info_map = {}
         self.__key_info_list = []
-        self.__data: list[Data] = []
+        # compact keeps rows in typed columns instead of one Data per row
+        self.__compact_mode = compact
+        # concurrent: one writer at a time (write lock) and lock-free readers
+        # that retry when a change ran meanwhile, see __read
+        self.__write_lock = threading.Lock() if concurrent else None
+        # odd while a change is being applied
+        self.__version = 0
+        self.__store = self.__new_store()
         self.__index_map = {}
-        for key_set in key_set_list:
-            key_set_hash = get_hash(key_set)
-            self.__key_info_list.append(
-                {"key_set": key_set, "key_set_hash": key_set_hash})
-            if key_set_hash not in self.__index_map:
-                self.__index_map[key_set_hash] = {}
+        # ordered key sets also keep their keys sorted for range queries,
+        # they are indexed like any other key set as well
+        ordered_key_set_list = [tuple(x) for x in ordered_key_set_list or []]
+        for key_set in key_set_list + ordered_key_set_list:
+            key_set = tuple(key_set)
+            if key_set in self.__index_map:
+                continue
+            self.__key_info_list.append({
+                "key_set": key_set,
+                "key_name_set": frozenset(key_set),
+                "key_getter": make_key_getter(key_set),
+                "ordered": SortedKeyList() if key_set in ordered_key_set_list else None})
+            self.__index_map[key_set] = {}
         # unique
-        self.__unique_key_set = key_set_list[0]
-        self.__unique_key_set_hash = get_hash(self.__unique_key_set)
-        self.__unique_index = self.__index_map[self.__unique_key_set_hash]
+        self.__unique_key_info = self.__key_info_list[0]
+        self.__unique_key_set = self.__unique_key_info["key_set"]
+        self.__unique_index = self.__index_map[self.__unique_key_set]
+        # query column set -> (row count when planned, candidate list, prefix key info)
+        self.__plan_cache = {}
+        self.__wal = None
+        # watched column set -> (key getter, {filter key: (Watch, ...)}),
+        # replaced as a whole on watch/unwatch so a writer can walk it
+        # without a lock
+        self.__watch_group_map = {}
+        self.__watch_lock = threading.Lock()
+        # {Watch: events} of the changes made, pushed in change order
+        # outside the write lock by one thread at a time, see __deliver
+        self.__deliver_queue = deque()
+        self.__deliver_lock = threading.Lock()
+        self.__delivering = False
+        # (old, new) key values of the rows the running change touched,
+        # collected only while someone watches, the cache is on or a change
+        # consumer is kept
+        self.__change_list = None
+        # get/getOne results of up to cache_size queries, see cache.QueryCache
+        self.__cache = QueryCache(cache_size) if cache_size > 0 else None
+        # state kept up to date from the change list, each with
+        # apply(change_list): materialized aggregates, the row expiry and
+        # the text export column widths; replaced as a whole
+        self.__change_consumer_list = []
+        # name -> MaterializedAggregate
+        self.__aggregate_map = {}
+        # rows expire ttl seconds after their last insert/update (or after
+        # their own ttl, see setTtl); expired rows are deleted when a read or
+        # write finds them due, by sweep() or by the background sweeper, and
+        # expire_callback gets their key values
+        self.__expiry = None
+        if ttl != None:
+            self.__with_expiry().ttl = ttl
+        self.__expire_callback = expire_callback
+        self.__sweeper = None
+        # created by the first text export, see export.ColumnWidth
+        self.__column_width = None
+        # instrument: count and time insert/get/update/delete, see stats()
+        self.__op_stats = OpStats(["insert", "get", "update", "delete"]) if instrument else None
+        self.__expired_count = 0
+
+    def __new_store(self):
+        store_type = ColumnStore if self.__compact_mode else RowStore
+        return store_type(self.__member_list, snapshot_view=self.__write_lock != None)
 
-    def __insert_data_to_index(self, data: Data):
+    def __insert_data_to_index(self, row_id: int, key_value: dict):
         for key_info in self.__key_info_list:
-            index: dict = self.__index_map[key_info["key_set_hash"]]
+            index: dict = self.__index_map[key_info["key_set"]]
 
-            value_hash = self.__get_value_hash(
-                key_info["key_set"], data.key_value)
-            if value_hash not in index:
-                index[value_hash] = []
-            index[value_hash].append(data)
+            value_key = key_info["key_getter"](key_value)
+            if bucket_add(index, value_key, row_id):
+                ordered_add(key_info["ordered"], value_key)
 
-    def __delete_data_from_index(self, data: Data):
-        for key_info in self.__key_info_list:
-            index: dict = self.__index_map[key_info["key_set_hash"]]
+    def __updata_data_in_index(self, row_id: int, old_key_value: dict, new_key_value: dict,
+                               key_info_list: List[dict]):
+        for key_info in key_info_list:
+            index: dict = self.__index_map[key_info["key_set"]]
+
+            key_getter = key_info["key_getter"]
+            old_value_key = key_getter(old_key_value)
+            new_value_key = key_getter(new_key_value)
+            if old_value_key != new_value_key:
+                ordered: SortedKeyList = key_info["ordered"]
+                if bucket_remove(index, old_value_key, row_id):
+                    ordered_remove(ordered, old_value_key)
+                if bucket_add(index, new_value_key, row_id):
+                    ordered_add(ordered, new_value_key)
+
+    def __get_unique_row_id(self, key_value: dict) -> int:
+        value_key = self.__unique_key_info["key_getter"](key_value)
+        bucket = self.__unique_index.get(value_key)
+        if bucket is None or type(bucket) is int:
+            return bucket
 
-            value_hash = self.__get_value_hash(
-                key_info["key_set"], data.key_value)
-            index[value_hash].remove(data)
+        return next(iter(bucket))
 
-    def __updata_data_in_index(self, data: Data, old_key_value: dict, new_key_value: dict):
+    def __delete_rows(self, row_id_list: List[int], whole_bucket: tuple = None):
+        # index-major so that each index is walked once for the whole batch:
+        # its keys read column-wise by the store and popped in one go, only
+        # the buckets of several rows are then handled one by one;
+        # whole_bucket is (key_set, value_key) of a bucket being emptied,
+        # dropped as a whole
         for key_info in self.__key_info_list:
-            index: dict = self.__index_map[key_info["key_set_hash"]]
-
-            old_value_hash = self.__get_value_hash(
-                key_info["key_set"], old_key_value)
-            new_value_hash = self.__get_value_hash(
-                key_info["key_set"], new_key_value)
-            if old_value_hash != new_value_hash:
-                index[old_value_hash].remove(data)
-
-                if new_value_hash not in index:
-                    index[new_value_hash] = []
-                index[new_value_hash].append(data)
-
-    def __get_data_list(self, key_info: List[dict], key_value: dict) -> List[Data]:
-        ret = []
-        value_hash = self.__get_value_hash(key_info['key_set'], key_value)
-        index: dict = self.__index_map[key_info['key_set_hash']]
-        if value_hash not in index:
-            return ret
+            index: dict = self.__index_map[key_info["key_set"]]
+            ordered: SortedKeyList = key_info["ordered"]
+            if whole_bucket != None and whole_bucket[0] == key_info["key_set"]:
+                del index[whole_bucket[1]]
+                ordered_remove(ordered, whole_bucket[1])
+                continue
 
-        for data in index[value_hash]:
-            if key_value.items() <= data.key_value.items():
-                ret.append(data)
-        return ret
+            key_list = self.__store.key_tuples(row_id_list, key_info["key_set"])
+            # a key seen again was a set bucket popped earlier in the batch
+            bucket_list = list(map(index.pop, key_list, repeat(None, len(key_list))))
+            if ordered == None and set(map(type, bucket_list)) == {int}:
+                # rows alone in their buckets, the common case
+                continue
+            rest_map = {}
+            for i in [i for i, bucket in enumerate(bucket_list) if type(bucket) is not int]:
+                bucket = bucket_list[i]
+                if bucket is None:
+                    bucket = rest_map[key_list[i]]
+                else:
+                    rest_map[key_list[i]] = bucket
+                bucket.discard(row_id_list[i])
 
-    def __get_unique(self, key_value: dict) -> Data:
-        unique_value_hash = self.__get_value_hash(
-            self.__unique_key_set, key_value)
-        if unique_value_hash not in self.__unique_index:
-            return None
+            for value_key, bucket in rest_map.items():
+                if len(bucket) > 0:
+                    index[value_key] = next(iter(bucket)) if len(bucket) == 1 else bucket
+            if ordered != None:
+                for value_key, bucket in zip(key_list, bucket_list):
+                    if type(bucket) is int or (bucket is not None and len(bucket) == 0):
+                        ordered_remove(ordered, value_key)
 
-        data_value_list: list[Data] = self.__unique_index[unique_value_hash]
-        for data_value in data_value_list:
-            found = True
-            for key in self.__unique_key_set:
-                if data_value.key_value[key] != key_value[key]:
-                    found = False
-                    break
-            if found == True:
-                return data_value
+        self.__store.free(row_id_list)
 
-        return None
+    def __compact(self):
+        # renumber live rows into the front slots and remap every index,
+        # O(n) but only after n/2 deletes so it is amortized O(1) per delete
+        remap = self.__store.compact()
+        # cached row ids are stale
+        if self.__cache != None:
+            self.__cache.clear()
+        for index in self.__index_map.values():
+            for value_key, bucket in index.items():
+                if type(bucket) is int:
+                    index[value_key] = remap[bucket]
+                else:
+                    index[value_key] = {remap[row_id] for row_id in bucket}
 
-    def __get_value_hash(self, key_set: List[str], key_value: dict):
-        return get_hash([str(key_value[key]) for key in key_set])
+    def __maybe_compact(self):
+        slot_count = self.__store.slot_count()
+        if slot_count >= COMPACT_MIN_SLOT and len(self.__store) * 2 < slot_count:
+            self.__compact()
 
-    def insert(self, *args, **kwargs) -> bool:
-        key_value = dict(kwargs)
-        if set(key_value.keys()) != set(self.__member_name_set):
+    def __to_typed(self, key_value: dict) -> dict:
+        # values are stored as the declared Field type so that index keys
+        # compare the same way no matter how the caller spelled them
+        # (dpid=1 and dpid='1' land in the same bucket); None is kept as is.
+        # A number the type would change (port_no=0.5) is rejected, not
+        # truncated onto another row
+        for name, value in key_value.items():
+            member_type = self.__member_type_map.get(name)
+            if member_type is None or value is None or type(value) is member_type:
+                continue
+            try:
+                key_value[name] = to_typed(value, member_type)
+            except (TypeError, ValueError):
+                return None
+
+        return key_value
+
+    def __insert(self, key_value: dict) -> bool:
+        key_value = self.__validate(key_value)
+        if key_value == None:
+            return False
+
+        if self.__get_unique_row_id(key_value) != None:
             return False
 
-        unique_data = self.__get_unique(key_value)
-        if unique_data != None:
+        if not self.__store.check(key_value):
             return False
 
-        newData = Data(key_value)
-        self.__data.append(newData)
-        self.__insert_data_to_index(newData)
+        row_id = self.__store.alloc(key_value)
+        self.__insert_data_to_index(row_id, key_value)
+        if self.__change_list != None:
+            self.__change_list.append((None, key_value))
 
         return True
 
-    def update(self, *args, **kwargs):
-        key_value = dict(kwargs)
-        if set(key_value.keys()) != set(self.__member_name_set):
+    def __filter_batch(self, row_list: list, key_value_list: List[dict], rejected_list: list) -> List[dict]:
+        # whole batch checks first, column by column; only when one of them
+        # fails the rows are checked one by one to find the bad ones
+        member_name_set = set(self.__member_name_set)
+        store = self.__store
+        batch_valid = all([key_value.keys() == member_name_set for key_value in key_value_list])
+        for field in self.__member_list:
+            if not batch_valid:
+                break
+            value_list = list(map(itemgetter(field.name), key_value_list))
+            type_set = set(map(type, value_list))
+            type_set.discard(type(None))
+            batch_valid = type_set <= {field.type} and store.check_column(field.name, value_list)
+
+        if not batch_valid:
+            valid_list = []
+            for row, key_value in zip(row_list, key_value_list):
+                key_value = self.__validate(key_value)
+                if key_value == None or not store.check(key_value):
+                    rejected_list.append(row)
+                    continue
+                valid_list.append((row, key_value))
+            row_list = [row for row, key_value in valid_list]
+            key_value_list = [key_value for row, key_value in valid_list]
+
+        unique_key_list = list(map(self.__unique_key_info["key_getter"], key_value_list))
+        unique_key_set = set(unique_key_list)
+        if len(unique_key_set) == len(unique_key_list) and self.__unique_index.keys().isdisjoint(unique_key_set):
+            return key_value_list
+
+        unique_key_set = set()
+        valid_list = []
+        for row, key_value, unique_key in zip(row_list, key_value_list, unique_key_list):
+            if unique_key in self.__unique_index or unique_key in unique_key_set:
+                rejected_list.append(row)
+                continue
+            unique_key_set.add(unique_key)
+            valid_list.append(key_value)
+        return valid_list
+
+    def __insert_many(self, row_list: list) -> List[dict]:
+        # validate the whole batch, then fill every index in one pass per
+        # index; rows that are invalid or hit the unique key (in the table or
+        # earlier in the batch) are skipped and returned
+        rejected_list = []
+        key_value_list = self.__filter_batch(
+            row_list, [dict(row) for row in row_list], rejected_list)
+
+        row_id_list = self.__store.alloc_many(key_value_list)
+        if self.__change_list != None:
+            self.__change_list.extend([(None, key_value) for key_value in key_value_list])
+        for key_info in self.__key_info_list:
+            index: dict = self.__index_map[key_info["key_set"]]
+            key_set = key_info["key_set"]
+            if len(key_set) == 1:
+                value_key_list = list(zip(map(itemgetter(key_set[0]), key_value_list)))
+            else:
+                value_key_list = list(map(key_info["key_getter"], key_value_list))
+
+            # every key new and distinct: one C level dict update
+            new_index = dict(zip(value_key_list, row_id_list))
+            if len(new_index) == len(value_key_list) and index.keys().isdisjoint(new_index):
+                index.update(new_index)
+                if key_info["ordered"] != None:
+                    key_info["ordered"].update([x for x in new_index if None not in x])
+                continue
+
+            new_key_list = []
+            for value_key, row_id in zip(value_key_list, row_id_list):
+                bucket = index.get(value_key)
+                if bucket is None:
+                    index[value_key] = row_id
+                    new_key_list.append(value_key)
+                elif type(bucket) is int:
+                    index[value_key] = {bucket, row_id}
+                else:
+                    bucket.add(row_id)
+            if key_info["ordered"] != None:
+                key_info["ordered"].update([x for x in new_key_list if None not in x])
+
+        return rejected_list
+
+    def __load(self, row_list: list) -> List[dict]:
+        # replace the whole table content with row_list
+        if self.__change_list != None:
+            self.__change_list.extend([(x.key_value, None) for x in self.__store.views()])
+        self.__store = self.__new_store()
+        for index in self.__index_map.values():
+            index.clear()
+        for key_info in self.__key_info_list:
+            if key_info["ordered"] != None:
+                key_info["ordered"].clear()
+        self.__plan_cache.clear()
+        if self.__cache != None:
+            self.__cache.clear()
+
+        return self.__insert_many(row_list)
+
+    def __get_changed_key_info_list(self, changed_name_set: frozenset) -> List[dict]:
+        key_info_list = self.__changed_key_info_map.get(changed_name_set)
+        if key_info_list == None:
+            key_info_list = [key_info for key_info in self.__key_info_list
+                             if not key_info["key_name_set"].isdisjoint(changed_name_set)]
+            self.__changed_key_info_map[changed_name_set] = key_info_list
+        return key_info_list
+
+    def __update(self, key_value: dict) -> bool:
+        # the unique key columns pick the row and every other column given
+        # is changed, the rest is kept; only the indexes over a column whose
+        # value really changed are touched
+        if not self.__member_name_frozenset.issuperset(key_value):
+            return False
+        key_value = self.__to_typed(dict(key_value))
+        if key_value == None or not self.__unique_key_info["key_name_set"] <= key_value.keys():
+            return False
+
+        row_id = self.__get_unique_row_id(key_value)
+        if row_id == None:
             return False
 
-        unique_data = self.__get_unique(key_value)
-        if unique_data == None:
+        old_key_value = self.__store.key_value(row_id)
+        changed_name_set = frozenset([name for name, value in key_value.items() if old_key_value[name] != value])
+        if len(changed_name_set) == 0:
+            # nothing for watchers or the cache, but an update with the same
+            # values (a refreshed MAC) still restarts the row's ttl
+            if self.__expiry != None:
+                self.__expiry.apply([(old_key_value, old_key_value)])
+            return True
+
+        new_key_value = dict(old_key_value)
+        new_key_value.update(key_value)
+        if not self.__store.check(new_key_value):
             return False
 
-        self.__updata_data_in_index(
-            unique_data, unique_data.key_value, key_value)
-        unique_data.key_value = key_value
+        self.__updata_data_in_index(row_id, old_key_value, new_key_value,
+                                    self.__get_changed_key_info_list(changed_name_set))
+        self.__store.replace(row_id, new_key_value)
+        if self.__change_list != None:
+            self.__change_list.append((old_key_value, new_key_value))
 
         return True
 
-    def delete(self, *args, **kwargs):
-        data_list = self.get(**kwargs)
+    def __get_candidate(self, name_set: frozenset) -> tuple:
+        # covering indexes of a column set ordered by estimated bucket size
+        # (row count / distinct keys), replanned when the row count has
+        # moved by more than 2x since the last plan
+        row_count = len(self.__store)
+        cached = self.__plan_cache.get(name_set)
+        if cached != None and cached[0] // 2 <= row_count <= cached[0] * 2 + 1:
+            return cached[1], cached[2]
+
+        candidate_list = []
+        for key_info in self.__key_info_list:
+            if key_info["key_name_set"] <= name_set:
+                distinct_count = len(self.__index_map[key_info["key_set"]])
+                estimate = row_count / distinct_count if distinct_count else 0
+                candidate_list.append((estimate, -len(key_info["key_set"]), key_info))
+        candidate_list.sort(key=lambda x: x[:2])
+        candidate_list = [(x[0], x[2]) for x in candidate_list]
+
+        # no covering index: the ordered key set with the longest leading
+        # run of query columns can still narrow the rows down
+        prefix_info = None
+        for key_info in self.__key_info_list:
+            if key_info["ordered"] == None:
+                continue
+            prefix_len = 0
+            while prefix_len < len(key_info["key_set"]) and key_info["key_set"][prefix_len] in name_set:
+                prefix_len += 1
+            if prefix_len > 0 and (prefix_info == None or prefix_len > prefix_info[1]):
+                prefix_info = (key_info, prefix_len)
+
+        self.__plan_cache[name_set] = (row_count, candidate_list, prefix_info)
+        return candidate_list, prefix_info
+
+    def __plan(self, key_value: dict, explain: bool = False, lazy: bool = False) -> tuple:
+        # returns (row id list, whole bucket, plan) for an equality query:
+        # the covering index with the smallest estimated bucket, more
+        # covering indexes intersected while the result is still large, an
+        # ordered index prefix, and a filtered scan as last resort; the plan
+        # dict is only built for explain(). lazy returns an iterable of row
+        # ids instead, read while it is walked (intersections excepted)
+        name_set = frozenset(key_value)
+        if len(name_set) == 0 or not name_set <= self.__member_name_frozenset:
+            return [], None, make_plan(explain, "empty", [], (), 0)
+
+        candidate_list, prefix_info = self.__get_candidate(name_set)
+
+        # common case: the best index covers the whole query
+        if candidate_list and candidate_list[0][1]["key_name_set"] == name_set:
+            estimate, key_info = candidate_list[0]
+            value_key = key_info["key_getter"](key_value)
+            bucket = self.__index_map[key_info["key_set"]].get(value_key)
+            plan = make_plan(explain, "index" if bucket is not None else "empty",
+                             [key_info["key_set"]], (), estimate)
+            if bucket is None:
+                return [], None, plan
+            row_ids = bucket_row_ids(bucket)
+            return row_ids if lazy else list(row_ids), (key_info["key_set"], value_key), plan
+
+        kind = "empty"
+        key_set_list = []
+        plan_estimate = 0
+        covered = set()
+        row_id_set = None
+        whole_bucket = None
+        for estimate, key_info in candidate_list:
+            if key_info["key_name_set"] <= covered:
+                continue
+
+            value_key = key_info["key_getter"](key_value)
+            bucket = self.__index_map[key_info["key_set"]].get(value_key)
+            key_set_list.append(key_info["key_set"])
+            if bucket is None:
+                return [], None, make_plan(explain, "empty", key_set_list, (), plan_estimate)
+
+            if row_id_set == None:
+                kind = "index"
+                plan_estimate = estimate
+                row_id_set = bucket_row_ids(bucket)
+                whole_bucket = (key_info["key_set"], value_key)
+            else:
+                kind = "intersect"
+                whole_bucket = None
+                other = bucket_row_ids(bucket)
+                if len(other) < len(row_id_set):
+                    row_id_set, other = other, row_id_set
+                row_id_set = [row_id for row_id in row_id_set if row_id in other]
+
+            covered |= key_info["key_name_set"]
+            if covered == name_set or len(row_id_set) <= PLAN_INTERSECT_MIN:
+                break
+
+        if row_id_set == None and prefix_info != None:
+            key_info, prefix_len = prefix_info
+            key_set = key_info["key_set"]
+            prefix = tuple([key_value[name] for name in key_set[:prefix_len]])
+            high = prefix + (GREATEST,) * (len(key_set) - prefix_len)
+            index: dict = self.__index_map[key_set]
+            # keys holding a None are missing from the ordered index, it
+            # answers a prefix only while it has every key of the index and
+            # the prefix has no None; otherwise, or when the values do not
+            # compare, the scan below does
+            if None not in prefix and len(key_info["ordered"]) == len(index):
+                # the keys of the range are read here, also for lazy, so a
+                # comparison error never reaches the caller's iteration
+                try:
+                    value_key_list = list(key_info["ordered"].irange(prefix, high))
+                except TypeError:
+                    value_key_list = None
+                if value_key_list != None:
+                    row_id_set = (row_id for value_key in value_key_list
+                                  for row_id in bucket_row_ids(index[value_key]))
+                    if not lazy:
+                        row_id_set = list(row_id_set)
+            if row_id_set != None:
+                kind = "prefix"
+                key_set_list.append(key_set[:prefix_len])
+                plan_estimate = len(self.__store)
+                covered |= set(key_set[:prefix_len])
+
+        if row_id_set == None:
+            kind = "scan"
+            plan_estimate = len(self.__store)
+            row_id_set = self.__store.iter_row_ids() if lazy else self.__store.row_ids()
 
-        if len(data_list) == 0:
+        residual = {name: key_value[name] for name in name_set - covered}
+        plan = make_plan(explain, kind, key_set_list, residual, plan_estimate)
+        if len(residual) == 0:
+            return row_id_set if lazy else list(row_id_set), whole_bucket, plan
+
+        store_key_value = self.__store.key_value
+        residual_items = residual.items()
+        row_id_set = (row_id for row_id in row_id_set
+                      if store_key_value(row_id).items() >= residual_items)
+        return row_id_set if lazy else list(row_id_set), None, plan
+
+    def __delete(self, key_value: dict) -> bool:
+        key_value = self.__to_typed(dict(key_value))
+        if key_value == None:
+            return False
+
+        row_id_list, whole_bucket, plan = self.__plan(key_value)
+        if len(row_id_list) == 0:
             return False
 
-        for each in data_list:
-            self.__delete_data_from_index(each)
-            self.__data.remove(each)
+        if self.__change_list != None:
+            store_key_value = self.__store.key_value
+            self.__change_list.extend([(store_key_value(row_id), None) for row_id in row_id_list])
+        self.__delete_rows(row_id_list, whole_bucket)
+        self.__maybe_compact()
 
         return True
 
-    def get(self, *args, **kwargs) -> List[Data]:
-        key_value = dict(kwargs)
-        key_info: List[dict] = None
-        for each_key_info in self.__key_info_list:
-            if set(key_value.keys()) != set(each_key_info["key_set"]):
+    def __flush_batch(self, insert_list: list, delete_row_id_list: list) -> bool:
+        if delete_row_id_list:
+            if self.__change_list != None:
+                store_key_value = self.__store.key_value
+                self.__change_list.extend([(store_key_value(row_id), None) for row_id in delete_row_id_list])
+            self.__delete_rows(delete_row_id_list)
+            self.__maybe_compact()
+
+        return len(insert_list) == 0 or len(self.__insert_many(insert_list)) == 0
+
+    def __apply_batch(self, op_list: list) -> bool:
+        # inserts and deletes by unique key are held back and applied in
+        # bulk, the deletes by one __delete_rows pass and then the inserts
+        # by one __insert_many (unique keys checked once for all of them);
+        # any other op, or a delete of a key about to be inserted, applies
+        # them first
+        unique_key_set = self.__unique_key_set
+        unique_name_set = self.__unique_key_info["key_name_set"]
+        unique_key_getter = self.__unique_key_info["key_getter"]
+        insert_list = []
+        insert_key_set = set()
+        delete_row_id_map = {}
+        for op, payload in op_list:
+            key_value = self.__to_typed({name: payload.get(name) for name in unique_key_set})
+            value_key = None if key_value == None else unique_key_getter(key_value)
+            if op == "insert":
+                insert_list.append(payload)
+                insert_key_set.add(value_key)
+                continue
+            if op == "delete" and payload.keys() == unique_name_set and value_key not in insert_key_set:
+                row_id = None if key_value == None else self.__get_unique_row_id(key_value)
+                if row_id != None:
+                    delete_row_id_map[row_id] = None
                 continue
-            key_info = each_key_info
 
-        if key_info == None:
+            if not self.__flush_batch(insert_list, list(delete_row_id_map)):
+                return False
+            insert_list = []
+            insert_key_set = set()
+            delete_row_id_map = {}
+
+            if op == "update":
+                if not self.__update(payload):
+                    return False
+            elif op == "delete":
+                self.__delete(payload)
+            else:
+                return False
+
+        return self.__flush_batch(insert_list, list(delete_row_id_map))
+
+    def __undo_op_list(self, change_list: list) -> list:
+        undo_list = []
+        for old_key_value, new_key_value in reversed(change_list):
+            if old_key_value == None:
+                undo_list.append(("delete", {name: new_key_value[name] for name in self.__unique_key_set}))
+            elif new_key_value == None:
+                undo_list.append(("insert", dict(old_key_value)))
+            else:
+                undo_list.append(("update", dict(old_key_value)))
+        return undo_list
+
+    def __batch(self, op_list: list) -> list:
+        # every op or none of them: an insert hitting a unique key, an
+        # update of a missing row or an unknown op undoes what was applied
+        # and the batch returns None, otherwise the op list undoing it
+        outer_change_list = self.__change_list
+        change_list = []
+        self.__change_list = change_list
+        done = False
+        try:
+            done = self.__apply_batch(op_list)
+        finally:
+            self.__change_list = None
+            if not done:
+                # undone rows may come back under other row ids
+                if self.__cache != None:
+                    self.__invalidate(change_list)
+                self.__apply_batch(self.__undo_op_list(change_list))
+            self.__change_list = outer_change_list
+
+        if not done:
+            return None
+        if outer_change_list != None:
+            outer_change_list.extend(change_list)
+        return self.__undo_op_list(change_list)
+
+    def __write(self, op: str, payload):
+        # every change goes through here: one writer at a time in concurrent
+        # mode, the version is odd while the change is applied, and an
+        # attached write-ahead log records the changes in the order they
+        # were applied (a checkpoint holding the log lock never sees half of
+        # one)
+        if self.__expiry != None:
+            self.__expire_due()
+        if self.__write_lock == None:
+            # plain table, nothing to log or tell
+            if self.__wal == None and self.__cache == None and not self.__watch_group_map and \
+                    not self.__change_consumer_list:
+                return self.__apply(op, payload)
+            ret = self.__write_notified(op, payload)
+        else:
+            with self.__write_lock:
+                ret = self.__write_notified(op, payload)
+        self.__deliver()
+        return ret
+
+    def __write_notified(self, op: str, payload):
+        # watchers hear about a change once it is fully applied and the
+        # write lock is released (the caller runs __deliver), so a callback
+        # may write to the table
+        if not self.__watch_group_map and self.__cache == None and not self.__change_consumer_list:
+            return self.__write_logged(op, payload)
+
+        self.__change_list = []
+        try:
+            ret = self.__write_logged(op, payload)
+        finally:
+            change_list = self.__change_list
+            self.__change_list = None
+        if change_list and self.__watch_group_map:
+            self.__notify(change_list)
+        return ret
+
+    def __notify(self, change_list: list):
+        # every changed row is matched against each watched column set by
+        # one dict lookup, so the cost follows the changed rows, not the
+        # table size
+        event_list_map = {}
+        for key_getter, watch_map in self.__watch_group_map.values():
+            for old_key_value, new_key_value in change_list:
+                old_watch_list = () if old_key_value == None else watch_map.get(key_getter(old_key_value), ())
+                new_watch_list = () if new_key_value == None else watch_map.get(key_getter(new_key_value), ())
+                if not old_watch_list and not new_watch_list:
+                    continue
+
+                event = make_event(old_key_value, new_key_value)
+                for watch in old_watch_list:
+                    event_list_map.setdefault(watch, []).append(event)
+                if new_watch_list is not old_watch_list:
+                    for watch in new_watch_list:
+                        event_list_map.setdefault(watch, []).append(event)
+
+        if event_list_map:
+            self.__deliver_queue.append(event_list_map)
+
+    def __deliver(self):
+        # pushes the queued events in change order. One thread delivers at
+        # a time, a writer finding another one at it leaves its events to
+        # it; a callback writing to the table queues its events behind the
+        # ones being delivered instead of waiting for itself
+        if not self.__deliver_queue:
+            return
+        with self.__deliver_lock:
+            if self.__delivering:
+                return
+            self.__delivering = True
+
+        try:
+            while True:
+                with self.__deliver_lock:
+                    if not self.__deliver_queue:
+                        self.__delivering = False
+                        return
+                    event_list_map = self.__deliver_queue.popleft()
+                for watch, event_list in event_list_map.items():
+                    watch.push(event_list)
+        except BaseException:
+            # the next writer delivers the rest
+            with self.__deliver_lock:
+                self.__delivering = False
+            raise
+
+    def __apply(self, op: str, payload):
+        self.__version += 1
+        try:
+            return self.__write_func(op)(payload)
+        finally:
+            # the version goes even again whatever a consumer raises, an odd
+            # one would send every reader to the lock for good
+            try:
+                if self.__change_list:
+                    if self.__cache != None:
+                        self.__invalidate(self.__change_list)
+                    for consumer in self.__change_consumer_list:
+                        consumer.apply(self.__change_list)
+            finally:
+                self.__version += 1
+
+    def __invalidate(self, change_list: list):
+        # moves the version of every bucket a changed row left or entered
+        cache = self.__cache
+        slot_list = []
+        for key_info in self.__key_info_list:
+            key_set = key_info["key_set"]
+            key_getter = key_info["key_getter"]
+            for old_key_value, new_key_value in change_list:
+                if old_key_value != None:
+                    slot_list.append(cache.slot(key_set, key_getter(old_key_value)))
+                if new_key_value != None:
+                    slot_list.append(cache.slot(key_set, key_getter(new_key_value)))
+        cache.invalidate(slot_list)
+
+    def __write_logged(self, op: str, payload):
+        wal = self.__wal
+        if wal == None:
+            return self.__apply(op, payload)
+
+        with wal.lock:
+            ret = self.__apply(op, payload)
+            if op == "insert_many":
+                changed = len(ret) < len(payload)
+            else:
+                changed = op == "load" or ret
+            if changed:
+                wal.append(op, payload)
+            return ret
+
+    def __write_func(self, op: str):
+        if op == "insert":
+            return self.__insert
+        if op == "update":
+            return self.__update
+        if op == "delete":
+            return self.__delete
+        if op == "insert_many":
+            return self.__insert_many
+        if op == "batch":
+            return self.__batch
+        return self.__load
+
+    def insert(self, *args, **kwargs) -> bool:
+        if self.__op_stats != None:
+            return self.__op_stats.call("insert", self.__write, "insert", kwargs)
+        return self.__write("insert", kwargs)
+
+    def insert_many(self, row_list) -> List[dict]:
+        return self.__write("insert_many", list(row_list))
+
+    def load(self, row_list) -> List[dict]:
+        return self.__write("load", list(row_list))
+
+    def update(self, *args, **kwargs) -> bool:
+        if self.__op_stats != None:
+            return self.__op_stats.call("update", self.__write, "update", kwargs)
+        return self.__write("update", kwargs)
+
+    def delete(self, *args, **kwargs) -> bool:
+        if self.__op_stats != None:
+            return self.__op_stats.call("delete", self.__write, "delete", kwargs)
+        return self.__write("delete", kwargs)
+
+    def applyBatch(self, op_list) -> list:
+        # [(op, kwargs), ...] with op "insert", "update" or "delete", applied
+        # as one change (readers, watchers and the log see all of it or
+        # nothing); returns the op list undoing it, None if it was not applied
+        return self.__write("batch", [(op, dict(payload)) for op, payload in op_list])
+
+    def attachWal(self, wal):
+        # wal needs a lock and append(op, payload), see persist.WriteAheadLog
+        self.__wal = wal
+
+    def detachWal(self):
+        self.__wal = None
+
+    def watch(self, callback=None, batch_size: int = 256, max_pending: int = 65536,
+              overflow: str = OVERFLOW_BLOCK, **kwargs) -> Watch:
+        # insert/update/delete events of the rows matching kwargs (every row
+        # without a filter), see watch.Watch; None if the filter names an
+        # unknown column or a value of the wrong type
+        if not self.__member_name_frozenset.issuperset(kwargs):
+            return None
+        key_value = self.__to_typed(dict(kwargs))
+        if key_value == None:
+            return None
+
+        watch = Watch(self.__unwatch, callback, batch_size, max_pending, overflow)
+        key_set = tuple(sorted(key_value))
+        with self.__watch_lock:
+            watch_group_map = dict(self.__watch_group_map)
+            key_getter, watch_map = watch_group_map.get(key_set, (make_key_getter(key_set), {}))
+            watch_map = dict(watch_map)
+            value_key = key_getter(key_value)
+            watch_map[value_key] = watch_map.get(value_key, ()) + (watch,)
+            watch_group_map[key_set] = (key_getter, watch_map)
+            self.__watch_group_map = watch_group_map
+        return watch
+
+    def __unwatch(self, watch: Watch):
+        with self.__watch_lock:
+            watch_group_map = {}
+            for key_set, (key_getter, watch_map) in self.__watch_group_map.items():
+                watch_map = {value_key: tuple([x for x in watch_list if x is not watch])
+                             for value_key, watch_list in watch_map.items()}
+                watch_map = {value_key: watch_list for value_key, watch_list in watch_map.items() if watch_list}
+                if watch_map:
+                    watch_group_map[key_set] = (key_getter, watch_map)
+            self.__watch_group_map = watch_group_map
+
+    def getMemberList(self) -> List[Field]:
+        return list(self.__member_list)
+
+    def __read(self, func, *args):
+        # concurrent mode: an optimistic lock-free read (seqlock), func runs
+        # against the live table and its result is kept only when no change
+        # started or finished meanwhile; rows come back as snapshot copies.
+        # A reader that keeps losing to the writer falls back to the lock
+        if self.__expiry != None:
+            self.__expire_due()
+        return self.__read_live(func, *args)
+
+    def __read_live(self, func, *args):
+        # __read without expiry, for the reads a checkpoint makes holding the
+        # log lock: expiry writes, it would take the write lock after the log
+        # lock, the other way round from a writer
+        if self.__write_lock == None:
+            return func(*args)
+
+        for _ in range(READ_RETRY_COUNT):
+            version = self.__version
+            if version & 1 == 0:
+                try:
+                    ret = func(*args)
+                except Exception:
+                    # a read torn by a change may fail in odd ways, an error
+                    # without a change in between is a real one
+                    if self.__version == version:
+                        raise
+                else:
+                    if self.__version == version:
+                        return ret
+            # let the writer finish
+            time.sleep(0)
+
+        with self.__write_lock:
+            return func(*args)
+
+    def getColumns(self) -> dict:
+        # column name -> values of every row (a list, or an array for the
+        # numeric columns of a compact table), same row order in every column;
+        # rows past their ttl not yet expired are in, see __read_live
+        return self.__read_live(self.__store_columns)
+
+    def __store_columns(self) -> dict:
+        return self.__store.columns()
+
+    def get(self, *args, **kwargs) -> List[Data]:
+        if self.__op_stats != None:
+            return self.__op_stats.call("get", self.__read, self.__get, kwargs)
+        return self.__read(self.__get, kwargs)
+
+    def __get(self, kwargs: dict) -> List[Data]:
+        if self.__cache != None:
+            return list(self.__get_cached(kwargs))
+
+        key_value = self.__to_typed(dict(kwargs))
+        if key_value == None:
+            return []
+
+        row_id_list, whole_bucket, plan = self.__plan(key_value)
+        view = self.__store.view
+        return [view(row_id) for row_id in row_id_list]
+
+    def __get_cached(self, kwargs: dict) -> List[Data]:
+        # the cached list is shared, callers copy it
+        key_value = self.__to_typed(dict(kwargs))
+        if key_value == None:
             return []
 
-        data_list = self.__get_data_list(key_info, key_value)
-        return data_list
+        cache = self.__cache
+        # typed values make the key the same however the query was spelled
+        try:
+            cache_key = frozenset(key_value.items())
+        except TypeError:
+            cache_key = None
+        if cache_key != None:
+            view_list = cache.get(cache_key)
+            if view_list != None:
+                return view_list
+
+        # every row matching the query is in the bucket of the best covering
+        # index, without one any change may matter
+        version = self.__version
+        slot = None
+        name_set = frozenset(key_value)
+        if name_set and name_set <= self.__member_name_frozenset:
+            candidate_list = self.__get_candidate(name_set)[0]
+            if candidate_list:
+                key_info = candidate_list[0][1]
+                slot = cache.slot(key_info["key_set"], key_info["key_getter"](key_value))
+        slot_version = cache.version(slot)
+
+        row_id_list, whole_bucket, plan = self.__plan(key_value)
+        view = self.__store.view
+        view_list = [view(row_id) for row_id in row_id_list]
+        # a read torn by a concurrent change is not kept
+        if cache_key != None and version & 1 == 0 and self.__version == version:
+            cache.put(cache_key, view_list, slot, slot_version)
+        return view_list
 
     def getOne(self, *args, **kwargs) -> Data:
-        key_value = dict(kwargs)
-        key_info: List[dict] = None
-        for each_key_info in self.__key_info_list:
-            if set(key_value.keys()) != set(each_key_info["key_set"]):
-                continue
-            key_info = each_key_info
+        # timed as a get
+        if self.__op_stats != None:
+            return self.__op_stats.call("get", self.__read, self.__get_one, kwargs)
+        return self.__read(self.__get_one, kwargs)
 
-        if key_info == None:
+    def __get_one(self, kwargs: dict) -> Data:
+        if self.__cache != None:
+            view_list = self.__get_cached(kwargs)
+            return view_list[0] if view_list else None
+
+        key_value = self.__to_typed(dict(kwargs))
+        if key_value == None:
+            return None
+
+        row_id_list, whole_bucket, plan = self.__plan(key_value)
+        if len(row_id_list) == 0:
+            return None
+
+        return self.__store.view(row_id_list[0])
+
+    def explain(self, *args, **kwargs) -> dict:
+        # the plan get(**kwargs) runs: "index", "intersect", "prefix",
+        # "scan" or "empty", the key sets it probed, the columns filtered
+        # row by row, the estimated bucket size and the actual row count
+        return self.__read(self.__explain, kwargs)
+
+    def __explain(self, kwargs: dict) -> dict:
+        key_value = self.__to_typed(dict(kwargs))
+        if key_value == None:
+            plan = make_plan(True, "empty", [], (), 0)
+            plan["row_count"] = 0
+            return plan
+
+        row_id_list, whole_bucket, plan = self.__plan(key_value, True)
+        plan["row_count"] = len(row_id_list)
+        return plan
+
+    def getCacheStats(self) -> dict:
+        # size, capacity, hit, miss and evict counts of the query cache,
+        # None when the table has none
+        if self.__cache == None:
+            return None
+        return self.__cache.stats()
+
+    def clearCache(self):
+        if self.__cache != None:
+            self.__cache.clear()
+
+    def addAggregate(self, name: str, op: str, key_set: list, column: str = None) -> bool:
+        # materialized count, sum, min or max of column (count: rows when no
+        # column) per key of key_set, kept up to date by every change and
+        # read with getAggregate/getAggregateMap, see
+        # aggregate.MaterializedAggregate
+        #   table.addAggregate('port_count', 'count', ['dpid'])
+        #   table.getAggregate('port_count', dpid=1)
+        # False if the name is taken or an argument is invalid (sum needs an
+        # int/float column, min and max an int/float/str one)
+        key_set = tuple(key_set)
+        if name in self.__aggregate_map or op not in MATERIALIZED_OP_LIST:
+            return False
+        if not self.__member_name_frozenset.issuperset(key_set) or len(set(key_set)) != len(key_set):
+            return False
+        if (column == None and op != 'count') or (column != None and column not in self.__member_name_frozenset):
+            return False
+        if op != 'count' and self.__member_type_map[column] not in MATERIALIZED_TYPE_MAP[op]:
+            return False
+
+        if self.__write_lock == None:
+            self.__add_aggregate(name, op, key_set, column)
+        else:
+            with self.__write_lock:
+                self.__add_aggregate(name, op, key_set, column)
+        return True
+
+    def __add_aggregate(self, name: str, op: str, key_set: tuple, column: str):
+        index = self.__index_map.get(key_set) if op == 'count' and column == None else None
+        aggregate = MaterializedAggregate(op, key_set, make_key_getter(key_set), column, index)
+        if index == None:
+            store_key_value = self.__store.key_value
+            aggregate.apply([(None, store_key_value(row_id)) for row_id in self.__store.iter_row_ids()])
+            self.__change_consumer_list = self.__change_consumer_list + [aggregate]
+        self.__aggregate_map = {**self.__aggregate_map, name: aggregate}
+
+    def dropAggregate(self, name: str) -> bool:
+        aggregate = self.__aggregate_map.get(name)
+        if aggregate == None:
+            return False
+
+        self.__aggregate_map = {x: y for x, y in self.__aggregate_map.items() if x != name}
+        self.__change_consumer_list = [x for x in self.__change_consumer_list if x is not aggregate]
+        return True
+
+    def getAggregateNameList(self) -> List[str]:
+        return list(self.__aggregate_map)
+
+    def getAggregate(self, name: str, *args, **kwargs):
+        # the aggregate of the key given by kwargs (every column of its key
+        # set), 0 or None (min/max) when no row has that key; None for an
+        # unknown aggregate or key
+        aggregate = self.__aggregate_map.get(name)
+        if aggregate == None or kwargs.keys() != set(aggregate.key_set):
+            return None
+        key_value = self.__to_typed(dict(kwargs))
+        if key_value == None:
             return None
 
-        data_list = self.__get_data_list(key_info, key_value)
-        if len(data_list) == 0:
+        return self.__read(aggregate.get, tuple([key_value[x] for x in aggregate.key_set]))
+
+    def getAggregateMap(self, name: str) -> dict:
+        # key (a tuple in key set order) -> aggregate, of every key some
+        # row has; None for an unknown aggregate
+        aggregate = self.__aggregate_map.get(name)
+        if aggregate == None:
             return None
+        return self.__read(aggregate.items)
+
+    def __expire_due(self) -> int:
+        # called by every read and write, one clock read unless a wheel
+        # tick has passed
+        if not self.__expiry.pending(time.monotonic()):
+            return 0
+        if self.__write_lock == None:
+            key_value_list = self.__expire()
+        else:
+            with self.__write_lock:
+                key_value_list = self.__expire()
+        self.__deliver()
+        return self.__expired(key_value_list)
+
+    def __expire(self) -> List[dict]:
+        # deletes the rows due by now as one batch of deletes by unique key
+        # (logged and watched like any other batch), their key values
+        expiry = self.__expiry
+        now = time.monotonic()
+        if not expiry.pending(now):
+            return []
+        value_key_list = expiry.due(now)
+        if len(value_key_list) == 0:
+            return []
+
+        unique_key_set = self.__unique_key_set
+        op_list = [("delete", dict(zip(unique_key_set, value_key))) for value_key in value_key_list]
+        undo_op_list = self.__write_notified("batch", op_list) or []
+        self.__expired_count += len(undo_op_list)
+        return [key_value for op, key_value in undo_op_list]
+
+    def __expired(self, key_value_list: List[dict]) -> int:
+        # the callback runs outside the write lock, it may use the table
+        if key_value_list and self.__expire_callback != None:
+            self.__expire_callback(key_value_list)
+        return len(key_value_list)
+
+    def __with_expiry(self) -> RowExpiry:
+        # rows written before the first ttl have none
+        if self.__expiry == None:
+            self.__expiry = RowExpiry(None, self.__unique_key_info["key_getter"])
+            self.__change_consumer_list = self.__change_consumer_list + [self.__expiry]
+        return self.__expiry
+
+    def setTtl(self, ttl: float, *args, **kwargs) -> bool:
+        # the rows matching kwargs expire ttl seconds from now, or never
+        # with None, until their next change; False if no row matches
+        key_value = self.__to_typed(dict(kwargs))
+        if key_value == None:
+            return False
+
+        if self.__write_lock == None:
+            return self.__set_ttl(ttl, key_value)
+        with self.__write_lock:
+            return self.__set_ttl(ttl, key_value)
+
+    def __set_ttl(self, ttl: float, key_value: dict) -> bool:
+        row_id_list, whole_bucket, plan = self.__plan(key_value)
+        if len(row_id_list) == 0:
+            return False
+
+        expiry = self.__with_expiry()
+        unique_key_getter = self.__unique_key_info["key_getter"]
+        store_key_value = self.__store.key_value
+        for row_id in row_id_list:
+            expiry.set(unique_key_getter(store_key_value(row_id)), ttl)
+        return True
 
-        return data_list[0]
+    def setDefaultTtl(self, ttl: float):
+        # ttl of the rows inserted or updated from now on, None for none
+        if self.__write_lock == None:
+            self.__with_expiry().ttl = ttl
+            return
+        with self.__write_lock:
+            self.__with_expiry().ttl = ttl
+
+    def getTtl(self, *args, **kwargs) -> float:
+        # seconds left before the row with the unique key in kwargs expires,
+        # None if it does not expire or does not exist
+        key_value = self.__to_typed(dict(kwargs))
+        if key_value == None or self.__expiry == None or \
+                not self.__unique_key_info["key_name_set"] <= key_value.keys():
+            return None
+
+        value_key = self.__unique_key_info["key_getter"](key_value)
+        return self.__read(self.__expiry.remaining, value_key)
+
+    def sweep(self) -> int:
+        # deletes the expired rows now, the number deleted
+        if self.__expiry == None:
+            return 0
+        return self.__expire_due()
+
+    def startSweeper(self, interval: float = 1.0) -> bool:
+        # a daemon thread sweeping every interval seconds, so rows expire
+        # even when nobody touches the table; concurrent tables only, False
+        # otherwise or when one runs already
+        if self.__write_lock == None or self.__sweeper != None:
+            return False
+
+        stop_event = threading.Event()
+
+        def sweep_loop():
+            while not stop_event.wait(interval):
+                self.sweep()
+
+        thread = threading.Thread(target=sweep_loop, name='memdb-sweeper', daemon=True)
+        self.__sweeper = (thread, stop_event)
+        thread.start()
+        return True
+
+    def stopSweeper(self):
+        if self.__sweeper == None:
+            return
+
+        thread, stop_event = self.__sweeper
+        self.__sweeper = None
+        stop_event.set()
+        if thread is not threading.current_thread():
+            thread.join()
+
+    def stats(self) -> dict:
+        # row and slot counts, estimated bytes of the store and of each
+        # index (key tuples and values sampled), the bucket size histogram
+        # and largest buckets of each index to spot skew, and with
+        # instrument=True op counts and latency histograms; cache and
+        # expiry counters when those are on. O(keys) per call, the ops
+        # themselves only pay for two clock reads when instrumented
+        return self.__read(self.__stats)
+
+    def __stats(self) -> dict:
+        stats = {
+            "row_count": len(self.__store),
+            "slot_count": self.__store.slot_count(),
+            "store_bytes": self.__store.nbytes(),
+            "index": {','.join(key_set): index_stats(index) for key_set, index in self.__index_map.items()},
+            "watch_count": len(set([watch for key_getter, watch_map in self.__watch_group_map.values()
+                                    for watch_list in watch_map.values() for watch in watch_list])),
+            "aggregate_count": len(self.__aggregate_map),
+        }
+        for key_info in self.__key_info_list:
+            if key_info["ordered"] != None:
+                stats["index"][','.join(key_info["key_set"])]["ordered"] = True
+        if self.__op_stats != None:
+            stats["op"] = self.__op_stats.report()
+        if self.__cache != None:
+            stats["cache"] = self.__cache.stats()
+        if self.__expiry != None:
+            stats["expiry_pending"] = len(self.__expiry)
+            stats["expired_count"] = self.__expired_count
+        return stats
+
+    def statsText(self, table: str = 'table', prefix: str = 'memdb') -> str:
+        # stats() in the Prometheus text format, labelled table="<table>"
+        return prometheus_text(self.stats(), table, prefix)
 
     def getAll(self) -> List[Data]:
-        return self.__data
+        return self.__read(self.__get_all)
+
+    def __get_all(self) -> List[Data]:
+        return self.__store.views()
+
+    def __find_ordered_key_info(self, key_set: list) -> dict:
+        key_set = tuple(key_set)
+        for key_info in self.__key_info_list:
+            if key_info["key_set"] == key_set and key_info["ordered"] != None:
+                return key_info
+        return None
+
+    def __to_typed_bound(self, key_set: tuple, bound: tuple) -> tuple:
+        if bound == None:
+            return None
+
+        bound = tuple(bound)
+        key_value = self.__to_typed(dict(zip(key_set, bound)))
+        if key_value == None:
+            return None
+        return tuple([key_value[name] for name in key_set[:len(bound)]])
+
+    def __iter_ordered(self, key_info: dict, low: tuple, high: tuple, reverse: bool):
+        if high != None and len(high) < len(key_info["key_set"]):
+            # a short high bound covers every key it is a prefix of
+            high = high + (GREATEST,) * (len(key_info["key_set"]) - len(high))
+
+        index: dict = self.__index_map[key_info["key_set"]]
+        view = self.__store.view
+        for value_key in key_info["ordered"].irange(low, high, reverse):
+            for row_id in bucket_row_ids(index[value_key]):
+                yield view(row_id)
+
+    def getRange(self, key_set: list, low: tuple = None, high: tuple = None, reverse: bool = False) -> List[Data]:
+        # rows whose key over an ordered key set is within [low, high], in
+        # key order; a bound may be a prefix of the key set, e.g. for
+        # ['dpid', 'port_no'], low=(2, 100), high=(2, 200) or low=high=(2,)
+        return self.__read(self.__get_range, key_set, low, high, reverse)
+
+    def __get_range(self, key_set: list, low: tuple, high: tuple, reverse: bool) -> List[Data]:
+        key_info = self.__find_ordered_key_info(key_set)
+        if key_info == None:
+            return []
+
+        key_set = key_info["key_set"]
+        typed_low = self.__to_typed_bound(key_set, low)
+        typed_high = self.__to_typed_bound(key_set, high)
+        if (low != None and typed_low == None) or (high != None and typed_high == None):
+            return []
+
+        try:
+            return list(self.__iter_ordered(key_info, typed_low, typed_high, reverse))
+        except TypeError:
+            # bound not comparable with the indexed values
+            return []
+
+    def query(self, fields: List[str] = None, order_by: List[str] = None, reverse: bool = False,
+              limit: int = None, offset: int = 0, **kwargs):
+        # lazily yields the rows matching kwargs (every row without a
+        # filter), as Data views or, with fields, as dicts of those fields
+        # only. order_by walks an ordered index when one fits and otherwise
+        # keeps just offset + limit rows in a heap, so a first page costs
+        # about the same whatever the result size. Unknown columns yield
+        # nothing; the table must not be changed while iterating, in
+        # concurrent mode the page is read up front
+        if self.__expiry != None:
+            self.__expire_due()
+        if self.__write_lock != None:
+            return iter(self.__read(self.__query_list, fields, order_by, reverse, limit, offset, kwargs))
+        return self.__query(fields, order_by, reverse, limit, offset, kwargs)
+
+    def __query_list(self, fields: List[str], order_by: List[str], reverse: bool,
+                     limit: int, offset: int, kwargs: dict) -> list:
+        return list(self.__query(fields, order_by, reverse, limit, offset, kwargs))
+
+    def __query(self, fields: List[str], order_by: List[str], reverse: bool,
+                limit: int, offset: int, kwargs: dict):
+        if type(order_by) is str:
+            order_by = [order_by]
+        order_by = list(order_by or [])
+        if type(fields) is str:
+            fields = [fields]
+        if not self.__member_name_frozenset.issuperset(order_by + list(fields or [])):
+            return iter(())
+        key_value = self.__to_typed(dict(kwargs))
+        if key_value == None:
+            return iter(())
+
+        offset = max(0, offset or 0)
+        stop = None if limit == None else offset + max(0, limit)
+        if stop == 0:
+            return iter(())
+
+        # columns fixed by the filter do not change the order
+        order_by = [name for name in order_by if name not in key_value]
+        row_ids = islice(self.__query_row_ids(key_value, order_by, reverse, stop), offset, stop)
+
+        store = self.__store
+        if fields == None:
+            return map(store.view, row_ids)
+        fields = list(fields)
+        return (store.project(row_id, fields) for row_id in row_ids)
+
+    def __query_row_ids(self, key_value: dict, order_by: List[str], reverse: bool, stop: int):
+        name_set = frozenset(key_value)
+        if order_by:
+            key_info, prefix_len = self.__find_order_index(key_value, order_by)
+            # a filter an index covers is better planned and sorted
+            if key_info != None and (prefix_len == len(key_value) or not self.__get_candidate(name_set)[0]):
+                return self.__iter_order_index(key_info, key_value, prefix_len, reverse)
+
+        if len(key_value):
+            row_ids = self.__plan(key_value, lazy=True)[0]
+        else:
+            row_ids = self.__store.iter_row_ids()
+        if not order_by:
+            return iter(row_ids)
+
+        # None sorts after every value
+        project = self.__store.project
+        sort_key = lambda row_id: tuple([(value is None, value) for value in project(row_id, order_by).values()])
+        if stop == None:
+            return iter(sorted(row_ids, key=sort_key, reverse=reverse))
+        if reverse:
+            return iter(heapq.nlargest(stop, row_ids, key=sort_key))
+        return iter(heapq.nsmallest(stop, row_ids, key=sort_key))
+
+    def __find_order_index(self, key_value: dict, order_by: List[str]) -> tuple:
+        # (key info, prefix length) of an ordered key set that continues
+        # with the order_by columns after a leading run of filtered columns
+        for key_info in self.__key_info_list:
+            ordered: SortedKeyList = key_info["ordered"]
+            key_set = key_info["key_set"]
+            # keys holding a None are missing from the ordered index
+            if ordered == None or len(ordered) != len(self.__index_map[key_set]):
+                continue
+
+            prefix_len = 0
+            while prefix_len < len(key_set) and key_set[prefix_len] in key_value:
+                if key_value[key_set[prefix_len]] is None:
+                    break
+                prefix_len += 1
+            if list(key_set[prefix_len:prefix_len + len(order_by)]) == order_by:
+                return key_info, prefix_len
+        return None, 0
+
+    def __iter_order_index(self, key_info: dict, key_value: dict, prefix_len: int, reverse: bool):
+        key_set = key_info["key_set"]
+        prefix = tuple([key_value[name] for name in key_set[:prefix_len]])
+        low = prefix if prefix_len else None
+        high = prefix + (GREATEST,) * (len(key_set) - prefix_len) if prefix_len else None
+        residual_items = {name: value for name, value in key_value.items()
+                          if name not in key_set[:prefix_len]}.items()
+        index: dict = self.__index_map[key_set]
+        store_key_value = self.__store.key_value
+        for value_key in key_info["ordered"].irange(low, high, reverse):
+            for row_id in bucket_row_ids(index[value_key]):
+                if not residual_items or store_key_value(row_id).items() >= residual_items:
+                    yield row_id
+
+    def getPrefix(self, key_set: list, prefix: tuple, reverse: bool = False) -> List[Data]:
+        return self.getRange(key_set, prefix, prefix, reverse)
+
+    def getMin(self, key_set: list) -> Data:
+        return self.__read(self.__get_min, key_set)
+
+    def __get_min(self, key_set: list) -> Data:
+        key_info = self.__find_ordered_key_info(key_set)
+        if key_info == None or len(key_info["ordered"]) == 0:
+            return None
+
+        bucket = self.__index_map[key_info["key_set"]][key_info["ordered"].min()]
+        return self.__store.view(min(bucket_row_ids(bucket)))
+
+    def getMax(self, key_set: list) -> Data:
+        return self.__read(self.__get_max, key_set)
+
+    def __get_max(self, key_set: list) -> Data:
+        key_info = self.__find_ordered_key_info(key_set)
+        if key_info == None or len(key_info["ordered"]) == 0:
+            return None
+
+        bucket = self.__index_map[key_info["key_set"]][key_info["ordered"].max()]
+        return self.__store.view(min(bucket_row_ids(bucket)))
+
+    def iterOrdered(self, key_set: list, reverse: bool = False):
+        # lazily walks the rows in key order, the table must not be changed
+        # while iterating; in concurrent mode the rows are read up front
+        key_info = self.__find_ordered_key_info(key_set)
+        if key_info == None:
+            return iter(())
+
+        if self.__expiry != None:
+            self.__expire_due()
+        if self.__write_lock != None:
+            return iter(self.__read(self.__get_range, key_set, None, None, reverse))
+        return self.__iter_ordered(key_info, None, None, reverse)
+
+    def __read_columns(self, func, *args):
+        # numpy reads the columns in place and an array exporting its buffer
+        # cannot grow, so in concurrent mode a scan keeps the writers out
+        if self.__expiry != None:
+            self.__expire_due()
+        if self.__write_lock == None:
+            return func(*args)
+
+        with self.__write_lock:
+            return func(*args)
+
+    def scan(self, where=None) -> List[Data]:
+        # rows matching a predicate no index has to fit, see scan.normalize
+        #   table.scan([('port_no', '>', 1000), ('dpid', 'in', {1, 3})])
+        # evaluated a column at a time with numpy on a compact table and row
+        # by row otherwise; [] if the predicate is invalid
+        node = normalize(where, self.__member_type_map)
+        if node == None:
+            return []
+        return self.__read_columns(self.__scan, node)
+
+    def __scan(self, node: tuple) -> List[Data]:
+        view = self.__store.view
+        return [view(row_id) for row_id in scan_row_ids(self.__store, node)]
+
+    def aggregate(self, op: str, column: str = None, where=None, group_by: str = None):
+        # count, sum, min or max of column over the rows matching where,
+        # {group value: result} with group_by; None values are skipped and
+        # count without a column counts rows. None if the arguments are invalid
+        #   table.aggregate('max', 'port_no', group_by='dpid')
+        if op not in AGGREGATE_OP_LIST or (column == None and op != 'count'):
+            return None
+        if (column != None and column not in self.__member_type_map) or \
+                (group_by != None and group_by not in self.__member_type_map):
+            return None
+
+        node = normalize(where, self.__member_type_map)
+        if node == None:
+            return None
+        return self.__read_columns(aggregate_rows, self.__store, op, column, node, group_by)
 
     def test(self):
         print(self.insert(port_name='veth1', port_no=1, dpid=1))
@@ -202,25 +1906,78 @@ class Table:
         # print(self.delete(dpid=1))
         # print(self.get(dpid=1))
 
-    def __str__(self):
-        ret = ''
-        padding_map = {}
-        for name in self.__member_name_set:
-            padding = len(name)
-            for each in self.__data:
-                if len(str(each.key_value[name])) > padding:
-                    padding = len(str(each.key_value[name]))
-            padding_map[name] = padding
-
-        ret += '| '
-        for name in self.__member_name_set:
-            ret += f'{name:>{padding_map[name]}} | '
-        ret += '\n'
-
-        for each in self.__data:
-            ret += '| '
-            for name in self.__member_name_set:
-                ret += f'{each.key_value[name]:>{padding_map[name]}} | '
-            ret += '\n'
+    def __key_value_chunk(self, start: int) -> List[dict]:
+        return self.__store.key_values(start, start + EXPORT_CHUNK)
 
-        return ret
+    def __iter_chunks(self):
+        # the rows EXPORT_CHUNK slots at a time, so an export holds one
+        # chunk at most; in concurrent mode each chunk is read on its own,
+        # changes made meanwhile may or may not be seen. Expiry runs once
+        # before the first chunk, not per chunk
+        if self.__expiry != None:
+            self.__expire_due()
+        start = 0
+        while start < self.__store.slot_count():
+            key_value_list = self.__read_live(self.__key_value_chunk, start)
+            if key_value_list:
+                yield key_value_list
+            start += EXPORT_CHUNK
+
+    def __width_map(self) -> dict:
+        # the first text export measures every row, later changes keep the
+        # widths up to date
+        if self.__column_width == None:
+            if self.__write_lock == None:
+                self.__add_column_width()
+            else:
+                with self.__write_lock:
+                    self.__add_column_width()
+        return self.__read(self.__column_width.width_map)
+
+    def __add_column_width(self):
+        if self.__column_width != None:
+            return
+        column_width = ColumnWidth(list(self.__member_name_set))
+        store = self.__store
+        for start in range(0, store.slot_count(), EXPORT_CHUNK):
+            column_width.apply([(None, key_value) for key_value in store.key_values(start, start + EXPORT_CHUNK)])
+        self.__change_consumer_list = self.__change_consumer_list + [column_width]
+        self.__column_width = column_width
+
+    def exportText(self, out) -> int:
+        # streams the rows to out (a text file, a socket or anything with
+        # write(str)) as an aligned table, the number of rows written
+        out = make_writer(out)
+        return write_text(out, self.__member_name_set, self.__width_map(), self.__iter_chunks())
+
+    def exportCsv(self, out, header: bool = True) -> int:
+        return write_csv(make_writer(out), self.__member_name_set, self.__iter_chunks(), header)
+
+    def exportJsonl(self, out) -> int:
+        return write_jsonl(make_writer(out), self.__member_name_set, self.__iter_chunks())
+
+    def __import(self, row_iter, replace: bool) -> List[dict]:
+        # bulk inserts EXPORT_CHUNK rows at a time, replace loads the first
+        # chunk instead (emptying the table first); the rejected rows
+        rejected_list = []
+        for row_list in iter_chunks(row_iter):
+            if replace:
+                rejected_list += self.load(row_list)
+                replace = False
+            else:
+                rejected_list += self.insert_many(row_list)
+        if replace:
+            self.load([])
+        return rejected_list
+
+    def importCsv(self, file, replace: bool = False, header: bool = True) -> List[dict]:
+        # rows written by exportCsv; an empty field reads back as None
+        return self.__import(read_csv(file, self.__member_list, header), replace)
+
+    def importJsonl(self, file, replace: bool = False) -> List[dict]:
+        return self.__import(read_jsonl(file), replace)
+
+    def __str__(self):
+        out = io.StringIO()
+        self.exportText(out)
+        return out.getvalue()
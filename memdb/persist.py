@@ -0,0 +1,325 @@
+import mmap
+import os
+import pickle
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+
+# snapshot: header, then per column a header, the column name and the data
+SNAPSHOT_MAGIC = b'MEMDBSN1'
+SNAPSHOT_HEADER = struct.Struct('<8s?QIQ')  # magic, little endian, last seq, column count, row count
+COLUMN_HEADER = struct.Struct('<HcQ')  # name length, encoding, data length
+# wal: a header per record followed by the pickled (op, payload)
+WAL_RECORD_HEADER = struct.Struct('<QII')  # seq, payload length, crc32 of payload
+
+SNAPSHOT_FILE_NAME = 'snapshot'
+WAL_FILE_NAME = 'wal'
+
+FSYNC_ALWAYS = 'always'
+FSYNC_INTERVAL = 'interval'
+FSYNC_NEVER = 'never'
+
+
+def fsync_directory(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def encode_column(value_list) -> tuple:
+    # (encoding, data): int64/float64 arrays and NUL joined utf-8 text load
+    # without touching each value in python, anything else is pickled
+    if type(value_list) is array and value_list.typecode in ('q', 'd'):
+        return value_list.typecode.encode(), value_list.tobytes()
+
+    type_set = set(map(type, value_list))
+    if type_set == {int}:
+        try:
+            return b'q', array('q', value_list).tobytes()
+        except OverflowError:
+            pass
+    elif type_set == {float}:
+        return b'd', array('d', value_list).tobytes()
+    elif type_set == {str}:
+        text = '\0'.join(value_list)
+        if text.count('\0') == len(value_list) - 1:
+            return b's', text.encode('utf-8')
+
+    return b'p', pickle.dumps(list(value_list), pickle.HIGHEST_PROTOCOL)
+
+
+def decode_column(encoding: bytes, data: memoryview, byteswap: bool):
+    if encoding in (b'q', b'd'):
+        column = array(encoding.decode())
+        column.frombytes(data)
+        if byteswap:
+            column.byteswap()
+        return column
+    if encoding == b's':
+        return str(data, 'utf-8').split('\0')
+    return pickle.loads(data)
+
+
+def write_snapshot(path: str, column_map: dict, last_seq: int):
+    # written next to the old snapshot and renamed over it, so a crash
+    # leaves either the old or the new snapshot
+    row_count = len(next(iter(column_map.values()))) if column_map else 0
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, sys.byteorder == 'little',
+                                     last_seq, len(column_map), row_count))
+        for name, value_list in column_map.items():
+            encoding, data = encode_column(value_list)
+            name_bytes = name.encode('utf-8')
+            f.write(COLUMN_HEADER.pack(len(name_bytes), encoding, len(data)))
+            f.write(name_bytes)
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def read_snapshot(path: str) -> tuple:
+    # returns (column map, last seq), the file is memory mapped and every
+    # column is decoded straight from the mapping
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                magic, little_endian, last_seq, column_count, row_count = \
+                    SNAPSHOT_HEADER.unpack_from(view, 0)
+                if magic != SNAPSHOT_MAGIC:
+                    raise ValueError(f'{path} is not a memdb snapshot')
+                byteswap = little_endian != (sys.byteorder == 'little')
+
+                column_map = {}
+                offset = SNAPSHOT_HEADER.size
+                for _ in range(column_count):
+                    name_length, encoding, data_length = COLUMN_HEADER.unpack_from(view, offset)
+                    offset += COLUMN_HEADER.size
+                    name = str(view[offset:offset + name_length], 'utf-8')
+                    offset += name_length
+                    column_map[name] = decode_column(
+                        encoding, view[offset:offset + data_length], byteswap)
+                    offset += data_length
+            finally:
+                view.release()
+
+    return column_map, last_seq
+
+
+def read_wal(path: str) -> tuple:
+    # returns ([(seq, op, payload), ...], valid length); reading stops at the
+    # first torn or corrupt record, everything after it is dropped
+    record_list = []
+    if not os.path.exists(path):
+        return record_list, 0
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    offset = 0
+    while offset + WAL_RECORD_HEADER.size <= len(data):
+        seq, length, crc = WAL_RECORD_HEADER.unpack_from(data, offset)
+        start = offset + WAL_RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            break
+        op, value = pickle.loads(payload)
+        record_list.append((seq, op, value))
+        offset = start + length
+
+    return record_list, offset
+
+
+class WriteAheadLog:
+    # appended records are buffered and written with one write() per group
+    # (group commit); fsync_policy decides when the file is fsynced:
+    #   always   - every append is written and fsynced before it returns
+    #   interval - a flusher thread writes and fsyncs every fsync_interval
+    #   never    - the flusher thread writes, the OS decides when to sync
+    # a full group (group_commit_size records) is written right away
+    def __init__(self, path: str, next_seq: int = 1, fsync_policy: str = FSYNC_INTERVAL,
+                 fsync_interval: float = 1.0, group_commit_size: int = 64) -> None:
+        if fsync_policy not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError(f'unknown fsync policy {fsync_policy}')
+
+        self.path = path
+        self.lock = threading.RLock()
+        self.next_seq = next_seq
+        self.__fsync_policy = fsync_policy
+        self.__fsync_interval = fsync_interval
+        self.__group_commit_size = group_commit_size
+        self.__file = open(path, 'ab')
+        self.__buffer = bytearray()
+        self.__buffer_count = 0
+        self.__unsynced = False
+        self.__stop = threading.Event()
+        self.__flusher = None
+        if fsync_policy != FSYNC_ALWAYS:
+            self.__flusher = threading.Thread(target=self.__flush_loop, daemon=True)
+            self.__flusher.start()
+
+    def __flush_loop(self):
+        while not self.__stop.wait(self.__fsync_interval):
+            self.flush(fsync=self.__fsync_policy == FSYNC_INTERVAL)
+
+    def append(self, op: str, payload):
+        data = pickle.dumps((op, payload), pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.__buffer += WAL_RECORD_HEADER.pack(self.next_seq, len(data), zlib.crc32(data))
+            self.__buffer += data
+            self.next_seq += 1
+            self.__buffer_count += 1
+            if self.__fsync_policy == FSYNC_ALWAYS or self.__buffer_count >= self.__group_commit_size:
+                self.flush()
+
+    def flush(self, fsync: bool = None):
+        # fsync=None follows the policy
+        with self.lock:
+            if self.__buffer_count:
+                self.__file.write(self.__buffer)
+                self.__file.flush()
+                self.__buffer = bytearray()
+                self.__buffer_count = 0
+                self.__unsynced = True
+
+            if fsync == None:
+                fsync = self.__fsync_policy == FSYNC_ALWAYS
+            if fsync and self.__unsynced:
+                os.fsync(self.__file.fileno())
+                self.__unsynced = False
+
+    def commit(self):
+        # everything appended so far is on disk when this returns
+        self.flush(fsync=True)
+
+    def size(self) -> int:
+        with self.lock:
+            return self.__file.tell() + len(self.__buffer)
+
+    def truncate(self):
+        with self.lock:
+            self.__buffer = bytearray()
+            self.__buffer_count = 0
+            self.__file.truncate(0)
+            self.__file.seek(0)
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__unsynced = False
+
+    def close(self):
+        self.__stop.set()
+        if self.__flusher != None:
+            self.__flusher.join()
+        with self.lock:
+            self.flush(fsync=self.__fsync_policy != FSYNC_NEVER)
+            self.__file.close()
+
+
+class Persist:
+    # durable Table: a snapshot plus a write-ahead log in directory.
+    # Opening recovers the table (snapshot, then the log records written
+    # after it) and attaches the log, so every later change is logged.
+    # checkpoint() writes a new snapshot and truncates the log; it runs in
+    # the background every checkpoint_interval seconds and/or once the log
+    # grows past checkpoint_wal_size bytes when those are given
+    def __init__(self, table, directory: str, fsync_policy: str = FSYNC_INTERVAL,
+                 fsync_interval: float = 1.0, group_commit_size: int = 64,
+                 checkpoint_interval: float = None, checkpoint_wal_size: int = None) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.__table = table
+        self.__snapshot_path = os.path.join(directory, SNAPSHOT_FILE_NAME)
+        self.__wal_path = os.path.join(directory, WAL_FILE_NAME)
+
+        last_seq = self.__recover()
+        self.wal = WriteAheadLog(self.__wal_path, last_seq + 1, fsync_policy,
+                                 fsync_interval, group_commit_size)
+        table.attachWal(self.wal)
+
+        self.__checkpoint_interval = checkpoint_interval
+        self.__checkpoint_wal_size = checkpoint_wal_size
+        self.__stop = threading.Event()
+        self.__checkpointer = None
+        if checkpoint_interval != None or checkpoint_wal_size != None:
+            self.__checkpointer = threading.Thread(target=self.__checkpoint_loop, daemon=True)
+            self.__checkpointer.start()
+
+    def __recover(self) -> int:
+        # returns the last seq applied
+        last_seq = 0
+        self.recovered_count = 0
+        if os.path.exists(self.__snapshot_path):
+            column_map, last_seq = read_snapshot(self.__snapshot_path)
+            name_list = list(column_map)
+            if set(name_list) != set(x.name for x in self.__table.getMemberList()):
+                raise ValueError(f'{self.__snapshot_path} columns {name_list} do not match the table')
+            self.__table.load(dict(zip(name_list, value_list))
+                              for value_list in zip(*column_map.values()))
+
+        record_list, valid_length = read_wal(self.__wal_path)
+        if os.path.exists(self.__wal_path) and valid_length < os.path.getsize(self.__wal_path):
+            with open(self.__wal_path, 'r+b') as f:
+                f.truncate(valid_length)
+
+        # records up to the snapshot seq are already in the snapshot (a
+        # crash between writing the snapshot and truncating the log)
+        record_list = [x for x in record_list if x[0] > last_seq]
+        insert_list = []
+        for seq, op, payload in record_list:
+            # runs of single inserts are replayed as one bulk insert
+            if op == "insert":
+                insert_list.append(payload)
+                continue
+            if insert_list:
+                self.__table.insert_many(insert_list)
+                insert_list = []
+
+            if op == "update":
+                self.__table.update(**payload)
+            elif op == "delete":
+                self.__table.delete(**payload)
+            elif op == "insert_many":
+                self.__table.insert_many(payload)
+            elif op == "load":
+                self.__table.load(payload)
+            elif op == "batch":
+                self.__table.applyBatch(payload)
+        if insert_list:
+            self.__table.insert_many(insert_list)
+
+        self.recovered_count = len(record_list)
+        if record_list:
+            last_seq = record_list[-1][0]
+        return last_seq
+
+    def __checkpoint_loop(self):
+        last_time = time.monotonic()
+        while not self.__stop.wait(min(self.__checkpoint_interval or 1.0, 1.0)):
+            now = time.monotonic()
+            due = self.__checkpoint_interval != None and now - last_time >= self.__checkpoint_interval
+            if self.__checkpoint_wal_size != None and self.wal.size() >= self.__checkpoint_wal_size:
+                due = True
+            if due:
+                self.checkpoint()
+                last_time = now
+
+    def checkpoint(self):
+        # the log lock keeps the table from changing until the log is
+        # truncated, every record so far is in the new snapshot
+        with self.wal.lock:
+            write_snapshot(self.__snapshot_path, self.__table.getColumns(), self.wal.next_seq - 1)
+            self.wal.truncate()
+
+    def close(self):
+        self.__stop.set()
+        if self.__checkpointer != None:
+            self.__checkpointer.join()
+        self.__table.detachWal()
+        self.wal.close()
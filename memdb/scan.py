@@ -0,0 +1,340 @@
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# where is None (every row), a condition (column, op, value), a list of
+# where (all of them), or ('and', [where, ...]), ('or', [where, ...]),
+# ('not', where); e.g.
+#   [('port_no', '>', 1000), ('dpid', 'in', {1, 3})]
+OPERATOR_MAP = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+SET_OPERATOR_LIST = ['in', 'not in']
+
+AGGREGATE_OP_LIST = ['count', 'sum', 'min', 'max']
+
+NUMPY_DTYPE_MAP = {
+    'q': 'int64',
+    'd': 'float64',
+}
+
+
+NUMBER_TYPE_LIST = [int, float]
+
+
+def to_typed(value, value_type: type):
+    # value as value_type, ValueError when a number would change on the
+    # way (5.5 or inf for an int column, 2 ** 53 + 1 for a float one)
+    if value is None or type(value) is value_type:
+        return value
+    try:
+        typed = value_type(value)
+    except OverflowError:
+        raise ValueError(f'{value!r} does not fit {value_type.__name__}')
+    if type(value) in NUMBER_TYPE_LIST and value_type in NUMBER_TYPE_LIST and typed != value:
+        raise ValueError(f'{value!r} is not exactly {value_type.__name__}')
+    return typed
+
+
+def to_compared(value, value_type: type):
+    # a number the column type cannot hold exactly is compared as it is,
+    # port_no < 5.5 keeps port_no 5
+    try:
+        return to_typed(value, value_type)
+    except ValueError:
+        if type(value) in NUMBER_TYPE_LIST and value_type in NUMBER_TYPE_LIST:
+            return value
+        raise
+
+
+def normalize(where, type_map: dict) -> tuple:
+    # where as nested tuples with the values converted to the column
+    # types (see to_compared), None when it names an unknown column or op
+    # or a value cannot be converted; ('and', []) matches every row
+    if where is None:
+        return ('and', [])
+    if type(where) is list:
+        where = ('and', where)
+    if type(where) is not tuple:
+        return None
+
+    if len(where) == 2 and where[0] in ('and', 'or'):
+        child_list = [normalize(x, type_map) for x in where[1]]
+        if None in child_list:
+            return None
+        return (where[0], child_list)
+    if len(where) == 2 and where[0] == 'not':
+        child = normalize(where[1], type_map)
+        return None if child == None else ('not', child)
+    if len(where) != 3:
+        return None
+
+    column, op, value = where
+    value_type = type_map.get(column)
+    if value_type is None or (op not in OPERATOR_MAP and op not in SET_OPERATOR_LIST):
+        return None
+    try:
+        if op in SET_OPERATOR_LIST:
+            value = frozenset([to_compared(x, value_type) for x in value])
+        else:
+            value = to_compared(value, value_type)
+    except (TypeError, ValueError):
+        return None
+    return ('cond', column, op, value)
+
+
+def compare(op: str, x, value) -> bool:
+    if op == 'in':
+        return x in value
+    if op == 'not in':
+        return x not in value
+    if x is None or value is None:
+        return (op == '==' and x is value) or (op == '!=' and x is not value)
+    return OPERATOR_MAP[op](x, value)
+
+
+def predicate_expression(node: tuple, const_map: dict) -> str:
+    kind = node[0]
+    if kind in ('and', 'or'):
+        if len(node[1]) == 0:
+            return 'True' if kind == 'and' else 'False'
+        return '(' + f' {kind} '.join([predicate_expression(x, const_map) for x in node[1]]) + ')'
+    if kind == 'not':
+        return f'(not {predicate_expression(node[1], const_map)})'
+
+    kind, column, op, value = node
+    name = f'c{len(const_map)}'
+    const_map[name] = value
+    x = f'key_value[{column!r}]'
+    if op in SET_OPERATOR_LIST or op in ('==', '!='):
+        return f'({x} {op} {name})'
+    if value is None:
+        return 'False'
+    # None is never ordered against a value
+    return f'({x} is not None and {x} {op} {name})'
+
+
+# row filters over the rows of a RowStore (Data list) or of any store
+# (row ids and a key_value function), the predicate inlined in the loop
+ROW_FILTER_MAP = {
+    'data': '[data.row_id for data in source if data is not None'
+            ' for key_value in (data.key_value,) if {expression}]',
+    'row_id': '[row_id for row_id in source for key_value in (get_key_value(row_id),) if {expression}]',
+}
+
+
+def make_predicate(node: tuple):
+    # builds predicate(key_value) -> bool as one expression, like
+    # make_validator
+    const_map = {}
+    expression = predicate_expression(node, const_map)
+    exec(f'def predicate(key_value):\n    return {expression}', const_map)
+    return const_map['predicate']
+
+
+def make_row_filter(node: tuple, source_kind: str):
+    # builds match(source, get_key_value) -> row ids of the matching rows
+    const_map = {}
+    expression = predicate_expression(node, const_map)
+    body = ROW_FILTER_MAP[source_kind].replace('{expression}', expression)
+    exec(f'def match(source, get_key_value):\n    return {body}', const_map)
+    return const_map['match']
+
+
+def can_vectorize(store) -> bool:
+    # only column stores hold their data in arrays numpy can use in place
+    return numpy != None and hasattr(store, 'column_map')
+
+
+def numpy_column(store, name: str):
+    # int/float columns (arrays or memoryviews) are read in place (no
+    # copy), the rest becomes an object array; the views must be dropped
+    # before the store grows
+    column = store.column_map[name]
+    typecode = getattr(column, 'typecode', None) or getattr(column, 'format', None)
+    if typecode in NUMPY_DTYPE_MAP:
+        return numpy.frombuffer(column, dtype=NUMPY_DTYPE_MAP[typecode])
+    data = numpy.empty(len(column), dtype=object)
+    data[:] = column if type(column) is list else list(column)
+    return data
+
+
+def numpy_mask(node: tuple, store, slot_count: int):
+    kind = node[0]
+    if kind in ('and', 'or'):
+        mask = numpy.full(slot_count, kind == 'and', dtype=bool)
+        for child in node[1]:
+            if kind == 'and':
+                mask &= numpy_mask(child, store, slot_count)
+            else:
+                mask |= numpy_mask(child, store, slot_count)
+        return mask
+    if kind == 'not':
+        return ~numpy_mask(node[1], store, slot_count)
+
+    kind, column, op, value = node
+    data = numpy_column(store, column)
+    if data.dtype == object:
+        # python objects, compared one by one but without building rows
+        return numpy.fromiter((compare(op, x, value) for x in data), dtype=bool, count=slot_count)
+
+    # numeric columns never hold None
+    if op in SET_OPERATOR_LIST:
+        value_list = [x for x in value if x is not None]
+        mask = numpy.isin(data, value_list) if value_list else numpy.zeros(slot_count, dtype=bool)
+        return mask if op == 'in' else ~mask
+    if value is None:
+        return numpy.full(slot_count, op == '!=', dtype=bool)
+    return OPERATOR_MAP[op](data, value)
+
+
+def to_python(value):
+    if numpy != None and isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+
+def fold(op: str, acc, value):
+    if op == 'count':
+        return acc + 1
+    if acc is None:
+        return value
+    if op == 'sum':
+        return acc + value
+    if op == 'min':
+        return value if value < acc else acc
+    return value if value > acc else acc
+
+
+def python_row_ids(store, node: tuple) -> list:
+    if type(getattr(store, 'data', None)) is list:
+        return make_row_filter(node, 'data')(store.data, None)
+    return make_row_filter(node, 'row_id')(store.iter_row_ids(), store.key_value)
+
+
+def python_aggregate(store, op: str, column: str, node: tuple, group_by: str):
+    # None values are skipped, count without a column counts rows
+    predicate = make_predicate(node)
+    empty = 0 if op in ('count', 'sum') else None
+    result = empty
+    group_map = {}
+    store_key_value = store.key_value
+    for row_id in store.iter_row_ids():
+        key_value = store_key_value(row_id)
+        if not predicate(key_value):
+            continue
+        value = None if column == None else key_value[column]
+        if value is None and column != None:
+            continue
+
+        if group_by == None:
+            result = fold(op, result, value)
+        else:
+            group = key_value[group_by]
+            group_map[group] = fold(op, group_map.get(group, empty), value)
+    return result if group_by == None else group_map
+
+
+def scan_row_ids(store, node: tuple) -> list:
+    if not can_vectorize(store) or store.slot_count() == 0:
+        return python_row_ids(store, node)
+
+    slot_count = store.slot_count()
+    mask = numpy_mask(node, store, slot_count)
+    mask &= numpy.frombuffer(store.alive, dtype=bool)
+    return numpy.flatnonzero(mask).tolist()
+
+
+def aggregate_rows(store, op: str, column: str, node: tuple, group_by: str):
+    if not can_vectorize(store) or store.slot_count() == 0:
+        return python_aggregate(store, op, column, node, group_by)
+
+    slot_count = store.slot_count()
+    mask = numpy_mask(node, store, slot_count)
+    mask &= numpy.frombuffer(store.alive, dtype=bool)
+    if column == None:
+        if group_by == None:
+            return int(numpy.count_nonzero(mask))
+        value_array = None
+    else:
+        value_array = numpy_column(store, column)
+        if value_array.dtype == object:
+            # None is only possible in object columns, aggregates skip it
+            mask &= numpy.fromiter((x is not None for x in value_array), dtype=bool, count=slot_count)
+        value_array = value_array[mask]
+        if op == 'sum':
+            value_array = sum_safe(value_array)
+
+    if group_by == None:
+        if op == 'count':
+            return len(value_array)
+        if len(value_array) == 0:
+            return 0 if op == 'sum' else None
+        if value_array.dtype == object:
+            return python_fold(op, value_array)
+        return to_python(getattr(value_array, op)())
+
+    group_array = numpy_column(store, group_by)[mask]
+    if group_array.dtype == object or (value_array is not None and value_array.dtype == object):
+        return python_group(op, group_array, value_array)
+
+    key_array, inverse = numpy.unique(group_array, return_inverse=True)
+    if op == 'count':
+        result_array = numpy.bincount(inverse, minlength=len(key_array))
+    elif op == 'sum':
+        result_array = numpy.zeros(len(key_array), dtype=value_array.dtype)
+        numpy.add.at(result_array, inverse, value_array)
+    else:
+        # every group has a value, so starting from the identity of the
+        # op (the dtype's max for min) never shows through
+        ufunc = numpy.minimum if op == 'min' else numpy.maximum
+        result_array = numpy.full(len(key_array), reduce_identity(op, value_array.dtype),
+                                  dtype=value_array.dtype)
+        ufunc.at(result_array, inverse, value_array)
+    return dict(zip(key_array.tolist(), result_array.tolist()))
+
+
+def sum_safe(value_array):
+    # integer sums wrap around silently in numpy; an array whose sum could
+    # leave its dtype is summed as python ints (object) instead
+    if value_array.dtype.kind not in 'iu' or len(value_array) == 0:
+        return value_array
+    bound = max(-int(value_array.min()), int(value_array.max())) * len(value_array)
+    if bound <= numpy.iinfo(value_array.dtype).max:
+        return value_array
+    return value_array.astype(object)
+
+
+def reduce_identity(op: str, dtype):
+    if numpy.issubdtype(dtype, numpy.floating):
+        return numpy.inf if op == 'min' else -numpy.inf
+    info = numpy.iinfo(dtype)
+    return info.max if op == 'min' else info.min
+
+
+def python_fold(op: str, value_list) -> object:
+    result = 0 if op == 'sum' else None
+    for value in value_list:
+        result = fold(op, result, value)
+    return result
+
+
+def python_group(op: str, group_array, value_array) -> dict:
+    empty = 0 if op in ('count', 'sum') else None
+    group_map = {}
+    if value_array is None:
+        for group in group_array.tolist():
+            group_map[group] = group_map.get(group, 0) + 1
+        return group_map
+
+    for group, value in zip(group_array.tolist(), value_array.tolist()):
+        group_map[group] = fold(op, group_map.get(group, empty), value)
+    return group_map
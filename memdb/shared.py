@@ -0,0 +1,685 @@
+import atexit
+import os
+import pickle
+import struct
+import threading
+import time
+import weakref
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from multiprocessing import resource_tracker, shared_memory
+from typing import List
+
+from memdb import Data, Field, Table, make_key_getter
+from scan import AGGREGATE_OP_LIST, aggregate_rows, normalize, scan_row_ids, to_typed
+
+# directory segment: header, the pickled schema, then the segment name of
+# every partition; the seq is odd while the writer changes the names
+DIRECTORY_HEADER = struct.Struct('<QQQQ')  # seq, partition count, schema length, writer tracker pid
+DIRECTORY_SEQ = struct.Struct('<Q')
+DIRECTORY_ENTRY = struct.Struct('<64s')  # segment name
+# partition segment: header, the pickled layout, then the column and index
+# data at 8 byte aligned offsets
+SEGMENT_HEADER = struct.Struct('<QQ')  # layout length, row count
+
+# reads retried when publishes unlinked a segment before it was mapped
+SHARED_RETRY_COUNT = 16
+
+# (table name, partition) -> SharedPartition mapped by the pool workers of
+# this process; every SharedTableReader maps into a cache of its own, a
+# reader swapping in a newer publish closes only the mapping it held
+partition_cache = {}
+
+
+def tracker_pid() -> int:
+    # pid of the resource tracker of this process, 0 before it runs
+    return getattr(resource_tracker._resource_tracker, '_pid', None) or 0
+
+
+def create_segment(name: str, size: int) -> shared_memory.SharedMemory:
+    return shared_memory.SharedMemory(name, create=True, size=max(size, 1))
+
+
+def open_segment(name: str) -> tuple:
+    # (segment, tracked); before python 3.13 attaching registers the segment
+    # with the resource tracker, which would unlink it under the writer once
+    # this process exits
+    try:
+        return shared_memory.SharedMemory(name, track=False), False
+    except TypeError:
+        return shared_memory.SharedMemory(name), True
+
+
+def untrack(segment: shared_memory.SharedMemory, writer_tracker: int):
+    # a process forked from the writer shares its tracker, whose
+    # registration the writer drops itself on unlink
+    if tracker_pid() != writer_tracker:
+        resource_tracker.unregister(segment._name, 'shared_memory')
+
+
+def attach_segment(name: str, writer_tracker: int) -> shared_memory.SharedMemory:
+    segment, tracked = open_segment(name)
+    if tracked:
+        untrack(segment, writer_tracker)
+    return segment
+
+
+def unlink_segment(segment: shared_memory.SharedMemory):
+    # processes that mapped it keep reading it, the last unmap frees it
+    segment.close()
+    segment.unlink()
+
+
+def align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def sort_key(value_key: tuple) -> tuple:
+    # None sorts after every value instead of failing to compare
+    return tuple([(x is None, x) for x in value_key])
+
+
+def partition_index(key_value: dict, partition_key_set: tuple, type_map: dict, partition_count: int) -> int:
+    # a hash stable across processes (str hashes are salted per process);
+    # None when key_value lacks a partition column or a value does not
+    # convert
+    value_key = []
+    for name in partition_key_set:
+        if name not in key_value:
+            return None
+        try:
+            value_key.append(to_typed(key_value[name], type_map[name]))
+        except (TypeError, ValueError):
+            return None
+    return zlib.crc32(repr(tuple(value_key)).encode()) % partition_count
+
+
+def encode_partition(column_map: dict, key_set_list: list) -> tuple:
+    # ([(offset, data), ...], segment size). int/float arrays go
+    # in as they are and str columns as the end offsets of the values plus
+    # their utf-8 text, both read in place; any other column (one holding
+    # None included) is pickled. Every key set gets the row positions in key
+    # order, readers binary search it instead of building an index
+    row_count = len(next(iter(column_map.values()))) if column_map else 0
+    offset = 0
+    chunk_list = []
+
+    def add(data) -> int:
+        nonlocal offset
+        chunk_list.append((offset, data))
+        start = offset
+        offset = align(offset + len(data))
+        return start
+
+    column_layout = {}
+    for name, column in column_map.items():
+        if type(column) is array and column.typecode in ('q', 'd'):
+            column_layout[name] = (column.typecode, add(column.tobytes()), len(column) * column.itemsize)
+        elif set(map(type, column)) <= {str}:
+            encoded_list = [x.encode('utf-8') for x in column]
+            end_offset = add(array('q', accumulate(map(len, encoded_list))).tobytes())
+            column_layout[name] = ('s', end_offset, add(b''.join(encoded_list)))
+        else:
+            data = pickle.dumps(list(column), pickle.HIGHEST_PROTOCOL)
+            column_layout[name] = ('p', add(data), len(data))
+
+    index_layout = {}
+    for key_set in key_set_list:
+        key_list = [sort_key(x) for x in zip(*[column_map[name] for name in key_set])]
+        try:
+            order = sorted(range(row_count), key=key_list.__getitem__)
+        except TypeError:
+            # values of mixed types, lookups over this key set scan instead
+            continue
+        index_layout[key_set] = add(array('q', order).tobytes())
+
+    layout = pickle.dumps({"column": column_layout, "index": index_layout}, pickle.HIGHEST_PROTOCOL)
+    base = align(SEGMENT_HEADER.size + len(layout))
+    header = SEGMENT_HEADER.pack(len(layout), row_count) + layout
+    return [(0, header)] + [(base + x, data) for x, data in chunk_list], base + offset
+
+
+class StrColumn:
+    # a str column read in place: value i is the utf-8 text between the end
+    # offsets of values i - 1 and i. The first scan over the whole column
+    # decodes it and the values are kept, once per process
+    def __init__(self, end, text) -> None:
+        self.end = end
+        self.text = text
+        self.value_list = None
+
+    def __len__(self) -> int:
+        return len(self.end)
+
+    def __getitem__(self, i: int) -> str:
+        if self.value_list != None:
+            return self.value_list[i]
+        start = self.end[i - 1] if i else 0
+        return str(self.text[start:self.end[i]], 'utf-8')
+
+    def __iter__(self):
+        if self.value_list == None:
+            self.value_list = self.__decode()
+        return iter(self.value_list)
+
+    def __decode(self) -> list:
+        end_list = self.end.tolist()
+        text = str(self.text, 'utf-8')
+        if len(text) != len(self.text):
+            # multibyte characters, the byte offsets are no str offsets
+            text = self.text.tobytes()
+            return [str(text[start:end], 'utf-8') for start, end in zip([0] + end_list, end_list)]
+        return [text[start:end] for start, end in zip([0] + end_list, end_list)]
+
+
+class SharedPartition:
+    # a published partition mapped read only, shaped like a ColumnStore
+    # (column_map, alive, key_value, ...) so scan.py runs on it as it is
+    def __init__(self, segment_name: str, writer_tracker: int) -> None:
+        self.segment_name = segment_name
+        self.__segment = attach_segment(segment_name, writer_tracker)
+        buf = self.__segment.buf
+        layout_length, row_count = SEGMENT_HEADER.unpack_from(buf)
+        layout = pickle.loads(buf[SEGMENT_HEADER.size:SEGMENT_HEADER.size + layout_length])
+        base = align(SEGMENT_HEADER.size + layout_length)
+        self.row_count = row_count
+        # views into the segment, released before it is closed
+        self.__view_list = []
+
+        self.column_map = {}
+        for name, (encoding, offset, length) in layout["column"].items():
+            if encoding in ('q', 'd'):
+                self.column_map[name] = self.__view(base + offset, length, encoding)
+            elif encoding == 's':
+                # length is the offset of the text here
+                end = self.__view(base + offset, row_count * 8, 'q')
+                text_length = end[row_count - 1] if row_count else 0
+                self.column_map[name] = StrColumn(end, self.__view(base + length, text_length, 'B'))
+            else:
+                self.column_map[name] = pickle.loads(buf[base + offset:base + offset + length])
+        self.column_item_list = list(self.column_map.items())
+        self.__order_map = {key_set: self.__view(base + offset, row_count * 8, 'q')
+                            for key_set, offset in layout["index"].items()}
+        self.alive = b'\x01' * row_count
+
+    def __view(self, offset: int, length: int, typecode: str) -> memoryview:
+        view = self.__segment.buf[offset:offset + length].cast(typecode)
+        self.__view_list.append(view)
+        return view
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def slot_count(self) -> int:
+        return self.row_count
+
+    def iter_row_ids(self):
+        return iter(range(self.row_count))
+
+    def key_value(self, row_id: int) -> dict:
+        return {name: column[row_id] for name, column in self.column_item_list}
+
+    def key_values(self, start: int, stop: int) -> List[dict]:
+        key_value = self.key_value
+        return [key_value(row_id) for row_id in range(start, min(stop, self.row_count))]
+
+    def lookup(self, key_set: tuple, value_key: tuple) -> List[int]:
+        # row ids whose key_set values are value_key, None without an order
+        # over key_set
+        order = self.__order_map.get(key_set)
+        if order == None:
+            return None
+
+        column_list = [self.column_map[name] for name in key_set]
+        target = sort_key(value_key)
+
+        def key(i: int) -> tuple:
+            row_id = order[i]
+            return sort_key(tuple([column[row_id] for column in column_list]))
+
+        # first position not below target, then first position above it
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if key(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        start = low
+        high = len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if target < key(middle):
+                high = middle
+            else:
+                low = middle + 1
+        return order[start:low].tolist()
+
+    def close(self):
+        for view in self.__view_list:
+            view.release()
+        self.__view_list = []
+        self.column_map = {}
+        self.column_item_list = []
+        self.__order_map = {}
+        self.__segment.close()
+
+
+def open_partition(cache: dict, name: str, writer_tracker: int, index: int, segment_name: str) -> SharedPartition:
+    # the partition as published in segment_name, a newer publish replaces
+    # the mapping of the older one in cache
+    partition = cache.get((name, index))
+    if partition != None and partition.segment_name == segment_name:
+        return partition
+
+    if partition != None:
+        del cache[(name, index)]
+        partition.close()
+    partition = SharedPartition(segment_name, writer_tracker)
+    cache[(name, index)] = partition
+    return partition
+
+
+def close_partitions(cache: dict = None):
+    # every partition of cache, of the pool worker cache without one
+    cache = partition_cache if cache == None else cache
+    while cache:
+        cache.popitem()[1].close()
+
+
+# a segment still mapped at exit fails to close with views into it
+atexit.register(close_partitions)
+
+
+def partition_scan(name: str, writer_tracker: int, index: int, segment_name: str, node: tuple,
+                   cache: dict = None) -> List[int]:
+    cache = partition_cache if cache == None else cache
+    return scan_row_ids(open_partition(cache, name, writer_tracker, index, segment_name), node)
+
+
+def partition_aggregate(name: str, writer_tracker: int, index: int, segment_name: str, op: str, column: str,
+                        node: tuple, group_by: str, cache: dict = None):
+    cache = partition_cache if cache == None else cache
+    return aggregate_rows(open_partition(cache, name, writer_tracker, index, segment_name), op, column, node,
+                          group_by)
+
+
+def merge_aggregate(op: str, acc, value):
+    # combines the results of two partitions
+    if op in ('count', 'sum'):
+        return acc + value
+    if acc is None:
+        return value
+    if value is None:
+        return acc
+    if op == 'min':
+        return value if value < acc else acc
+    return value if value > acc else acc
+
+
+class SharedTable:
+    # the writer of a table whose partitions live in shared memory for
+    # readers in other processes, see SharedTableReader. Rows are split into
+    # partition_count compact Tables by a hash of partition_key_set, a part
+    # of the unique key set (all of it by default). publish() copies the
+    # partitions changed since the last publish into new segments and
+    # switches the directory segment (name) over to them; readers see
+    # nothing of a change before. With publish_interval it also runs in the
+    # background every publish_interval seconds
+    def __init__(self, name: str, member_list: List[Field], key_set_list: List[list],
+                 partition_key_set: list = None, partition_count: int = 8,
+                 publish_interval: float = None) -> None:
+        unique_key_set = tuple(key_set_list[0])
+        partition_key_set = unique_key_set if partition_key_set == None else tuple(partition_key_set)
+        if not set(partition_key_set) <= set(unique_key_set):
+            raise ValueError(f'partition key set {partition_key_set} is not part of the unique key set {unique_key_set}')
+
+        self.name = name
+        self.__member_type_map = {x.name: x.type for x in member_list}
+        self.__key_set_list = []
+        for key_set in key_set_list:
+            if tuple(key_set) not in self.__key_set_list:
+                self.__key_set_list.append(tuple(key_set))
+        self.__partition_key_set = partition_key_set
+        self.__partition_count = partition_count
+        self.__table_list = [Table(member_list, key_set_list, compact=True, concurrent=True)
+                             for _ in range(partition_count)]
+        # partitions changed since the last publish
+        self.__dirty_set = set(range(partition_count))
+        self.__dirty_lock = threading.Lock()
+        self.__publish_lock = threading.Lock()
+        self.__segment_list = [None] * partition_count
+        # segments replaced by the last publish, unlinked by the next one so
+        # a reader that just read their names still gets to map them
+        self.__retired_list = []
+        self.__generation = 0
+
+        schema = pickle.dumps({
+            "member_list": [(x.name, x.type) for x in member_list],
+            "key_set_list": self.__key_set_list,
+            "partition_key_set": partition_key_set,
+        }, pickle.HIGHEST_PROTOCOL)
+        self.__entry_offset = align(DIRECTORY_HEADER.size + len(schema))
+        self.__directory = create_segment(name, self.__entry_offset + DIRECTORY_ENTRY.size * partition_count)
+        DIRECTORY_HEADER.pack_into(self.__directory.buf, 0, 0, partition_count, len(schema), tracker_pid())
+        self.__directory.buf[DIRECTORY_HEADER.size:DIRECTORY_HEADER.size + len(schema)] = schema
+        self.publish()
+
+        self.__stop = threading.Event()
+        self.__publisher = None
+        if publish_interval != None:
+            self.__publisher = threading.Thread(target=self.__publish_loop, args=(publish_interval,), daemon=True)
+            self.__publisher.start()
+
+    def __partition_index(self, key_value: dict) -> int:
+        return partition_index(key_value, self.__partition_key_set, self.__member_type_map, self.__partition_count)
+
+    def __changed(self, index: int):
+        with self.__dirty_lock:
+            self.__dirty_set.add(index)
+
+    def getPartitionCount(self) -> int:
+        return self.__partition_count
+
+    def getPartition(self, index: int) -> Table:
+        return self.__table_list[index]
+
+    def insert(self, *args, **kwargs) -> bool:
+        index = self.__partition_index(kwargs)
+        if index == None:
+            return False
+
+        ret = self.__table_list[index].insert(**kwargs)
+        if ret:
+            self.__changed(index)
+        return ret
+
+    def insert_many(self, row_list) -> List[dict]:
+        # the rejected rows, as Table.insert_many
+        rejected_list = []
+        row_list_map = {}
+        for row in row_list:
+            index = self.__partition_index(row)
+            if index == None:
+                rejected_list.append(row)
+            else:
+                row_list_map.setdefault(index, []).append(row)
+
+        for index, partition_row_list in row_list_map.items():
+            partition_rejected_list = self.__table_list[index].insert_many(partition_row_list)
+            if len(partition_rejected_list) < len(partition_row_list):
+                self.__changed(index)
+            rejected_list.extend(partition_rejected_list)
+        return rejected_list
+
+    def update(self, *args, **kwargs) -> bool:
+        index = self.__partition_index(kwargs)
+        if index == None:
+            return False
+
+        ret = self.__table_list[index].update(**kwargs)
+        if ret:
+            self.__changed(index)
+        return ret
+
+    def delete(self, *args, **kwargs) -> bool:
+        # without the partition key every partition deletes its matches
+        index = self.__partition_index(kwargs)
+        index_list = range(self.__partition_count) if index == None else [index]
+        ret = False
+        for index in index_list:
+            if self.__table_list[index].delete(**kwargs):
+                self.__changed(index)
+                ret = True
+        return ret
+
+    def get(self, *args, **kwargs) -> List[Data]:
+        index = self.__partition_index(kwargs)
+        if index != None:
+            return self.__table_list[index].get(**kwargs)
+
+        data_list = []
+        for table in self.__table_list:
+            data_list.extend(table.get(**kwargs))
+        return data_list
+
+    def getAll(self) -> List[Data]:
+        data_list = []
+        for table in self.__table_list:
+            data_list.extend(table.getAll())
+        return data_list
+
+    def publish(self) -> int:
+        # the number of partitions published
+        with self.__publish_lock:
+            with self.__dirty_lock:
+                dirty_set = self.__dirty_set
+                self.__dirty_set = set()
+            if not dirty_set:
+                return 0
+
+            self.__generation += 1
+            segment_map = {index: self.__write_segment(index) for index in sorted(dirty_set)}
+
+            buf = self.__directory.buf
+            seq = DIRECTORY_SEQ.unpack_from(buf)[0]
+            DIRECTORY_SEQ.pack_into(buf, 0, seq + 1)
+            for index, segment in segment_map.items():
+                DIRECTORY_ENTRY.pack_into(buf, self.__entry_offset + DIRECTORY_ENTRY.size * index,
+                                          segment.name.encode())
+            DIRECTORY_SEQ.pack_into(buf, 0, seq + 2)
+
+            for segment in self.__retired_list:
+                unlink_segment(segment)
+            self.__retired_list = [self.__segment_list[index] for index in segment_map
+                                   if self.__segment_list[index] != None]
+            for index, segment in segment_map.items():
+                self.__segment_list[index] = segment
+            return len(segment_map)
+
+    def __write_segment(self, index: int) -> shared_memory.SharedMemory:
+        chunk_list, size = encode_partition(self.__table_list[index].getColumns(), self.__key_set_list)
+        segment = create_segment(f'{self.name}_{index}_{self.__generation}', size)
+        buf = segment.buf
+        for offset, data in chunk_list:
+            buf[offset:offset + len(data)] = data
+        return segment
+
+    def __publish_loop(self, interval: float):
+        while not self.__stop.wait(interval):
+            self.publish()
+
+    def close(self):
+        # unlinks every segment, readers keep what they already mapped
+        self.__stop.set()
+        if self.__publisher != None:
+            self.__publisher.join()
+        with self.__publish_lock:
+            for segment in self.__segment_list + self.__retired_list:
+                if segment != None:
+                    unlink_segment(segment)
+            self.__segment_list = [None] * self.__partition_count
+            self.__retired_list = []
+            unlink_segment(self.__directory)
+
+
+class SharedTableReader:
+    # a SharedTable opened by name, from any process. Every partition is
+    # read as of the last publish, a publish may land between the
+    # partitions of one read. get/getOne binary search the key order of the
+    # best index in the partition(s) the rows can be in; scan and aggregate
+    # fan out one task per partition to a pool of process_count processes
+    # (the cpu count by default, in this process when 1). One reader per
+    # thread
+    def __init__(self, name: str, process_count: int = None) -> None:
+        self.name = name
+        self.__directory, tracked = open_segment(name)
+        buf = self.__directory.buf
+        seq, partition_count, schema_length, self.__writer_tracker = DIRECTORY_HEADER.unpack_from(buf)
+        if tracked:
+            untrack(self.__directory, self.__writer_tracker)
+        schema = pickle.loads(buf[DIRECTORY_HEADER.size:DIRECTORY_HEADER.size + schema_length])
+        self.__member_list = [Field(x, member_type) for x, member_type in schema["member_list"]]
+        self.__member_type_map = {x.name: x.type for x in self.__member_list}
+        self.__key_set_list = schema["key_set_list"]
+        self.__partition_key_set = schema["partition_key_set"]
+        self.__partition_count = partition_count
+        self.__entry_offset = align(DIRECTORY_HEADER.size + schema_length)
+        self.__process_count = os.cpu_count() if process_count == None else process_count
+        self.__pool = None
+        # the partitions this reader mapped, closed with the reader (or at
+        # exit / when it is collected without close)
+        self.__partition_cache = {}
+        self.__release = weakref.finalize(self, close_partitions, self.__partition_cache)
+
+    def getMemberList(self) -> List[Field]:
+        return list(self.__member_list)
+
+    def getPartitionCount(self) -> int:
+        return self.__partition_count
+
+    def __segment_name_list(self) -> List[str]:
+        # the directory entries of one publish, retried while the writer is
+        # switching them
+        buf = self.__directory.buf
+        entry_size = DIRECTORY_ENTRY.size
+        while True:
+            seq = DIRECTORY_SEQ.unpack_from(buf)[0]
+            if seq & 1 == 0:
+                name_list = [DIRECTORY_ENTRY.unpack_from(buf, self.__entry_offset + entry_size * index)[0]
+                             for index in range(self.__partition_count)]
+                if DIRECTORY_SEQ.unpack_from(buf)[0] == seq:
+                    return [x.rstrip(b'\0').decode() for x in name_list]
+            time.sleep(0)
+
+    def __retry(self, func, *args):
+        for _ in range(SHARED_RETRY_COUNT - 1):
+            try:
+                return func(*args)
+            except FileNotFoundError:
+                time.sleep(0)
+        return func(*args)
+
+    def __to_typed(self, key_value: dict) -> dict:
+        for name, value in key_value.items():
+            member_type = self.__member_type_map.get(name)
+            if member_type is None:
+                return None
+            try:
+                key_value[name] = to_typed(value, member_type)
+            except (TypeError, ValueError):
+                return None
+        return key_value
+
+    def get(self, *args, **kwargs) -> List[Data]:
+        key_value = self.__to_typed(dict(kwargs))
+        if key_value == None:
+            return []
+        return self.__retry(self.__get, key_value)
+
+    def getOne(self, *args, **kwargs) -> Data:
+        data_list = self.get(**kwargs)
+        return data_list[0] if data_list else None
+
+    def __get(self, key_value: dict) -> List[Data]:
+        segment_name_list = self.__segment_name_list()
+        index = partition_index(key_value, self.__partition_key_set, self.__member_type_map,
+                                self.__partition_count)
+        index_list = range(self.__partition_count) if index == None else [index]
+
+        # the index over the most of the query columns
+        name_set = frozenset(key_value)
+        key_set_list = [x for x in self.__key_set_list if name_set.issuperset(x) and x]
+        key_set = max(key_set_list, key=len) if key_set_list else None
+        value_key = None if key_set == None else make_key_getter(key_set)(key_value)
+        node = ('and', [('cond', name, '==', value) for name, value in key_value.items()])
+
+        data_list = []
+        for index in index_list:
+            partition = open_partition(self.__partition_cache, self.name, self.__writer_tracker, index,
+                                       segment_name_list[index])
+            row_id_list = None if key_set == None else partition.lookup(key_set, value_key)
+            if row_id_list == None:
+                row_id_list = scan_row_ids(partition, node)
+                data_list.extend([Data(partition.key_value(row_id)) for row_id in row_id_list])
+                continue
+
+            for row_id in row_id_list:
+                row = partition.key_value(row_id)
+                if all([row[name] == value for name, value in key_value.items()]):
+                    data_list.append(Data(row))
+        return data_list
+
+    def getAll(self) -> List[Data]:
+        return self.__retry(self.__get_all)
+
+    def __get_all(self) -> List[Data]:
+        data_list = []
+        for index, segment_name in enumerate(self.__segment_name_list()):
+            partition = open_partition(self.__partition_cache, self.name, self.__writer_tracker, index, segment_name)
+            data_list.extend([Data(x) for x in partition.key_values(0, len(partition))])
+        return data_list
+
+    def __fan_out(self, func, *args) -> tuple:
+        # func(name, writer tracker, partition, segment name, *args) of
+        # every partition, in the pool; (segment names, results)
+        segment_name_list = self.__segment_name_list()
+        arg_list = [(self.name, self.__writer_tracker, index, segment_name) + args for index, segment_name in enumerate(segment_name_list)]
+        if self.__process_count <= 1 or len(arg_list) <= 1:
+            return segment_name_list, [func(*x, cache=self.__partition_cache) for x in arg_list]
+
+        if self.__pool == None:
+            self.__pool = ProcessPoolExecutor(self.__process_count)
+        future_list = [self.__pool.submit(func, *x) for x in arg_list]
+        return segment_name_list, [x.result() for x in future_list]
+
+    def scan(self, where=None) -> List[Data]:
+        # as Table.scan; the workers send back row ids, the rows are built
+        # here from the same segments
+        node = normalize(where, self.__member_type_map)
+        if node == None:
+            return []
+        return self.__retry(self.__scan, node)
+
+    def __scan(self, node: tuple) -> List[Data]:
+        segment_name_list, row_id_list_list = self.__fan_out(partition_scan, node)
+        data_list = []
+        for index, row_id_list in enumerate(row_id_list_list):
+            key_value = open_partition(self.__partition_cache, self.name, self.__writer_tracker, index,
+                                       segment_name_list[index]).key_value
+            data_list.extend([Data(key_value(row_id)) for row_id in row_id_list])
+        return data_list
+
+    def aggregate(self, op: str, column: str = None, where=None, group_by: str = None):
+        # as Table.aggregate, merged over the partial results of the
+        # partitions
+        if op not in AGGREGATE_OP_LIST or (column == None and op != 'count'):
+            return None
+        if (column != None and column not in self.__member_type_map) or \
+                (group_by != None and group_by not in self.__member_type_map):
+            return None
+
+        node = normalize(where, self.__member_type_map)
+        if node == None:
+            return None
+        result_list = self.__retry(self.__fan_out, partition_aggregate, op, column, node, group_by)[1]
+        if group_by == None:
+            result = 0 if op in ('count', 'sum') else None
+            for value in result_list:
+                result = merge_aggregate(op, result, value)
+            return result
+
+        group_map = {}
+        for partition_group_map in result_list:
+            for group, value in partition_group_map.items():
+                group_map[group] = value if group not in group_map else merge_aggregate(op, group_map[group], value)
+        return group_map
+
+    def close(self):
+        if self.__pool != None:
+            self.__pool.shutdown()
+            self.__pool = None
+        self.__release()
+        self.__directory.close()
@@ -0,0 +1,167 @@
+from bisect import bisect_left, bisect_right, insort
+
+# chunks are split once they grow past twice this size
+CHUNK_LOAD = 512
+
+
+class Greatest:
+    # compares greater than anything else, pads a short high bound so that
+    # (2, GREATEST) sorts after every (2, x)
+    def __eq__(self, other):
+        return other is self
+
+    def __ne__(self, other):
+        return other is not self
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return other is self
+
+    def __gt__(self, other):
+        return other is not self
+
+    def __ge__(self, other):
+        return True
+
+    def __hash__(self):
+        return id(self)
+
+
+GREATEST = Greatest()
+
+
+class SortedKeyList:
+    # sorted list kept as a list of sorted chunks plus the last key of each
+    # chunk, so add/remove bisect twice and shift one chunk instead of the
+    # whole list, and a range of k keys is found in O(log n + k)
+    def __init__(self, key_list=()) -> None:
+        self.__chunk_list = []
+        self.__max_list = []
+        self.__len = 0
+        self.update(key_list)
+
+    def __len__(self) -> int:
+        return self.__len
+
+    def __iter__(self):
+        for chunk in self.__chunk_list:
+            yield from chunk
+
+    def __reversed__(self):
+        for chunk in reversed(self.__chunk_list):
+            yield from reversed(chunk)
+
+    def clear(self):
+        self.__chunk_list = []
+        self.__max_list = []
+        self.__len = 0
+
+    def update(self, key_list):
+        key_list = list(key_list)
+        if len(key_list) == 0:
+            return
+
+        # rebuild from scratch when the batch is large compared to the list
+        if len(key_list) * 4 >= self.__len:
+            key_list.extend(self)
+            key_list.sort()
+            self.__chunk_list = [key_list[i:i + CHUNK_LOAD]
+                                 for i in range(0, len(key_list), CHUNK_LOAD)]
+            self.__max_list = [chunk[-1] for chunk in self.__chunk_list]
+            self.__len = len(key_list)
+            return
+
+        for key in key_list:
+            self.add(key)
+
+    def add(self, key):
+        chunk_list = self.__chunk_list
+        max_list = self.__max_list
+        self.__len += 1
+        if len(chunk_list) == 0:
+            chunk_list.append([key])
+            max_list.append(key)
+            return
+
+        i = bisect_left(max_list, key)
+        if i == len(max_list):
+            i -= 1
+            chunk_list[i].append(key)
+            max_list[i] = key
+        else:
+            insort(chunk_list[i], key)
+
+        chunk = chunk_list[i]
+        if len(chunk) > CHUNK_LOAD * 2:
+            chunk_list.insert(i + 1, chunk[CHUNK_LOAD:])
+            del chunk[CHUNK_LOAD:]
+            max_list.insert(i, chunk[-1])
+
+    def remove(self, key):
+        chunk_list = self.__chunk_list
+        max_list = self.__max_list
+        i = bisect_left(max_list, key)
+        if i == len(max_list):
+            raise ValueError(f'{key} is not in list')
+
+        chunk = chunk_list[i]
+        j = bisect_left(chunk, key)
+        if j == len(chunk) or chunk[j] != key:
+            raise ValueError(f'{key} is not in list')
+
+        del chunk[j]
+        self.__len -= 1
+        if len(chunk) == 0:
+            del chunk_list[i]
+            del max_list[i]
+        else:
+            max_list[i] = chunk[-1]
+
+    def min(self):
+        if self.__len == 0:
+            return None
+        return self.__chunk_list[0][0]
+
+    def max(self):
+        if self.__len == 0:
+            return None
+        return self.__chunk_list[-1][-1]
+
+    def __position_left(self, key) -> tuple:
+        # (chunk, offset) of the first key >= key
+        i = bisect_left(self.__max_list, key)
+        if i == len(self.__max_list):
+            return (i, 0)
+        return (i, bisect_left(self.__chunk_list[i], key))
+
+    def __position_right(self, key) -> tuple:
+        # (chunk, offset) of the first key > key
+        i = bisect_right(self.__max_list, key)
+        if i == len(self.__max_list):
+            return (i, 0)
+        return (i, bisect_right(self.__chunk_list[i], key))
+
+    def irange(self, low=None, high=None, reverse: bool = False):
+        # keys in [low, high], None means unbounded on that side
+        chunk_list = self.__chunk_list
+        start = (0, 0) if low is None else self.__position_left(low)
+        stop = (len(chunk_list), 0) if high is None else self.__position_right(high)
+        if start >= stop:
+            return
+
+        slice_list = []
+        for i in range(start[0], min(stop[0], len(chunk_list) - 1) + 1):
+            begin = start[1] if i == start[0] else 0
+            end = stop[1] if i == stop[0] else len(chunk_list[i])
+            slice_list.append((i, begin, end))
+
+        if reverse:
+            for i, begin, end in reversed(slice_list):
+                chunk = chunk_list[i]
+                for j in range(end - 1, begin - 1, -1):
+                    yield chunk[j]
+        else:
+            for i, begin, end in slice_list:
+                yield from chunk_list[i][begin:end]
@@ -0,0 +1,172 @@
+import heapq
+import sys
+import time
+
+# latency histograms count op latencies in power of two nanosecond buckets,
+# bucket k holds latencies below 2 ** k ns
+LATENCY_BUCKET_COUNT = 36
+
+# index bucket sizes are counted in power of two buckets too, bucket k holds
+# sizes from 2 ** k to 2 ** (k + 1) - 1, the last one every larger size
+BUCKET_SIZE_BUCKET_COUNT = 24
+
+# rows measured to estimate the bytes of a store
+STATS_SAMPLE = 1024
+
+# largest buckets listed per index
+STATS_TOP_BUCKET = 3
+
+
+class OpStats:
+    # count, failures (False, None or [] back) and latency histogram per op;
+    # plain increments without a lock, concurrent ops may rarely lose one
+    def __init__(self, op_list: list) -> None:
+        # op -> [count, failures, total ns, latency histogram]
+        self.__record_map = {op: [0, 0, 0, [0] * LATENCY_BUCKET_COUNT] for op in op_list}
+
+    def call(self, op: str, func, *args):
+        start = time.perf_counter_ns()
+        ret = func(*args)
+        elapsed = time.perf_counter_ns() - start
+        record = self.__record_map[op]
+        record[0] += 1
+        record[2] += elapsed
+        record[3][min(elapsed.bit_length(), LATENCY_BUCKET_COUNT - 1)] += 1
+        if not ret:
+            record[1] += 1
+        return ret
+
+    def report(self) -> dict:
+        return {op: {
+            "count": count,
+            "fail": fail_count,
+            "seconds": elapsed / 1e9,
+            # upper bound in seconds -> ops, every bucket so the Prometheus
+            # histogram keeps the same le ladder from scrape to scrape
+            "latency": {(1 << k) / 1e9: n for k, n in enumerate(histogram)},
+        } for op, (count, fail_count, elapsed, histogram) in self.__record_map.items()}
+
+
+def sample_bytes(item_list: list, total_count: int, size_func) -> int:
+    # size_func over up to STATS_SAMPLE evenly spread items, scaled up
+    if total_count == 0 or len(item_list) == 0:
+        return 0
+    step = max(1, len(item_list) // STATS_SAMPLE)
+    sample = item_list[::step][:STATS_SAMPLE]
+    return int(sum(map(size_func, sample)) * total_count / len(sample))
+
+
+def index_stats(index: dict) -> dict:
+    # key count, bytes and bucket size distribution of an index; the bytes
+    # are the dict, the sets and the key tuples, whose values the rows share
+    size_histogram = [0] * BUCKET_SIZE_BUCKET_COUNT
+    largest_list = []
+    set_bytes = 0
+    row_count = 0
+    max_size = 0
+    for value_key, bucket in index.items():
+        if type(bucket) is int:
+            size = 1
+        else:
+            size = len(bucket)
+            set_bytes += sys.getsizeof(bucket)
+            largest_list.append((size, value_key))
+            if size > max_size:
+                max_size = size
+        row_count += size
+        # power of two buckets: 1, 2-3, 4-7, ...
+        size_histogram[min(size.bit_length() - 1, BUCKET_SIZE_BUCKET_COUNT - 1)] += 1
+
+    # key tuples of one key set are all the same size
+    key_bytes = sys.getsizeof(next(iter(index))) * len(index) if index else 0
+    return {
+        "key_count": len(index),
+        "row_count": row_count,
+        "bytes": sys.getsizeof(index) + set_bytes + key_bytes,
+        "bucket_max": max_size if max_size else min(1, len(index)),
+        "bucket_mean": row_count / len(index) if index else 0,
+        # lower bound of the bucket size -> key count, every bucket so the
+        # Prometheus histogram keeps the same le ladder from scrape to scrape
+        "bucket_histogram": {1 << k: n for k, n in enumerate(size_histogram)},
+        "largest": [[list(value_key), size]
+                    for size, value_key in heapq.nlargest(STATS_TOP_BUCKET, largest_list, key=lambda x: x[0])],
+    }
+
+
+def prometheus_label(label_map: dict) -> str:
+    return '{' + ','.join([name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+                           for name, value in label_map.items()]) + '}'
+
+
+def prometheus_text(stats: dict, table: str, prefix: str = 'memdb') -> str:
+    # stats() in the Prometheus text exposition format, every sample
+    # labelled with table
+    line_list = []
+
+    def metric(name: str, kind: str, help_text: str):
+        line_list.append(f'# HELP {prefix}_{name} {help_text}')
+        line_list.append(f'# TYPE {prefix}_{name} {kind}')
+
+    def sample(name: str, value, **label_map):
+        line_list.append(f'{prefix}_{name}{prometheus_label(dict(table=table, **label_map))} {value}')
+
+    metric('rows', 'gauge', 'Rows in the table.')
+    sample('rows', stats["row_count"])
+    metric('slots', 'gauge', 'Row slots allocated, live or free.')
+    sample('slots', stats["slot_count"])
+    metric('store_bytes', 'gauge', 'Estimated bytes of the row storage.')
+    sample('store_bytes', stats["store_bytes"])
+
+    index_map = stats["index"]
+    for name, field, help_text in (('index_keys', "key_count", 'Distinct keys per index.'),
+                                   ('index_bytes', "bytes", 'Estimated bytes per index.'),
+                                   ('index_bucket_max', "bucket_max", 'Rows in the largest bucket per index.')):
+        metric(name, 'gauge', help_text)
+        for key_set, index in index_map.items():
+            sample(name, index[field], index=key_set)
+    metric('index_bucket_size', 'histogram', 'Rows per bucket over the keys of each index.')
+    for key_set, index in index_map.items():
+        count = 0
+        for k, (bound, n) in enumerate(index["bucket_histogram"].items()):
+            count += n
+            # a bucket of size >= bound and < 2 * bound, the last bucket is
+            # open ended and only shows in +Inf
+            if k < BUCKET_SIZE_BUCKET_COUNT - 1:
+                sample('index_bucket_size_bucket', count, index=key_set, le=bound * 2 - 1)
+        sample('index_bucket_size_bucket', count, index=key_set, le='+Inf')
+        sample('index_bucket_size_sum', index["row_count"], index=key_set)
+        sample('index_bucket_size_count', count, index=key_set)
+
+    op_map = stats.get("op")
+    if op_map != None:
+        metric('op_total', 'counter', 'Operations by op.')
+        for op, op_stats in op_map.items():
+            sample('op_total', op_stats["count"], op=op)
+        metric('op_fail_total', 'counter', 'Operations that changed or found nothing, by op.')
+        for op, op_stats in op_map.items():
+            sample('op_fail_total', op_stats["fail"], op=op)
+        metric('op_seconds', 'histogram', 'Operation latency by op.')
+        for op, op_stats in op_map.items():
+            count = 0
+            for bound, n in op_stats["latency"].items():
+                count += n
+                sample('op_seconds_bucket', count, op=op, le=repr(bound))
+            sample('op_seconds_bucket', count, op=op, le='+Inf')
+            sample('op_seconds_sum', op_stats["seconds"], op=op)
+            sample('op_seconds_count', count, op=op)
+
+    cache = stats.get("cache")
+    if cache != None:
+        metric('cache_lookup_total', 'counter', 'Query cache lookups by result.')
+        for result in ("hit", "miss"):
+            sample('cache_lookup_total', cache[result], result=result)
+        metric('cache_evict_total', 'counter', 'Query cache entries evicted.')
+        sample('cache_evict_total', cache["evict"])
+
+    if stats.get("expiry_pending") != None:
+        metric('expiry_pending', 'gauge', 'Rows with a deadline.')
+        sample('expiry_pending', stats["expiry_pending"])
+        metric('expired_total', 'counter', 'Rows deleted by expiry.')
+        sample('expired_total', stats["expired_count"])
+
+    return '\n'.join(line_list) + '\n'
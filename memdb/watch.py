@@ -0,0 +1,145 @@
+import asyncio
+import threading
+from collections import deque
+
+# what a watch does once max_pending events wait for the consumer
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP = 'drop'
+
+
+def wake_future(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Watch:
+    # change events of a Table.watch, each one
+    #   {"op": "insert" | "update" | "delete", "old": dict or None, "new": dict or None}
+    # an update is delivered to the watches matching the old or the new row,
+    # so a row moving out of a filter is seen as well.
+    # Events come in batches (lists of up to batch_size events): to callback
+    # right after the change, or kept until the consumer takes them with
+    # get(), a for loop or an async for loop.
+    # Backpressure: once max_pending events wait, overflow='block' makes the
+    # writer wait until the consumer catches up (the consumer must not run
+    # on the writer thread then), overflow='drop' drops the waiting events
+    # and queues one {"op": "overflow"} event, telling the consumer to read
+    # the table again
+    def __init__(self, unwatch, callback=None, batch_size: int = 256,
+                 max_pending: int = 65536, overflow: str = OVERFLOW_BLOCK) -> None:
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP):
+            raise ValueError(f'unknown overflow policy {overflow}')
+
+        self.__unwatch = unwatch
+        self.__callback = callback
+        self.__batch_size = max(1, batch_size)
+        self.__max_pending = max(self.__batch_size, max_pending)
+        self.__overflow = overflow
+        self.__cond = threading.Condition()
+        self.__pending = deque()
+        self.__pending_count = 0
+        self.__closed = False
+        # (loop, future) of an async consumer waiting for events
+        self.__waiter = None
+        self.dropped_count = 0
+
+    def push(self, event_list: list):
+        # called by the table with the events of one change
+        batch_size = self.__batch_size
+        if self.__callback != None:
+            for i in range(0, len(event_list), batch_size):
+                self.__callback(event_list[i:i + batch_size])
+            return
+
+        with self.__cond:
+            pending = self.__pending
+            offset = 0
+            while offset < len(event_list) and not self.__closed:
+                # small changes in a burst are merged into the last batch
+                if pending and len(pending[-1]) < batch_size:
+                    batch = pending[-1]
+                else:
+                    batch = []
+                    pending.append(batch)
+                room = min(batch_size - len(batch), self.__max_pending - self.__pending_count)
+                if room <= 0:
+                    if batch == []:
+                        pending.pop()
+                    self.__overflowed()
+                    continue
+
+                batch.extend(event_list[offset:offset + room])
+                self.__pending_count += min(room, len(event_list) - offset)
+                offset += room
+                self.__wake()
+
+    def __overflowed(self):
+        if self.__overflow == OVERFLOW_BLOCK:
+            self.__cond.wait_for(
+                lambda: self.__pending_count < self.__max_pending or self.__closed)
+            return
+
+        self.dropped_count += self.__pending_count
+        self.__pending.clear()
+        self.__pending.append([{"op": "overflow", "old": None, "new": None}])
+        self.__pending_count = 1
+
+    def __wake(self):
+        self.__cond.notify_all()
+        if self.__waiter != None:
+            loop, future = self.__waiter
+            self.__waiter = None
+            loop.call_soon_threadsafe(wake_future, future)
+
+    def __pop(self) -> list:
+        batch = self.__pending.popleft()
+        self.__pending_count -= len(batch)
+        # a writer may wait for room
+        self.__cond.notify_all()
+        return batch
+
+    def get(self, timeout: float = None) -> list:
+        # the next batch, None on timeout or once the watch is closed
+        with self.__cond:
+            self.__cond.wait_for(lambda: self.__pending or self.__closed, timeout)
+            if not self.__pending:
+                return None
+            return self.__pop()
+
+    def pending(self) -> int:
+        return self.__pending_count
+
+    def __iter__(self):
+        while True:
+            batch = self.get()
+            if batch == None:
+                return
+            yield batch
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> list:
+        while True:
+            with self.__cond:
+                if self.__pending:
+                    return self.__pop()
+                if self.__closed:
+                    raise StopAsyncIteration
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self.__waiter = (loop, future)
+            await future
+
+    def close(self):
+        # no more events, a waiting consumer gets the rest and then stops
+        self.__unwatch(self)
+        with self.__cond:
+            self.__closed = True
+            self.__wake()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()